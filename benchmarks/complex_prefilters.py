@@ -0,0 +1,157 @@
+"""
+Benchmark of the complex prefilters filters against the row-wise apply versions they replaced.
+
+Runs on the bundled database with a 20000 genes x 100 cells counts matrix (the database genes and random genes to fill
+it), checks both versions return the same tables and prints the best time of 3 runs of every filter.
+
+    python benchmarks/complex_prefilters.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from cellphonedb.src.app.cpdb_app import create_app  # noqa: E402
+from cellphonedb.src.core.database import analysis_bundle  # noqa: E402
+from cellphonedb.src.core.methods import cpdb_statistical_analysis_complex_method  # noqa: E402
+from cellphonedb.src.core.models.cluster_counts import cluster_counts_filter  # noqa: E402
+from cellphonedb.src.core.models.complex import complex_helper  # noqa: E402
+
+GENES = 20000
+CELLS = 100
+REPEAT = 3
+
+
+def filter_interactions_by_genes(interactions: pd.DataFrame, genes: list, counts_data: str = 'ensembl') -> pd.DataFrame:
+    def filter_by_non_complex_element(interaction: pd.Series) -> bool:
+        if not interaction['is_complex_1']:
+            if interaction['{}_1'.format(counts_data)] in genes:
+                return True
+
+        if not interaction['is_complex_2']:
+            if interaction['{}_2'.format(counts_data)] in genes:
+                return True
+
+        return False
+
+    return interactions[interactions.apply(filter_by_non_complex_element, axis=1)]
+
+
+def filter_interactions_by_complexes(interactions: pd.DataFrame, complexes: pd.DataFrame) -> pd.DataFrame:
+    complex_ids = complexes['complex_multidata_id'].tolist()
+
+    interactions_filtered = interactions[interactions.apply(
+        lambda interaction: (interaction['multidata_1_id'] in complex_ids) or
+                            (interaction['multidata_2_id'] in complex_ids),
+        axis=1)].copy()
+
+    interactions_filtered.drop_duplicates('id_cp_interaction', inplace=True)
+
+    return interactions_filtered
+
+
+def filter_counts_by_genes(counts: pd.DataFrame, genes: list) -> pd.DataFrame:
+    return counts[counts['gene'].apply(lambda gene: gene in genes)]
+
+
+def get_involved_complex_from_protein(proteins: pd.DataFrame, complexes: pd.DataFrame,
+                                      complex_compositions: pd.DataFrame, drop_duplicates: bool = True) -> pd.DataFrame:
+    complex_counts_composition = pd.merge(complex_compositions, proteins, left_on='protein_multidata_id',
+                                          right_on='id_multidata')
+
+    if complex_counts_composition.empty:
+        return pd.DataFrame()
+
+    def all_protein_involved(complex):
+        number_proteins_in_counts = len(
+            complex_counts_composition[
+                complex_counts_composition['complex_multidata_id'] == complex['complex_multidata_id']])
+
+        if number_proteins_in_counts < complex['total_protein']:
+            return False
+
+        return True
+
+    complex_counts_composition = complex_counts_composition[
+        complex_counts_composition.apply(all_protein_involved, axis=1)]
+
+    complex_counts_composition = pd.merge(complex_counts_composition, complexes,
+                                          left_on='complex_multidata_id',
+                                          right_on='id_multidata',
+                                          suffixes=['_protein', ''])
+
+    if drop_duplicates:
+        complex_counts_composition.drop_duplicates(['complex_multidata_id'], inplace=True)
+    return complex_counts_composition
+
+
+def filter_empty_cluster_counts(counts: pd.DataFrame, clusters_names: list) -> pd.DataFrame:
+    if counts.empty:
+        return counts
+
+    return counts[counts[clusters_names].apply(lambda row: row.sum() > 0, axis=1)]
+
+
+def build_counts(genes: pd.DataFrame) -> pd.DataFrame:
+    random_state = np.random.RandomState(0)
+
+    database_genes = genes['ensembl'].dropna().unique().tolist()
+    filler_genes = ['ENSG9{:010d}'.format(number) for number in range(GENES - len(database_genes))]
+    cells = ['cell_{}'.format(number) for number in range(CELLS)]
+
+    values = random_state.poisson(0.3, (GENES, CELLS)).astype(np.float32)
+    counts = pd.DataFrame(values, index=database_genes + filler_genes, columns=cells)
+    counts['gene'] = counts.index
+
+    return counts
+
+
+def main():
+    bundle = analysis_bundle.get_analysis_bundle(create_app(False).database_manager)
+    interactions, genes = bundle['interactions'], bundle['genes']
+    complex_expanded, complex_composition = bundle['complex_expanded'], bundle['complex_composition']
+
+    counts = build_counts(genes)
+    clusters_names = sorted(counts.columns.drop('gene'))
+    counts_genes = counts['gene'].tolist()
+    # Genes of the interactions, as filter_counts_by_interactions calls filter_counts_by_genes
+    interactions_genes = pd.concat([interactions['ensembl_1'], interactions['ensembl_2']]).drop_duplicates().tolist()
+
+    counts_multidata = cluster_counts_filter.filter_by_gene(counts, genes)
+    multidatas_counts = counts_multidata[counts_multidata['id_multidata'].isin(
+        complex_composition['protein_multidata_id'])]
+    complex_in_counts, _ = cpdb_statistical_analysis_complex_method.get_involved_complex_from_counts(
+        counts_multidata, clusters_names, complex_expanded, complex_composition)
+
+    benchmarks = [
+        ('filter_interactions_by_genes', filter_interactions_by_genes,
+         cpdb_statistical_analysis_complex_method.filter_interactions_by_genes, (interactions, counts_genes)),
+        ('filter_interactions_by_complexes', filter_interactions_by_complexes,
+         cpdb_statistical_analysis_complex_method.filter_interactions_by_complexes, (interactions, complex_in_counts)),
+        ('filter_counts_by_genes', filter_counts_by_genes,
+         cpdb_statistical_analysis_complex_method.filter_counts_by_genes,
+         (counts, interactions_genes)),
+        ('get_involved_complex_from_protein', get_involved_complex_from_protein,
+         complex_helper.get_involved_complex_from_protein,
+         (multidatas_counts, complex_expanded, complex_composition, False)),
+        ('filter_empty_cluster_counts', filter_empty_cluster_counts,
+         cluster_counts_filter.filter_empty_cluster_counts, (counts, clusters_names)),
+    ]
+
+    print('{} genes x {} cells, best of {}'.format(GENES, CELLS, REPEAT))
+    for name, row_wise_filter, vectorized_filter, arguments in benchmarks:
+        if not row_wise_filter(*arguments).equals(vectorized_filter(*arguments)):
+            raise AssertionError('{}: the vectorized result is different'.format(name))
+
+        row_wise_time = min(timeit.repeat(lambda: row_wise_filter(*arguments), number=1, repeat=REPEAT))
+        vectorized_time = min(timeit.repeat(lambda: vectorized_filter(*arguments), number=1, repeat=REPEAT))
+
+        print('  {:<36}{:.3f}s -> {:.3f}s'.format(name, row_wise_time, vectorized_time))
+
+
+if __name__ == '__main__':
+    main()
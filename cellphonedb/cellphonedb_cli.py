@@ -35,8 +35,14 @@ def plot():
     pass
 
 
+@cli.group()
+def tools():
+    pass
+
+
 method.add_command(method_terminal_commands.statistical_analysis)
 method.add_command(method_terminal_commands.analysis)
+method.add_command(method_terminal_commands.render)
 query.add_command(query_terminal_commands.find_interactions_by_element)
 query.add_command(query_terminal_commands.get_interaction_gene)
 
@@ -48,14 +54,11 @@ database.add_command(database_terminal_commands.generate)
 plot.add_command(plot_terminal_commands.dot_plot)
 plot.add_command(plot_terminal_commands.heatmap_plot)
 
+tools.add_command(tools_terminal_commands.convert_counts)
+
 advanced_flag_var = 'ADVANCED'
 
 if os.getenv(advanced_flag_var, None):
-    @cli.group()
-    def tools():
-        pass
-
-
     query.add_command(query_terminal_commands.autocomplete)
     database.add_command(database_terminal_commands.collect)
     tools.add_command(tools_terminal_commands.generate_genes)
@@ -10,12 +10,15 @@ from cellphonedb.src.app import cpdb_app
 from cellphonedb.src.app.app_logger import app_logger
 from cellphonedb.src.core.exceptions.AllCountsFilteredException import AllCountsFilteredException
 from cellphonedb.src.core.exceptions.EmptyResultException import EmptyResultException
+from cellphonedb.src.core.exceptions.ThresholdNotAnalyzedException import ThresholdNotAnalyzedException
 from cellphonedb.src.core.exceptions.ThresholdValueException import ThresholdValueException
 from cellphonedb.src.core.utils.subsampler import Subsampler
 from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
 from cellphonedb.src.exceptions.ParseMetaException import ParseMetaException
 from cellphonedb.src.exceptions.ReadFileException import ReadFileException
+from cellphonedb.src.exceptions.WriteFileException import WriteFileException
 from cellphonedb.src.local_launchers.local_method_launcher import LocalMethodLauncher
+from cellphonedb.utils import long_results
 
 
 def check_subsampling_params(ctx: Context, argument: Argument, value) -> Any:
@@ -42,6 +45,24 @@ def check_subsampling_params(ctx: Context, argument: Argument, value) -> Any:
     return value
 
 
+def float_list(ctx: Context, argument: Argument, value: Optional[str]) -> Optional[list]:
+    """
+    Parses a comma separated list of float values
+    """
+    if value is None:
+        return None
+
+    try:
+        values = [float(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise click.BadParameter('{} is not a comma separated list of numbers'.format(value))
+
+    if not values:
+        raise click.BadParameter('at least one value is required')
+
+    return values
+
+
 def subsampling_options(f: Callable) -> Callable:
     options = [
         click.option('--subsampling', is_flag=True, help='Enable subsampling', is_eager=True),
@@ -59,6 +80,23 @@ def subsampling_options(f: Callable) -> Callable:
     return f
 
 
+def long_output_options(f: Callable) -> Callable:
+    options = [
+        click.option('--long-output', type=click.Choice(long_results.FORMATS), default=None,
+                     help='Write the significant interactions as a long table (one row per interaction and cluster '
+                          'pair) instead of the pvalues, means and significant means tables'),
+        click.option('--long-result-name', default='significant_interactions', type=str,
+                     help='Long result namefile [significant_interactions]'),
+        click.option('--long-mean-cutoff', default=None, type=float,
+                     help='Also keep the pairs with a mean above this value in the long result'),
+    ]
+
+    for option in reversed(options):
+        f = option(f)
+
+    return f
+
+
 def common_options(f: Callable) -> Callable:
     options = [
         click.argument('meta-filename'),
@@ -66,7 +104,6 @@ def common_options(f: Callable) -> Callable:
         click.option('--counts-data', type=click.Choice(['ensembl', 'gene_name', 'hgnc_symbol']), default='ensembl'),
         click.option('--project-name', default='', type=str,
                      help='Name of the project. It creates a subfolder in output folder'),
-        click.option('--threshold', default=0.1, type=float, help='% of cells expressing a gene'),
         click.option('--result-precision', default='3', type=int, help='Number of decimal digits in results [3]'),
         click.option('--output-path', default='', type=str,
                      help='Directory where the results will be allocated (the directory must exist) [out]'),
@@ -89,16 +126,28 @@ def common_options(f: Callable) -> Callable:
 
 @click.command()
 @common_options
+@click.option('--threshold', default='0.1', type=str, callback=float_list,
+              help='% of cells expressing a gene. A comma separated list runs the permutations once for all values')
 @click.option('--debug-seed', default='-1', type=int, help='Debug random seed 0 for disable it. >=0 to set it [-1]')
-@click.option('--pvalue', default=0.05, type=float, help='Pvalue threshold [0.05]')
+@click.option('--pvalue', default='0.05', type=str, callback=float_list,
+              help='Pvalue threshold [0.05]. A comma separated list writes the results of every value')
 @click.option('--pvalues-result-name', default='pvalues', type=str, help='Pvalues result namefile [pvalues]')
 @click.option('--iterations', default=1000, type=int, help='Number of pvalues analysis iterations [1000]')
 @click.option('--threads', default=4, type=int, help='Max of threads to process the data [4]')
+@long_output_options
+@click.option('--analysis-artifact', default=None, type=str,
+              help='Also save the analysis data with this filename, to render the results again with '
+                   '`cellphonedb method render`')
+@click.option('--adaptive-exceedances', default=0, type=click.IntRange(min=0),
+              help='Stop the permutations of an interaction pair once this number of shuffled means are bigger than '
+                   'the real mean (sequential Besag-Clifford pvalues). 0 runs all the iterations [0]')
+@click.option('--iterations-result-name', default='effective_iterations', type=str,
+              help='Effective iterations result namefile of the adaptive permutations [effective_iterations]')
 def statistical_analysis(meta_filename: str,
                          counts_filename: str,
                          counts_data: str,
                          project_name: str,
-                         threshold: float,
+                         threshold: list,
                          result_precision: int,
                          output_path: str,
                          output_format: str,
@@ -112,10 +161,16 @@ def statistical_analysis(meta_filename: str,
                          subsampling_num_pc: int,
                          subsampling_num_cells: Optional[int],
                          debug_seed: int,
-                         pvalue: float,
+                         pvalue: list,
                          pvalues_result_name: str,
                          iterations: int,
-                         threads: int
+                         threads: int,
+                         long_output: Optional[str],
+                         long_result_name: str,
+                         long_mean_cutoff: Optional[float],
+                         analysis_artifact: Optional[str],
+                         adaptive_exceedances: int,
+                         iterations_result_name: str
                          ) -> None:
     try:
 
@@ -142,9 +197,15 @@ def statistical_analysis(meta_filename: str,
                                                             result_precision,
                                                             pvalue,
                                                             subsampler,
+                                                            long_output,
+                                                            long_result_name,
+                                                            long_mean_cutoff,
+                                                            analysis_artifact,
+                                                            adaptive_exceedances,
+                                                            iterations_result_name,
                                                             )
     except (ReadFileException, ParseMetaException, ParseCountsException, ThresholdValueException,
-            AllCountsFilteredException) as e:
+            AllCountsFilteredException, WriteFileException) as e:
         app_logger.error(str(e) +
                          (':' if (hasattr(e, 'description') and e.description) or (
                                  hasattr(e, 'hint') and e.hint) else '') +
@@ -167,6 +228,7 @@ def statistical_analysis(meta_filename: str,
 
 @click.command()
 @common_options
+@click.option('--threshold', default=0.1, type=float, help='% of cells expressing a gene')
 def analysis(meta_filename: str,
              counts_filename: str,
              counts_data: str,
@@ -227,3 +289,87 @@ def analysis(meta_filename: str,
 
         if verbose:
             traceback.print_exc(file=sys.stdout)
+
+
+@click.command()
+@click.argument('artifact-filename')
+@click.option('--project-name', default='', type=str,
+              help='Name of the project. It creates a subfolder in output folder')
+@click.option('--threshold', default=None, type=str, callback=float_list,
+              help='% of cells expressing a gene. Accepts a comma separated list [analysis threshold]')
+@click.option('--pvalue', default=None, type=str, callback=float_list,
+              help='Pvalue threshold. Accepts a comma separated list [analysis pvalue]')
+@click.option('--result-precision', default=None, type=int,
+              help='Number of decimal digits in results [analysis precision]')
+@click.option('--output-path', default='', type=str,
+              help='Directory where the results will be allocated (the directory must exist) [out]')
+@click.option('--output-format', type=click.Choice(['txt', 'csv', 'tsv', 'tab']))
+@click.option('--means-result-name', default='means', type=str, help='Means result namefile [means]')
+@click.option('--pvalues-result-name', default='pvalues', type=str, help='Pvalues result namefile [pvalues]')
+@click.option('--significant-means-result-name', default='significant_means', type=str,
+              help='Significant result namefile [significant_means]')
+@click.option('--deconvoluted-result-name', default='deconvoluted',
+              help='Deconvoluted result namefile [deconvoluted]')
+@click.option('--iterations-result-name', default='effective_iterations', type=str,
+              help='Effective iterations result namefile of the adaptive permutations [effective_iterations]')
+@long_output_options
+@click.option('--verbose/--quiet', default=True, help='Print or hide cellphonedb logs [verbose]')
+def render(artifact_filename: str,
+           project_name: str,
+           threshold: Optional[list],
+           pvalue: Optional[list],
+           result_precision: Optional[int],
+           output_path: str,
+           output_format: str,
+           means_result_name: str,
+           pvalues_result_name: str,
+           significant_means_result_name: str,
+           deconvoluted_result_name: str,
+           iterations_result_name: str,
+           long_output: Optional[str],
+           long_result_name: str,
+           long_mean_cutoff: Optional[float],
+           verbose: bool
+           ) -> None:
+    """
+    Writes the statistical analysis results from an analysis artifact (see statistical_analysis --analysis-artifact)
+    without running the analysis again
+    """
+    try:
+        LocalMethodLauncher(cpdb_app.create_app(verbose)). \
+            cpdb_statistical_analysis_render_local_method_launcher(artifact_filename,
+                                                                   project_name,
+                                                                   threshold,
+                                                                   output_path,
+                                                                   output_format,
+                                                                   means_result_name,
+                                                                   pvalues_result_name,
+                                                                   significant_means_result_name,
+                                                                   deconvoluted_result_name,
+                                                                   result_precision,
+                                                                   pvalue,
+                                                                   long_output,
+                                                                   long_result_name,
+                                                                   long_mean_cutoff,
+                                                                   iterations_result_name,
+                                                                   )
+    except (ReadFileException, ThresholdValueException, ThresholdNotAnalyzedException, WriteFileException) as e:
+        app_logger.error(str(e) +
+                         (':' if (hasattr(e, 'description') and e.description) or (
+                                 hasattr(e, 'hint') and e.hint) else '') +
+                         (' {}.'.format(e.description) if hasattr(e, 'description') and e.description else '') +
+                         (' {}.'.format(e.hint) if hasattr(e, 'hint') and e.hint else '')
+                         )
+
+    except EmptyResultException as e:
+        app_logger.warning(str(e) +
+                           (':' if (hasattr(e, 'description') and e.description) or (
+                                   hasattr(e, 'hint') and e.hint) else '') +
+                           (' {}.'.format(e.description) if hasattr(e, 'description') and e.description else '') +
+                           (' {}.'.format(e.hint) if hasattr(e, 'hint') and e.hint else '')
+                           )
+    except:
+        app_logger.error('Unexpected error')
+
+        if verbose:
+            traceback.print_exc(file=sys.stdout)
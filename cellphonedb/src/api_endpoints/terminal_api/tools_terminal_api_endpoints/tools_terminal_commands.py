@@ -18,7 +18,7 @@ from cellphonedb.tools.generate_data.mergers.add_curated import add_curated
 from cellphonedb.tools.generate_data.mergers.merge_interactions import merge_iuphar_imex_interactions
 from cellphonedb.tools.generate_data.parsers import parse_iuphar_guidetopharmacology
 from cellphonedb.tools.generate_data.parsers.parse_interactions_imex import parse_interactions_imex
-from cellphonedb.utils import utils
+from cellphonedb.utils import utils, binary_counts, counts_reader
 from cellphonedb.utils.utils import _get_separator, write_to_file
 
 
@@ -381,3 +381,22 @@ def _set_paths(output_path, subfolder):
 
 def _path_is_not_empty(path):
     return bool([f for f in os.listdir(path) if not f.startswith('.')])
+
+
+@click.command()
+@click.argument('counts', type=click.Path(file_okay=True, exists=True, dir_okay=False))
+@click.option('--output', type=str, default=None,
+              help='Converted counts filename [counts filename with {} extension]'.format(binary_counts.EXTENSION))
+@click.option('--counts-data', type=click.Choice(['ensembl', 'gene_name', 'hgnc_symbol']), default='ensembl',
+              help='Genes identifiers read from sparse counts features [ensembl]')
+def convert_counts(counts: str, output: Optional[str], counts_data: str) -> None:
+    if output is None:
+        # x.txt.gz is converted to x.cpdbcounts
+        filename, _ = counts_reader.split_compression(counts)
+        output = '{}{}'.format(os.path.splitext(filename)[0], binary_counts.EXTENSION)
+
+    # Text counts are converted chunk by chunk, without loading the whole matrix
+    binary_counts.write_binary_counts_chunks(counts_reader.read_counts_file_chunks(counts, counts_data=counts_data),
+                                             output)
+
+    app_logger.info('Counts converted to {}'.format(output))
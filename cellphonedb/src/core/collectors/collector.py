@@ -25,20 +25,24 @@ class Collector(object):
                                                                               protein_columns)
 
         self.database_manager.get_repository('protein').add_proteins(proteins_to_add, multidata_to_add)
+        self.database_manager.database.read_cache.clear()
 
     def gene(self, genes: pd.DataFrame):
         genes_processed = gene_preprocess_collector.call(genes,
                                                          self.database_manager.get_column_table_names('gene_table'))
         self.database_manager.get_repository('gene').add(genes_processed)
+        self.database_manager.database.read_cache.clear()
 
     def complex(self, complexes: pd.DataFrame):
         complexes_processed = complex_preprocess_collector.call(complexes)
         self.database_manager.get_repository('complex').add(complexes_processed)
+        self.database_manager.database.read_cache.clear()
 
     def interaction(self, interactions: pd.DataFrame):
         multidatas = self.database_manager.get_repository('multidata').get_all_expanded(include_gene=False)
         interactions_processed = interaction_preprocess_collector.call(interactions, multidatas)
         self.database_manager.get_repository('interaction').add(interactions_processed)
+        self.database_manager.database.read_cache.clear()
 
     def all(self, proteins: pd.DataFrame, genes: pd.DataFrame, complexes: pd.DataFrame, interactions: pd.DataFrame):
         self.protein(proteins)
@@ -4,6 +4,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql.ddl import DropConstraint, DropTable
 
+from cellphonedb.src.core.database.ReadCache import ReadCache
+
 
 # TODO: create sqlalchemy inheritance
 class Database:
@@ -12,6 +14,7 @@ class Database:
         self.established_session = None
         self.base = declarative_base()
         self.base_model = None
+        self.read_cache = ReadCache()
 
     @property
     def session(self):
@@ -55,3 +58,4 @@ class Database:
             conn.execute(DropTable(table))
 
         trans.commit()
+        self.read_cache.clear()
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+import pandas as pd
+
+
+class ReadCache:
+    """
+    Least recently used cache of repository reads, keyed by repository, method and arguments.
+
+    Every hit returns a copy of the cached DataFrame, so callers can modify their result without changing the cache.
+    Cached results are never exposed directly: pandas can't operate on object columns backed by read-only arrays,
+    and many callers filter or rename the repository results in place.
+    """
+
+    def __init__(self, max_size: int = 32):
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, read: Callable):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._copy(self._results[key])
+
+        result = read()
+
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+        return self._copy(result)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    @staticmethod
+    def _copy(result):
+        if isinstance(result, (pd.DataFrame, pd.Series)):
+            return result.copy()
+
+        return result
@@ -1,9 +1,29 @@
+import functools
+
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
 from cellphonedb.src.core.database import DatabaseManager
 
 
+def cached_read(method):
+    """
+    Caches the repository read in the database read cache. Reads with unhashable arguments are not cached.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (self.name, method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        return self.database_manager.database.read_cache.get(key, lambda: method(self, *args, **kwargs))
+
+    return wrapper
+
+
 class Repository():
     def __init__(self, database_manager: DatabaseManager):
         self.database_manager = database_manager
@@ -0,0 +1,144 @@
+"""
+Analysis bundle: the database tables used by the methods (expanded interactions, genes, complex compositions and
+expanded complexes) precomputed and stored as a pickle next to the database file.
+
+Bundles are keyed by the hash of the database file, so a collected or replaced database never loads a stale bundle.
+Databases downloaded under ~/.cpdb/releases/<version> keep the bundle in the same folder; any other database file
+keeps it in ~/.cpdb/bundles.
+
+Loaded bundles are also kept in memory by database file, modification time and size, so the file is only hashed and
+the bundle unpickled once per process (and once per worker, for all its jobs).
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Optional
+
+from cellphonedb.src.core.core_logger import core_logger
+
+cpdb_releases = '~/.cpdb/releases'
+cpdb_bundles = '~/.cpdb/bundles'
+bundle_prefix = 'analysis_bundle_'
+bundle_extension = '.pkl'
+
+COUNTS_DATA = ['ensembl', 'gene_name', 'hgnc_symbol']
+
+# Loaded bundles by database file: (modification time, size) of the file and bundle
+_loaded_bundles = {}
+
+
+def get_analysis_bundle(database_manager) -> dict:
+    """
+    Returns the analysis bundle of the database. It is loaded from disk if it was already built for this database file,
+    else it is built from the repositories and stored. The loaded bundle is reused until the database file changes.
+    """
+    database_file = get_database_file(database_manager)
+    if not database_file:
+        return build_analysis_bundle(database_manager)
+
+    database_stat = os.stat(database_file)
+    file_version = (database_stat.st_mtime_ns, database_stat.st_size)
+
+    loaded_version, bundle = _loaded_bundles.get(database_file, (None, None))
+    if loaded_version != file_version:
+        bundle = _read_analysis_bundle(database_manager, database_file)
+        _loaded_bundles[database_file] = (file_version, bundle)
+
+    return _copy_bundle(bundle)
+
+
+def _read_analysis_bundle(database_manager, database_file: str) -> dict:
+    database_hash = file_hash(database_file)
+    bundle_file = os.path.join(get_bundle_dir(database_file), '{}{}{}'.format(bundle_prefix, database_hash,
+                                                                              bundle_extension))
+
+    bundle = load_analysis_bundle(bundle_file)
+    if bundle is not None:
+        core_logger.debug('Analysis bundle loaded from {}'.format(bundle_file))
+        return bundle
+
+    bundle = build_analysis_bundle(database_manager)
+    save_analysis_bundle(bundle, bundle_file)
+
+    return bundle
+
+
+def _copy_bundle(bundle: dict) -> dict:
+    """
+    The methods filter and modify the bundle tables, so every caller gets its own copy of the in-memory bundle
+    """
+    return {name: value.copy() for name, value in bundle.items()}
+
+
+def build_analysis_bundle(database_manager) -> dict:
+    genes = database_manager.get_repository('gene').get_all_expanded()
+
+    return {
+        'interactions': database_manager.get_repository('interaction').get_all_expanded(),
+        'genes': genes,
+        'complex_composition': database_manager.get_repository('complex').get_all_compositions(),
+        'complex_expanded': database_manager.get_repository('complex').get_all_expanded(),
+        'counts_genes': {counts_data: genes[counts_data].dropna().unique().tolist() for counts_data in COUNTS_DATA
+                         if counts_data in genes},
+    }
+
+
+def load_analysis_bundle(bundle_file: str) -> Optional[dict]:
+    try:
+        with open(bundle_file, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        core_logger.warning('Analysis bundle {} could not be loaded: {}'.format(bundle_file, e))
+        return None
+
+
+def save_analysis_bundle(bundle: dict, bundle_file: str) -> None:
+    """
+    Stores the bundle (atomically, so concurrent runs never read a partial file) and removes the bundles of previous
+    versions of the database file. The bundle is just not stored if the folder is not writable.
+    """
+    bundle_dir = os.path.dirname(bundle_file)
+    try:
+        os.makedirs(bundle_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=bundle_dir, suffix='.tmp', delete=False) as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, bundle_file)
+    except OSError as e:
+        core_logger.warning('Analysis bundle could not be stored in {}: {}'.format(bundle_dir, e))
+        return
+
+    if os.path.realpath(bundle_dir) != os.path.realpath(os.path.expanduser(cpdb_bundles)):
+        for file_name in os.listdir(bundle_dir):
+            old_bundle = os.path.join(bundle_dir, file_name)
+            if file_name.startswith(bundle_prefix) and old_bundle != bundle_file:
+                os.remove(old_bundle)
+
+
+def get_database_file(database_manager) -> Optional[str]:
+    url = database_manager.database.engine.url
+    if url.drivername != 'sqlite' or not url.database:
+        return None
+
+    return os.path.realpath(url.database)
+
+
+def get_bundle_dir(database_file: str) -> str:
+    releases_dir = os.path.realpath(os.path.expanduser(cpdb_releases))
+    database_dir = os.path.dirname(database_file)
+
+    if os.path.dirname(database_dir) == releases_dir:
+        return database_dir
+
+    return os.path.expanduser(cpdb_bundles)
+
+
+def file_hash(file: str, block_size: int = 1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
@@ -1,7 +1,7 @@
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
-from cellphonedb.src.core.database.Repository import Repository
+from cellphonedb.src.core.database.Repository import Repository, cached_read
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_complex import Complex
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_complex_composition import ComplexComposition
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_gene import Gene
@@ -13,24 +13,28 @@ from cellphonedb.src.core.utils import filters
 class ComplexRepository(Repository):
     name = 'complex'
 
+    @cached_read
     def get_all(self) -> pd.DataFrame:
         query = self.database_manager.database.session.query(Complex)
         result = pd.read_sql(query.statement, self.database_manager.database.engine)
 
         return result
 
+    @cached_read
     def get_all_expanded(self) -> pd.DataFrame:
         query = self.database_manager.database.session.query(Complex, Multidata).join(Multidata)
         result = pd.read_sql(query.statement, self.database_manager.database.engine)
 
         return result
 
+    @cached_read
     def get_all_compositions(self) -> pd.DataFrame:
         query = self.database_manager.database.session.query(ComplexComposition)
         result = pd.read_sql(query.statement, self.database_manager.database.engine)
 
         return result
 
+    @cached_read
     def get_all_compositions_expanded(self, include_gene: bool = True) -> pd.DataFrame:
         query = self.database_manager.database.session.query(ComplexComposition)
         complex_composition = pd.read_sql(query.statement, self.database_manager.database.engine)
@@ -1,7 +1,7 @@
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
-from cellphonedb.src.core.database.Repository import Repository
+from cellphonedb.src.core.database.Repository import Repository, cached_read
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_gene import Gene
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_multidata import Multidata
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_protein import Protein
@@ -11,12 +11,14 @@ from cellphonedb.src.core.utils import filters
 class GeneRepository(Repository):
     name = 'gene'
 
+    @cached_read
     def get_all(self):
         query = self.database_manager.database.session.query(Gene)
         result = pd.read_sql(query.statement, self.database_manager.database.session.bind)
 
         return result
 
+    @cached_read
     def get_all_expanded(self):
         protein_multidata_join = Protein.protein_multidata_id == Multidata.id_multidata
         gene_protein_join = Gene.protein_id == Protein.id_protein
@@ -1,7 +1,7 @@
 import pandas as pd
 from sqlalchemy import or_
 
-from cellphonedb.src.core.database.Repository import Repository
+from cellphonedb.src.core.database.Repository import Repository, cached_read
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_interaction import Interaction
 from cellphonedb.src.core.models.interaction.interaction_helper import expand_interactions_multidatas
 from cellphonedb.src.core.utils import filters
@@ -10,6 +10,7 @@ from cellphonedb.src.core.utils import filters
 class InteractionRepository(Repository):
     name = 'interaction'
 
+    @cached_read
     def get_all(self):
         query = self.database_manager.database.session.query(Interaction)
         interactions = pd.read_sql(query.statement, self.database_manager.database.engine)
@@ -40,6 +41,7 @@ class InteractionRepository(Repository):
         interactions_expanded = expand_interactions_multidatas(interactions, multidatas_expanded)
         return interactions_expanded
 
+    @cached_read
     def get_all_expanded(self, include_gene=True, suffixes=('_1', '_2')):
         interactions_query = self.database_manager.database.session.query(Interaction)
 
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from cellphonedb.src.core.database.Repository import Repository
+from cellphonedb.src.core.database.Repository import Repository, cached_read
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_complex import Complex
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_gene import Gene
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_multidata import Multidata
@@ -10,12 +10,14 @@ from cellphonedb.src.core.database.sqlalchemy_models.db_model_protein import Pro
 class MultidataRepository(Repository):
     name = 'multidata'
 
+    @cached_read
     def get_all(self):
         query = self.database_manager.database.session.query(Multidata)
         result = pd.read_sql(query.statement, self.database_manager.database.engine)
 
         return result
 
+    @cached_read
     def get_all_expanded(self, include_gene=True):
         protein_multidata_join = Protein.protein_multidata_id == Multidata.id_multidata
         if include_gene:
@@ -41,6 +43,7 @@ class MultidataRepository(Repository):
 
         return multidata_expanded
 
+    @cached_read
     def get_all_name_id(self) -> pd.DataFrame:
         query_multidatas = self.database_manager.database.session.query(Multidata.id_multidata, Multidata.name)
         multidatas = pd.read_sql(query_multidatas.statement, self.database_manager.database.session.bind)
@@ -48,6 +51,7 @@ class MultidataRepository(Repository):
         return multidatas
 
     def get_multidatas_from_string(self, input_string: str) -> pd.DataFrame:
+        # Not cached: every string would take a read cache entry. The expanded multidatas read is cached
         multidatas = self.get_all_expanded()
 
         return multidatas[(multidatas['name'] == input_string) |
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from cellphonedb.src.core.database.Repository import Repository
+from cellphonedb.src.core.database.Repository import Repository, cached_read
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_multidata import Multidata
 from cellphonedb.src.core.database.sqlalchemy_models.db_model_protein import Protein
 
@@ -8,12 +8,14 @@ from cellphonedb.src.core.database.sqlalchemy_models.db_model_protein import Pro
 class ProteinRepository(Repository):
     name = 'protein'
 
+    @cached_read
     def get_all(self) -> pd.DataFrame:
         protein_query = self.database_manager.database.session.query(Protein)
         protein = pd.read_sql(protein_query.statement, self.database_manager.database.session.bind)
 
         return protein
 
+    @cached_read
     def get_all_expanded(self) -> pd.DataFrame:
         protein_multidata_join = Protein.protein_multidata_id == Multidata.id_multidata
         protein_query = self.database_manager.database.session.query(Protein, Multidata).join(Multidata,
@@ -22,6 +24,7 @@ class ProteinRepository(Repository):
 
         return protein
 
+    @cached_read
     def get_all_name_id(self) -> pd.DataFrame:
         query_multidatas = self.database_manager.database.session.query(Protein.id_protein, Multidata.name).join(
             Multidata)
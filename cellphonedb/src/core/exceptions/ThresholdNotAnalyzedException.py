@@ -0,0 +1,7 @@
+class ThresholdNotAnalyzedException(Exception):
+    def __init__(self, threshold_value, analysis_threshold_value, description: str = None, hint: str = None):
+        super(ThresholdNotAnalyzedException, self).__init__(
+            'Threshold value ({}) is lower than the lowest threshold of the analysis ({})'.format(
+                threshold_value, analysis_threshold_value))
+        self.description = description
+        self.hint = hint
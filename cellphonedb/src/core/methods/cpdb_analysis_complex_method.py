@@ -1,5 +1,6 @@
 from functools import partial
 
+import numpy as np
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
@@ -91,19 +92,8 @@ def build_results(interactions: pd.DataFrame,
 
     interactions = interactions.copy()
 
-    def simple_complex_indicator(interaction: pd.Series, suffix: str) -> str:
-        """
-        Add simple/complex prefixes to interaction components
-        """
-        if interaction['is_complex{}'.format(suffix)]:
-            return 'complex:{}'.format(interaction['name{}'.format(suffix)])
-
-        return 'simple:{}'.format(interaction['name{}'.format(suffix)])
-
-    interactions['partner_a'] = interactions.apply(lambda interaction: simple_complex_indicator(interaction, '_1'),
-                                                   axis=1)
-    interactions['partner_b'] = interactions.apply(lambda interaction: simple_complex_indicator(interaction, '_2'),
-                                                   axis=1)
+    interactions['partner_a'] = cpdb_statistical_analysis_helper.partner_build(interactions, '_1')
+    interactions['partner_b'] = cpdb_statistical_analysis_helper.partner_build(interactions, '_2')
 
     significant_mean_rank, significant_means = cpdb_analysis_helper.build_significant_means(
         mean_analysis, percent_analysis)
@@ -415,28 +405,19 @@ def get_complex_significative(complexes: pd.DataFrame, counts: pd.DataFrame, com
     Returns a table with the most significant ensembl count for one complex.
 
     The most significative count is the lower mean of the components.
-
-
-
     """
     complex_composition_complexes = pd.merge(complexes, complex_composition, on='complex_multidata_id')
 
     complex_counts = pd.merge(counts, complex_composition_complexes, left_on='id_multidata',
                               right_on='protein_multidata_id', suffixes=('_protein', '_complex'))
 
-    complex_more_significative_protein = pd.Series(data='', index=complex_counts['name_complex'].drop_duplicates())
-
-    for _, complex in complexes.iterrows():
-        complex_composition_proteins = complex_counts[complex_counts['id_complex'] == complex['id_complex']]
-
-        means = pd.Series(index=complex_composition_proteins['gene'])
-
-        for _, complex_composition_protein in complex_composition_proteins.iterrows():
-            means[complex_composition_protein['gene']] = complex_composition_protein[cells_names].mean()
-
-        min_mean = means.idxmin()
+    # Means in float64 as the row by row means did, so float32 rounding doesn't create or break ties
+    components_means = pd.Series(complex_counts[cells_names].values.astype(np.float64).mean(axis=1),
+                                 index=complex_counts.index)
+    min_components = components_means.groupby(complex_counts['name_complex'], sort=False).idxmin()
 
-        complex_more_significative_protein.at[complex['name']] = min_mean
+    complex_more_significative_protein = pd.Series(complex_counts.loc[min_components.values, 'gene'].values,
+                                                   index=min_components.index)
 
     return complex_more_significative_protein
 
@@ -85,10 +85,8 @@ def build_results(interactions: pd.DataFrame,
                  **gene_renames},
         inplace=True)
 
-    interactions_data_result['partner_a'] = interactions_data_result['partner_a'].apply(
-        lambda name: 'simple:{}'.format(name))
-    interactions_data_result['partner_b'] = interactions_data_result['partner_b'].apply(
-        lambda name: 'simple:{}'.format(name))
+    interactions_data_result['partner_a'] = 'simple:' + interactions_data_result['partner_a'].astype(str)
+    interactions_data_result['partner_b'] = 'simple:' + interactions_data_result['partner_b'].astype(str)
 
     # Dedupe rows and filter only desired columns
     interactions_data_result.drop_duplicates(inplace=True)
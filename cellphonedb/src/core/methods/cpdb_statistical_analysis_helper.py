@@ -1,11 +1,21 @@
 import itertools
-from functools import partial
+import os
+import tempfile
 from multiprocessing.pool import Pool
+from typing import Union, Optional
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from cellphonedb.src.core.core_logger import core_logger
 
+# Iterations permutated by every statistical analysis task (see get_permutation_batches)
+PERMUTATION_BATCH_SIZE = 32
+
+# Permutation arrays memory-mapped by every statistical analysis thread (see _load_permutation_data)
+_permutation_data = {}
+
 
 def get_significant_means(real_mean_analysis: pd.DataFrame, result_percent: pd.DataFrame,
                           min_significant_mean: float) -> pd.DataFrame:
@@ -37,22 +47,7 @@ def get_significant_means(real_mean_analysis: pd.DataFrame, result_percent: pd.D
     ensembl2    2.0         0.1         NaN
     ensembl3    NaN         NaN         0.5
     """
-    significant_means = real_mean_analysis.copy()
-    for index, mean_analysis in real_mean_analysis.iterrows():
-        for cluster_interaction in list(result_percent.columns):
-            if result_percent.at[index, cluster_interaction] > min_significant_mean:
-                significant_means.at[index, cluster_interaction] = pd.np.nan
-    return significant_means
-
-
-def shuffle_meta(meta: pd.DataFrame) -> pd.DataFrame:
-    """
-    Permutates the meta values aleatory generating a new meta file
-    """
-    meta_copy = meta.copy()
-    pd.np.random.shuffle(meta_copy['cell_type'])
-
-    return meta_copy
+    return real_mean_analysis.mask(result_percent > min_significant_mean)
 
 
 def build_clusters(meta: pd.DataFrame, counts: pd.DataFrame) -> dict:
@@ -106,10 +101,7 @@ def mean_pvalue_result_build(real_mean_analysis: pd.DataFrame, result_percent: p
     """
     Merges the pvalues and means in one table
     """
-    mean_pvalue_result = pd.DataFrame(index=real_mean_analysis.index)
-    for interaction_cluster in real_mean_analysis.columns.values:
-        mean_pvalue_result[interaction_cluster] = real_mean_analysis[interaction_cluster].astype(str).str.cat(
-            result_percent[interaction_cluster].astype(str), sep=' | ')
+    mean_pvalue_result = real_mean_analysis.astype(str) + ' | ' + result_percent.astype(str)
 
     mean_pvalue_result = pd.concat([interactions_data_result, mean_pvalue_result], axis=1, join='inner', sort=False)
 
@@ -176,20 +168,71 @@ def mean_analysis(interactions: pd.DataFrame, clusters: dict, cluster_interactio
 
         results with * are 0 because one of both components is 0.
     """
-    result = base_result.copy()
+    cluster_means = pd.DataFrame(clusters['means'], columns=clusters['names'])
 
-    for interaction_index, interaction in interactions.iterrows():
-        for cluster_interaction in cluster_interactions:
-            cluster_interaction_string = '{}{}{}'.format(cluster_interaction[0], separator, cluster_interaction[1])
+    receptors, ligands = get_interactions_genes_indices(interactions, cluster_means.index, suffixes, counts_data)
+    clusters_receptors, clusters_ligands = get_cluster_interactions_indices(clusters['names'], cluster_interactions)
 
-            interaction_mean = cluster_interaction_mean(cluster_interaction, interaction, clusters['means'], suffixes,
-                                                        counts_data=counts_data)
+    interactions_means = interactions_cluster_means(cluster_means.values, receptors, ligands, clusters_receptors,
+                                                    clusters_ligands)
 
-            result.at[interaction_index, cluster_interaction_string] = interaction_mean
+    result = pd.DataFrame(interactions_means, index=base_result.index, columns=base_result.columns)
 
     return result
 
 
+def get_interactions_genes_indices(interactions: pd.DataFrame, genes: pd.Index, suffixes: tuple = ('_1', '_2'),
+                                   counts_data: str = 'ensembl') -> (np.ndarray, np.ndarray):
+    """
+    Maps the interaction components to their row position in the genes index
+
+    :raise KeyError: if any interaction component is not in the genes index
+    """
+    receptors_genes = interactions['{}{}'.format(counts_data, suffixes[0])]
+    ligands_genes = interactions['{}{}'.format(counts_data, suffixes[1])]
+
+    receptors = genes.get_indexer(receptors_genes)
+    ligands = genes.get_indexer(ligands_genes)
+
+    # get_indexer returns -1 for missing genes, which would silently take the means of the last gene
+    if (receptors < 0).any() or (ligands < 0).any():
+        missing_genes = set(receptors_genes[receptors < 0]) | set(ligands_genes[ligands < 0])
+        raise KeyError('Interaction genes not in counts: {}'.format(', '.join(sorted(map(str, missing_genes)))))
+
+    return receptors, ligands
+
+
+def get_cluster_interactions_indices(cluster_names: list, cluster_interactions: list) -> (np.ndarray, np.ndarray):
+    """
+    Maps every cluster interaction to the position of both clusters in cluster_names
+    """
+    cluster_positions = {cluster_name: position for position, cluster_name in enumerate(cluster_names)}
+
+    clusters_receptors = np.array([cluster_positions[cluster_interaction[0]]
+                                   for cluster_interaction in cluster_interactions], dtype=int)
+    clusters_ligands = np.array([cluster_positions[cluster_interaction[1]]
+                                 for cluster_interaction in cluster_interactions], dtype=int)
+
+    return clusters_receptors, clusters_ligands
+
+
+def interactions_cluster_means(cluster_means: np.ndarray, receptors: np.ndarray, ligands: np.ndarray,
+                               clusters_receptors: np.ndarray, clusters_ligands: np.ndarray) -> np.ndarray:
+    """
+    Means of all the interactions and cluster interactions at once.
+
+    cluster_means is a genes x clusters matrix. Returns an interactions x cluster interactions matrix with the mean
+    of both components or 0 if one of both is 0
+    """
+    means_receptors = cluster_means[receptors[:, None], clusters_receptors[None, :]]
+    means_ligands = cluster_means[ligands[:, None], clusters_ligands[None, :]]
+
+    interactions_means = (means_receptors + means_ligands) / 2
+    interactions_means[(means_receptors == 0) | (means_ligands == 0)] = 0
+
+    return interactions_means
+
+
 def percent_analysis(clusters: dict, threshold: float, interactions: pd.DataFrame, cluster_interactions: list,
                      base_result: pd.DataFrame, separator: str, suffixes: tuple = ('_1', '_2'),
                      counts_data: str = 'ensembl') -> pd.DataFrame:
@@ -230,244 +273,424 @@ def percent_analysis(clusters: dict, threshold: float, interactions: pd.DataFram
 
 
     """
-    result = base_result.copy()
-    percents = {}
-    # percents calculation
-    for cluster_name in clusters['names']:
-        counts = clusters['counts'][cluster_name]
+    fraction = clusters_expressing_fraction(clusters)
+
+    return fraction_percent_analysis(fraction, threshold, interactions, cluster_interactions, base_result, suffixes,
+                                     counts_data)
+
 
-        percents[cluster_name] = counts.apply(lambda count: counts_percent(count, threshold), axis=1)
+def fraction_percent_analysis(fraction: pd.DataFrame, threshold: float, interactions: pd.DataFrame,
+                              cluster_interactions: list, base_result: pd.DataFrame, suffixes: tuple = ('_1', '_2'),
+                              counts_data: str = 'ensembl') -> pd.DataFrame:
+    """
+    percent_analysis from the clusters expressing fraction (see clusters_expressing_fraction)
+    """
+    receptors, ligands = get_interactions_genes_indices(interactions, fraction.index, suffixes, counts_data)
+    clusters_receptors, clusters_ligands = get_cluster_interactions_indices(list(fraction.columns),
+                                                                            cluster_interactions)
 
-    for interaction_index, interaction in interactions.iterrows():
-        for cluster_interaction in cluster_interactions:
-            cluster_interaction_string = '{}{}{}'.format(cluster_interaction[0], separator, cluster_interaction[1])
+    not_expressed = fraction.values < threshold
+    interactions_percents = ~(not_expressed[receptors[:, None], clusters_receptors[None, :]] |
+                              not_expressed[ligands[:, None], clusters_ligands[None, :]])
 
-            interaction_percent = cluster_interaction_percent(cluster_interaction, interaction, percents, suffixes,
-                                                              counts_data=counts_data)
-            result.at[interaction_index, cluster_interaction_string] = interaction_percent
+    result = pd.DataFrame(interactions_percents.astype(float), index=base_result.index, columns=base_result.columns)
 
     return result
 
 
-def shuffled_analysis(iterations: int, meta: pd.DataFrame, counts: pd.DataFrame, interactions: pd.DataFrame,
-                      cluster_interactions: list, base_result: pd.DataFrame, threads: int, separator: str,
-                      suffixes: tuple = ('_1', '_2'), counts_data: str = 'ensembl') -> list:
+def clusters_expressing_fraction(clusters: dict) -> pd.DataFrame:
     """
-    Shuffles meta and calculates the means for each and saves it in a list.
+    Calculates the fraction of cells of every cluster with counts > 0 (genes x clusters) with a single product of the
+    expressed indicator (genes x cells) by the clusters one-hot matrix (cells x clusters)
+    """
+    cluster_counts = [clusters['counts'][cluster_name] for cluster_name in clusters['names']]
+    sizes = np.array([counts.shape[1] for counts in cluster_counts])
+
+    expressed = np.hstack([counts.values > 0 for counts in cluster_counts]).astype(np.float32)
+    one_hot = np.repeat(np.eye(len(sizes), dtype=np.float32), sizes, axis=0)
+
+    # float32 sums of 0/1 values are exact, the division is done in float64
+    fraction = expressed.dot(one_hot).astype(np.float64) / sizes
+
+    return pd.DataFrame(fraction, index=cluster_counts[0].index, columns=clusters['names'])
+
 
-    Runs it in a multiple threads to run it faster
+def build_permutation_data(meta: pd.DataFrame, counts: pd.DataFrame, interactions: pd.DataFrame,
+                           cluster_names: list, cluster_interactions: list, suffixes: tuple = ('_1', '_2'),
+                           counts_data: str = 'ensembl') -> dict:
     """
-    core_logger.info('Running Statistical Analysis')
-    with Pool(processes=threads) as pool:
-        statistical_analysis_thread = partial(_statistical_analysis,
-                                              base_result,
-                                              cluster_interactions,
-                                              counts,
-                                              interactions,
-                                              meta,
-                                              separator,
-                                              suffixes,
-                                              counts_data=counts_data
-                                              )
-        results = pool.map(statistical_analysis_thread, range(iterations))
+    Builds the arrays needed to run the permutations without rebuilding DataFrames:
+
+    - counts: genes x cells float32 matrix with the cells in meta order
+    - labels: cluster position of every cell
+    - sizes: number of cells of every cluster (it doesn't change when labels are permutated)
+    - receptors/ligands: row position of the interaction components in counts
+    - clusters_receptors/clusters_ligands: cluster positions of every cluster interaction
+    """
+    labels = pd.Index(cluster_names).get_indexer(meta['cell_type'])
+    receptors, ligands = get_interactions_genes_indices(interactions, counts.index, suffixes, counts_data)
+    clusters_receptors, clusters_ligands = get_cluster_interactions_indices(cluster_names, cluster_interactions)
 
-    return results
+    permutation_data = {
+        'counts': counts.loc[:, meta.index].values.astype(np.float32),
+        'labels': labels,
+        'sizes': np.bincount(labels, minlength=len(cluster_names)).astype(np.float32),
+        'receptors': receptors,
+        'ligands': ligands,
+        'clusters_receptors': clusters_receptors,
+        'clusters_ligands': clusters_ligands,
+    }
 
+    return permutation_data
 
-def _statistical_analysis(base_result, cluster_interactions, counts, interactions, meta, separator, suffixes,
-                          iteration_number, counts_data: str = 'ensembl') -> pd.DataFrame:
+
+def permutation_mean_analysis(permutation_data: dict, base_result: pd.DataFrame) -> pd.DataFrame:
     """
-    Shuffles meta dataset and calculates calculates the means
+    Calculates the real means with the permutation engine (without shuffling the labels).
+
+    The shuffled means must be compared against these values and not against the mean_analysis result: both are
+    calculated with the same float32 products, so the same cells in one cluster give exactly the same mean.
     """
-    shuffled_meta = shuffle_meta(meta)
-    shuffled_clusters = build_clusters(shuffled_meta, counts)
-    result_mean_analysis = mean_analysis(interactions, shuffled_clusters, cluster_interactions, base_result, separator,
-                                         suffixes, counts_data=counts_data)
-    return result_mean_analysis
+    labels = permutation_data['labels'][None, :]
+    cluster_means = permutations_cluster_means(permutation_data['counts'], labels, permutation_data['sizes'])[0]
 
+    interactions_means = interactions_cluster_means(cluster_means, permutation_data['receptors'],
+                                                    permutation_data['ligands'],
+                                                    permutation_data['clusters_receptors'],
+                                                    permutation_data['clusters_ligands'])
 
-def build_percent_result(real_mean_analysis: pd.DataFrame, real_perecents_analysis: pd.DataFrame,
-                         statistical_mean_analysis: list, interactions: pd.DataFrame, cluster_interactions: list,
-                         base_result: pd.DataFrame, separator: str) -> pd.DataFrame:
+    return pd.DataFrame(interactions_means, index=base_result.index, columns=base_result.columns)
+
+
+def permutations_cluster_means(counts: np.ndarray, permutations_labels: np.ndarray, sizes: np.ndarray) -> np.ndarray:
     """
-    Calculates the pvalues after statistical analysis.
+    Calculates the cluster means of a batch of label permutations with one sparse indicator matrix product.
 
-    If real_percent or real_mean are zero, result_percent is 1
+    counts is a genes x cells matrix and permutations_labels a permutations x cells matrix of cluster positions.
+    Returns a permutations x genes x clusters array.
+    """
+    permutations_number, cells_number = permutations_labels.shape
+    clusters_number = len(sizes)
 
-    If not:
-    Calculates how many shuffled means are bigger than real mean and divides it for the number of
-    the total iterations
+    columns = (np.arange(permutations_number)[:, None] * clusters_number + permutations_labels).ravel()
+    rows = np.tile(np.arange(cells_number), permutations_number)
+    indicator = sparse.csr_matrix((np.ones(len(rows), dtype=counts.dtype), (rows, columns)),
+                                  shape=(cells_number, permutations_number * clusters_number))
 
-    EXAMPLE:
-        INPUT:
+    clusters_sums = counts @ indicator
+    clusters_sums = clusters_sums.reshape(len(counts), permutations_number, clusters_number).transpose(1, 0, 2)
 
-        real_mean_analysis:
-                      cluster1_cluster1   cluster1_cluster2 ...
-        interaction1  0.5                 0.4
-        interaction2  0.0                 0.2
+    return clusters_sums / sizes
 
 
-        real_percents_analysis:
-                      cluster1_cluster1   cluster1_cluster2 ...
-        interaction1  1                   0
-        interaction2  0                   1
+def get_permutation_batches(iterations: int, batch_size: int, seed: int = None) -> list:
+    """
+    Splits the iterations in ranges of batch_size iterations and assigns an independent random stream to each one.
 
-        statistical means:
-        [
-                        cluster1_cluster1   cluster1_cluster2 ...
-        interaction1    0.6                 0.1
-        interaction2    0.0                 0.2
+    The streams are spawned from one root SeedSequence, so every batch always gets the same stream for the same seed
+    and the result doesn't depend on the number of threads or on the process that runs each batch.
+    If seed is None the root SeedSequence takes fresh entropy from the OS.
+    """
+    batches_starts = list(range(0, iterations, batch_size))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batches_starts))
 
-        ,
-                      cluster1_cluster1   cluster1_cluster2 ...
-        interaction1  0.5                 0.4
-        interaction2  0.0                 0.6
-        ]
+    return [(start, min(start + batch_size, iterations), seed_sequence)
+            for start, seed_sequence in zip(batches_starts, seed_sequences)]
 
-        iterations = 2
 
+def share_permutation_data(permutation_data: dict, path: str) -> dict:
+    """
+    Saves every permutation array as a .npy file in path and returns their paths.
 
-        RESULT:
+    The threads memory-map these files instead of receiving a pickled copy of the arrays with every batch, so the
+    counts matrix is written once and its pages are shared by all of them.
+    """
+    shared_paths = {}
+    for name, values in permutation_data.items():
+        shared_paths[name] = os.path.join(path, '{}.npy'.format(name))
+        np.save(shared_paths[name], values)
 
-                        cluster1_cluster1   cluster1_cluster2 ...
-        interaction1    1                   1
-        interaction2    1                   0.5
+    return shared_paths
 
 
+def _load_permutation_data(shared_paths: dict) -> None:
     """
-    core_logger.info('Building Pvalues result')
-    percent_result = base_result.copy()
+    Memory-maps the shared permutation arrays. Runs once in every thread when the pool starts.
+    """
+    _permutation_data.clear()
+    for name, path in shared_paths.items():
+        _permutation_data[name] = np.load(path, mmap_mode='r')
+
 
-    for interaction_index, interaction in interactions.iterrows():
-        for cluster_interaction in cluster_interactions:
-            cluster_interaction_string = '{}{}{}'.format(cluster_interaction[0], separator, cluster_interaction[1])
-            real_mean = real_mean_analysis.at[interaction_index, cluster_interaction_string]
-            real_percent = real_perecents_analysis.at[interaction_index, cluster_interaction_string]
+def shuffled_analysis(iterations: int, permutation_data: dict, real_mean_analysis: pd.DataFrame, threads: int,
+                      seed: int = None, batch_size: int = PERMUTATION_BATCH_SIZE,
+                      candidates: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Shuffles the cluster labels and counts, for every interaction and cluster interaction, how many shuffled means
+    are bigger than the real mean.
 
-            if int(real_percent) == 0 or real_mean == 0:
-                result_percent = 1.0
+    Permutations are processed in batches of iterations, in multiple threads to run it faster. The arrays are shared
+    with the threads through memory-mapped files and every task only receives its iterations range and seed. Every
+    batch returns its own counter matrix and they are added as they arrive, so the memory used doesn't depend on the
+    number of iterations.
 
-            else:
-                shuffled_bigger = 0
+    Each batch permutates the labels with its own random generator spawned from seed, so the same seed gives the same
+    result with any number of threads.
 
-                for statistical_mean in statistical_mean_analysis:
-                    mean = statistical_mean.at[interaction_index, cluster_interaction_string]
-                    if mean > real_mean:
-                        shuffled_bigger += 1
+    If candidates (a boolean matrix with the real means shape) is set, only the candidate cells are evaluated: the
+    batches only calculate the shuffled means of the candidate cells (and the cluster means of their genes) and every
+    other cell gets a 0 counter. It is used to skip the cells whose pvalue is always 1 (see build_percent_result).
+    """
+    core_logger.info('Running Statistical Analysis')
+    real_means = real_mean_analysis.values.astype(np.float32)
+    shuffled_bigger = np.zeros(real_means.shape, dtype=np.int32)
+
+    candidate_cells = np.flatnonzero(candidates) if candidates is not None else None
+    if candidate_cells is not None:
+        core_logger.info('Evaluating {} of {} cells'.format(len(candidate_cells), real_means.size))
+        if not len(candidate_cells):
+            return pd.DataFrame(shuffled_bigger, index=real_mean_analysis.index, columns=real_mean_analysis.columns)
+
+    with tempfile.TemporaryDirectory(prefix='cpdb_') as shared_path:
+        shared_paths = share_permutation_data(dict(permutation_data, real_means=real_means), shared_path)
+        batches = get_permutation_batches(iterations, batch_size, seed)
+
+        with Pool(processes=threads, initializer=_load_permutation_data, initargs=(shared_paths,)) as pool:
+            if candidate_cells is None:
+                for batch_shuffled_bigger in pool.imap_unordered(_statistical_analysis, batches):
+                    shuffled_bigger += batch_shuffled_bigger
+            else:
+                cells_path = os.path.join(shared_path, 'candidate_cells.npy')
+                np.save(cells_path, candidate_cells)
 
-                result_percent = shuffled_bigger / len(statistical_mean_analysis)
+                cells_bigger = np.zeros(len(candidate_cells), dtype=np.int32)
+                for batch_cells_bigger in pool.imap_unordered(_cells_statistical_analysis,
+                                                              [(batch, cells_path) for batch in batches]):
+                    cells_bigger += batch_cells_bigger
 
-            percent_result.at[interaction_index, cluster_interaction_string] = result_percent
+                shuffled_bigger.ravel()[candidate_cells] = cells_bigger
 
-    return percent_result
+    return pd.DataFrame(shuffled_bigger, index=real_mean_analysis.index, columns=real_mean_analysis.columns)
 
 
-def interacting_pair_build(interactions: pd.DataFrame) -> pd.Series:
+def _statistical_analysis(batch: tuple) -> np.ndarray:
     """
-    Returns the interaction result formated with prefixes
+    Permutates the cluster labels of one batch and counts how many times the shuffled mean is bigger than the real mean
     """
+    start, stop, seed_sequence = batch
+    random_generator = np.random.default_rng(seed_sequence)
+    real_means = _permutation_data['real_means']
 
-    def get_interactor_name(interaction: pd.Series, suffix: str) -> str:
-        if interaction['is_complex{}'.format(suffix)]:
-            return interaction['name{}'.format(suffix)]
+    permutations_labels = np.array([random_generator.permutation(_permutation_data['labels'])
+                                    for _ in range(start, stop)])
 
-        return interaction['gene_name{}'.format(suffix)]
+    permutations_means = permutations_cluster_means(_permutation_data['counts'], permutations_labels,
+                                                    _permutation_data['sizes'])
 
-    interacting_pair = interactions.apply(
-        lambda interaction: '{}_{}'.format(get_interactor_name(interaction, '_1'),
-                                           get_interactor_name(interaction, '_2')), axis=1)
+    shuffled_bigger = np.zeros(real_means.shape, dtype=np.int32)
+    for cluster_means in permutations_means:
+        shuffled_bigger += interactions_cluster_means(cluster_means, _permutation_data['receptors'],
+                                                      _permutation_data['ligands'],
+                                                      _permutation_data['clusters_receptors'],
+                                                      _permutation_data['clusters_ligands']) > real_means
 
-    interacting_pair.rename('interacting_pair', inplace=True)
-
-    return interacting_pair
+    return shuffled_bigger
 
 
-def build_significant_means(real_mean_analysis: pd.DataFrame, result_percent: pd.DataFrame,
-                            min_significant_mean: float) -> (
-        pd.Series, pd.DataFrame):
+def adaptive_shuffled_analysis(iterations: int, permutation_data: dict, real_mean_analysis: pd.DataFrame,
+                               threads: int, exceedances: int, seed: int = None,
+                               batch_size: int = PERMUTATION_BATCH_SIZE,
+                               candidates: Optional[np.ndarray] = None) -> (pd.DataFrame, pd.DataFrame):
     """
-    Calculates the significant means and add rank (number of non empty entries divided by total entries)
+    Sequential (Besag-Clifford) version of shuffled_analysis: the permutations run in rounds of 1, 2, 4... batches
+    and every interaction and cluster interaction stops being evaluated once `exceedances` shuffled means are bigger
+    than its real mean. Cells with a real mean of 0 (or not in candidates, see shuffled_analysis) are not evaluated at
+    all. Only the genes of the cells still evaluated are used to calculate the shuffled cluster means of every round.
+
+    The batches and their random streams are the same of shuffled_analysis, so the cells that are never stopped get
+    exactly the same counters. Returns the shuffled_bigger counters and the effective iterations of every cell: the
+    pvalue of a stopped cell is estimated as its counter divided by its effective iterations.
     """
-    significant_means = get_significant_means(real_mean_analysis, result_percent, min_significant_mean)
-    significant_mean_rank = significant_means.count(axis=1)  # type: pd.Series
-    number_of_clusters = len(significant_means.columns)
-    significant_mean_rank = significant_mean_rank.apply(lambda rank: rank / number_of_clusters)
-    significant_mean_rank = significant_mean_rank.round(3)
-    significant_mean_rank.name = 'rank'
-    return significant_mean_rank, significant_means
+    core_logger.info('Running Adaptive Statistical Analysis (stop after {} exceedances)'.format(exceedances))
+    real_means = real_mean_analysis.values.astype(np.float32)
+    shuffled_bigger = np.zeros(real_means.shape, dtype=np.int32)
+    effective_iterations = np.zeros(real_means.shape, dtype=np.int32)
 
+    active = real_means.ravel() != 0
+    if candidates is not None:
+        active &= candidates.ravel()
+    batches = get_permutation_batches(iterations, batch_size, seed)
 
-def cluster_interaction_percent(cluster_interaction: tuple,
-                                interaction: pd.Series,
-                                clusters_percents: dict,
-                                suffixes: tuple = ('_1', '_2'),
-                                counts_data: str = 'ensembl'
-                                ) -> int:
+    with tempfile.TemporaryDirectory(prefix='cpdb_') as shared_path:
+        shared_paths = share_permutation_data(dict(permutation_data, real_means=real_means), shared_path)
+
+        with Pool(processes=threads, initializer=_load_permutation_data, initargs=(shared_paths,)) as pool:
+            round_start, round_size = 0, 1
+            while round_start < len(batches) and active.any():
+                round_batches = batches[round_start:round_start + round_size]
+                active_cells = np.flatnonzero(active)
+
+                active_path = os.path.join(shared_path, 'active_cells_{}.npy'.format(round_start))
+                np.save(active_path, active_cells)
+
+                cells_bigger = np.zeros(len(active_cells), dtype=np.int32)
+                for batch_cells_bigger in pool.imap_unordered(_cells_statistical_analysis,
+                                                              [(batch, active_path) for batch in round_batches]):
+                    cells_bigger += batch_cells_bigger
+
+                shuffled_bigger.ravel()[active_cells] += cells_bigger
+                effective_iterations.ravel()[active_cells] += sum(stop - start for start, stop, _ in round_batches)
+                active[active_cells[shuffled_bigger.ravel()[active_cells] >= exceedances]] = False
+
+                round_start += round_size
+                round_size *= 2
+
+    core_logger.info('Adaptive Statistical Analysis: {:.1f} mean effective iterations, {} of {} cells run all the '
+                     'iterations'.format(effective_iterations.mean() if effective_iterations.size else 0,
+                                         int((effective_iterations == iterations).sum()), effective_iterations.size))
+
+    return pd.DataFrame(shuffled_bigger, index=real_mean_analysis.index, columns=real_mean_analysis.columns), \
+        pd.DataFrame(effective_iterations, index=real_mean_analysis.index, columns=real_mean_analysis.columns)
+
+
+def _cells_statistical_analysis(task: tuple) -> np.ndarray:
     """
-    If one of both is not 0 the result is 0 other cases are 1
+    Permutates the cluster labels of one batch and counts, only for the given cells (flat positions in the result
+    matrix, stored in cells_path), how many times the shuffled mean is bigger than the real mean
     """
+    (start, stop, seed_sequence), cells_path = task
+    random_generator = np.random.default_rng(seed_sequence)
+    real_means = _permutation_data['real_means']
 
-    percent_cluster_receptors = clusters_percents[cluster_interaction[0]]
-    percent_cluster_ligands = clusters_percents[cluster_interaction[1]]
+    cells = np.load(cells_path)
+    rows, columns = np.divmod(cells, real_means.shape[1])
+    cells_real_means = real_means[rows, columns]
 
-    percent_receptor = percent_cluster_receptors[interaction['{}{}'.format(counts_data, suffixes[0])]]
-    percent_ligand = percent_cluster_ligands[interaction['{}{}'.format(counts_data, suffixes[1])]]
+    genes, genes_positions = np.unique(np.concatenate([_permutation_data['receptors'][rows],
+                                                       _permutation_data['ligands'][rows]]), return_inverse=True)
+    receptors, ligands = genes_positions[:len(rows)], genes_positions[len(rows):]
+    clusters_receptors = _permutation_data['clusters_receptors'][columns]
+    clusters_ligands = _permutation_data['clusters_ligands'][columns]
 
-    if percent_receptor or percent_ligand:
-        interaction_percent = 0
+    permutations_labels = np.array([random_generator.permutation(_permutation_data['labels'])
+                                    for _ in range(start, stop)])
 
-    else:
-        interaction_percent = 1
+    permutations_means = permutations_cluster_means(_permutation_data['counts'][genes], permutations_labels,
+                                                    _permutation_data['sizes'])
 
-    return interaction_percent
+    cells_bigger = np.zeros(len(cells), dtype=np.int32)
+    for cluster_means in permutations_means:
+        means_receptors = cluster_means[receptors, clusters_receptors]
+        means_ligands = cluster_means[ligands, clusters_ligands]
 
+        cells_means = (means_receptors + means_ligands) / 2
+        cells_means[(means_receptors == 0) | (means_ligands == 0)] = 0
 
-def counts_percent(counts: pd.Series, threshold: float) -> int:
+        cells_bigger += cells_means > cells_real_means
+
+    return cells_bigger
+
+
+def build_percent_result(real_mean_analysis: pd.DataFrame, real_perecents_analysis: pd.DataFrame,
+                         shuffled_bigger: pd.DataFrame, iterations: Union[int, pd.DataFrame]) -> pd.DataFrame:
     """
-    Calculates the number of positive values and divides it for the total.
-    If this value is < threshold, returns 1, else, returns 0
+    Calculates the pvalues after statistical analysis.
 
+    If real_percent or real_mean are zero, result_percent is 1
+
+    If not:
+    Divides the number of shuffled means bigger than the real mean by the number of the total iterations (or by the
+    effective iterations of every cell, for the adaptive analysis)
 
     EXAMPLE:
         INPUT:
-        counts = [0.1, 0.2, 0.3, 0.0]
-        threshold = 0.1
+
+        real_mean_analysis:
+                      cluster1_cluster1   cluster1_cluster2 ...
+        interaction1  0.5                 0.4
+        interaction2  0.0                 0.2
+
+
+        real_percents_analysis:
+                      cluster1_cluster1   cluster1_cluster2 ...
+        interaction1  1                   0
+        interaction2  0                   1
+
+        shuffled_bigger:
+                      cluster1_cluster1   cluster1_cluster2 ...
+        interaction1  1                   0
+        interaction2  0                   1
+
+        iterations = 2
+
 
         RESULT:
 
-        # 3/4 -> 0.75 not minor than 0.1
-        result = 0
-    """
-    total = len(counts)
-    positive = len(counts[counts > 0])
+                        cluster1_cluster1   cluster1_cluster2 ...
+        interaction1    0.5                 1
+        interaction2    1                   0.5
+
 
-    if positive / total < threshold:
-        return 1
+    """
+    core_logger.info('Building Pvalues result')
+    if isinstance(iterations, pd.DataFrame):
+        # Effective iterations of the adaptive analysis: cells never evaluated (0 iterations) get pvalue 1 below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent_result = shuffled_bigger.values / iterations.values
     else:
-        return 0
+        percent_result = shuffled_bigger.values / iterations
+
+    not_significative = (real_perecents_analysis.values.astype(int) == 0) | (real_mean_analysis.values == 0)
+    percent_result[not_significative] = 1.0
 
+    return pd.DataFrame(percent_result, index=real_mean_analysis.index, columns=real_mean_analysis.columns)
 
-def cluster_interaction_mean(cluster_interaction: tuple, interaction: pd.Series, clusters_means: dict,
-                             suffixes: tuple = ('_1', '_2'), counts_data: str = 'ensembl') -> float:
+
+def interacting_pair_build(interactions: pd.DataFrame) -> pd.Series:
     """
-    Calculates the mean value for two clusters.
+    Returns the interaction result formated with prefixes
+    """
+    interacting_pair = _interactor_name(interactions, '_1') + '_' + _interactor_name(interactions, '_2')
 
-    Set 0 if one of both is 0
+    interacting_pair.rename('interacting_pair', inplace=True)
+
+    return interacting_pair
+
+
+def _interactor_name(interactions: pd.DataFrame, suffix: str) -> pd.Series:
+    """
+    Complexes are named by the complex name and simple proteins by the gene name
     """
+    names = np.where(interactions['is_complex{}'.format(suffix)].astype(bool),
+                     interactions['name{}'.format(suffix)].astype(str),
+                     interactions['gene_name{}'.format(suffix)].astype(str))
 
-    means_cluster_receptors = clusters_means[cluster_interaction[0]]
-    means_cluster_ligands = clusters_means[cluster_interaction[1]]
+    return pd.Series(names, index=interactions.index, dtype=object)
 
-    receptor = interaction['{}{}'.format(counts_data, suffixes[0])]
-    mean_receptor = means_cluster_receptors[receptor]
-    mean_ligand = means_cluster_ligands[interaction['{}{}'.format(counts_data, suffixes[1])]]
 
-    if mean_receptor == 0 or mean_ligand == 0:
-        interaction_mean = 0
-    else:
-        interaction_mean = (mean_receptor + mean_ligand) / 2
+def partner_build(interactions: pd.DataFrame, suffix: str) -> pd.Series:
+    """
+    Adds the simple/complex prefixes to the interaction components names
+    """
+    prefixes = np.where(interactions['is_complex{}'.format(suffix)].astype(bool), 'complex:', 'simple:')
+
+    return pd.Series(prefixes, index=interactions.index, dtype=object) + \
+        interactions['name{}'.format(suffix)].astype(str)
+
 
-    return interaction_mean
+def build_significant_means(real_mean_analysis: pd.DataFrame, result_percent: pd.DataFrame,
+                            min_significant_mean: float) -> (
+        pd.Series, pd.DataFrame):
+    """
+    Calculates the significant means and add rank (number of non empty entries divided by total entries)
+    """
+    significant_means = get_significant_means(real_mean_analysis, result_percent, min_significant_mean)
+    significant_mean_rank = significant_means.count(axis=1)  # type: pd.Series
+    number_of_clusters = len(significant_means.columns)
+    significant_mean_rank = significant_mean_rank / number_of_clusters
+    significant_mean_rank = significant_mean_rank.round(3)
+    significant_mean_rank.name = 'rank'
+    return significant_mean_rank, significant_means
 
 
 def filter_interactions_by_counts(interactions: pd.DataFrame, counts: pd.DataFrame,
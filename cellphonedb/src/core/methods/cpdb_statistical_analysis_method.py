@@ -1,8 +1,13 @@
+from typing import Optional, Union
+
 import pandas as pd
 
+from cellphonedb.src.core.core_logger import core_logger
+from cellphonedb.src.core.exceptions.AllCountsFilteredException import AllCountsFilteredException
 from cellphonedb.src.core.exceptions.EmptyResultException import EmptyResultException
+from cellphonedb.src.core.exceptions.ThresholdNotAnalyzedException import ThresholdNotAnalyzedException
 from cellphonedb.src.core.methods import cpdb_statistical_analysis_simple_method, \
-    cpdb_statistical_analysis_complex_method
+    cpdb_statistical_analysis_complex_method, cpdb_statistical_analysis_helper
 
 
 def call(meta: pd.DataFrame,
@@ -18,42 +23,299 @@ def call(meta: pd.DataFrame,
          debug_seed: int,
          result_precision: int,
          pvalue: float,
-         separator: str
+         separator: str,
+         adaptive_exceedances: int = 0
          ) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    results = call_combinations(meta, count, counts_data, interactions, genes, complex_expanded, complex_composition,
+                                iterations, [threshold], threads, debug_seed, result_precision, [pvalue], separator,
+                                adaptive_exceedances)
+
+    return results[(threshold, pvalue)]
+
+
+def call_combinations(meta: pd.DataFrame,
+                      count: pd.DataFrame,
+                      counts_data: str,
+                      interactions: pd.DataFrame,
+                      genes: pd.DataFrame,
+                      complex_expanded: pd.DataFrame,
+                      complex_composition: pd.DataFrame,
+                      iterations: int,
+                      thresholds: list,
+                      threads: int,
+                      debug_seed: int,
+                      result_precision: int,
+                      pvalues: list,
+                      separator: str,
+                      adaptive_exceedances: int = 0
+                      ) -> dict:
+    """
+    Neither the real nor the shuffled means depend on the threshold or the pvalue, so the permutations run once and
+    the results of every (threshold, pvalue) combination are built from them. Returns a dict of
+    (deconvoluted, means, pvalues, significant_means) by (threshold, pvalue).
+    """
+    core_logger.info('[Cluster Statistical Analysis] Threshold:{} Pvalue:{}'.format(
+        ','.join(str(threshold) for threshold in thresholds), ','.join(str(pvalue) for pvalue in pvalues)))
+
+    analysis_data = build_analysis_data(meta, count, counts_data, interactions, genes, complex_expanded,
+                                        complex_composition, iterations, threads, debug_seed, separator,
+                                        adaptive_exceedances, min(thresholds))
+
+    return build_combinations_results(analysis_data, thresholds, pvalues, result_precision)
+
+
+def build_analysis_data(meta: pd.DataFrame,
+                        count: pd.DataFrame,
+                        counts_data: str,
+                        interactions: pd.DataFrame,
+                        genes: pd.DataFrame,
+                        complex_expanded: pd.DataFrame,
+                        complex_composition: pd.DataFrame,
+                        iterations: int,
+                        threads: int,
+                        debug_seed: int,
+                        separator: str,
+                        adaptive_exceedances: int = 0,
+                        candidates_threshold: Optional[float] = None
+                        ) -> dict:
+    """
+    Runs the threshold and pvalue independent part of the analysis: the real means, the clusters expressing fractions
+    and the shuffled means counters, with everything else needed to build the results (see
+    build_combinations_results).
+
+    Simple and complex interactions are prefiltered separately and scored together: the genes of both are merged in
+    one counts matrix, complex components are replaced by their significative gene and the real and shuffled means
+    are calculated once for all the interactions. The result is split back to build the simple and complex results.
+
+    If adaptive_exceedances is set, the permutations stop for every interaction and cluster interaction once
+    adaptive_exceedances shuffled means are bigger than its real mean (see adaptive_shuffled_analysis) and the
+    effective iterations of every cell are kept with the analysis data.
+
+    Only the cells whose pvalue is not always 1 are permuted: the ones with a real mean and, if candidates_threshold
+    is set, expressed with this threshold. Any threshold >= candidates_threshold can be built from the analysis data.
+    """
+    core_logger.info(
+        '[Cluster Statistical Analysis] '
+        'Iterations:{} Debug-seed:{} Threads:{}'.format(iterations, debug_seed, threads))
+    if debug_seed >= 0:
+        core_logger.warning('Debug random seed enabled. Setted to {}'.format(debug_seed))
+
+    cells_names = count.columns.tolist()
+
+    interactions_simple, counts_simple = cpdb_statistical_analysis_simple_method.prefilters(count,
+                                                                                            interactions,
+                                                                                            counts_data)
+    if interactions_simple.empty or counts_simple.empty:
+        interactions_simple, counts_simple = pd.DataFrame(), pd.DataFrame(columns=cells_names)
+
+    interactions_complex, interactions_complex_processed, counts_complex = _complex_prefilters(count,
+                                                                                              interactions,
+                                                                                              genes,
+                                                                                              complex_expanded,
+                                                                                              complex_composition,
+                                                                                              counts_data)
+
+    gene_columns = ['{}_1'.format(counts_data), '{}_2'.format(counts_data)]
+    interactions_scored = [interactions_filtered[gene_columns] for interactions_filtered in
+                           (interactions_simple, interactions_complex_processed) if not interactions_filtered.empty]
+    if not interactions_scored:
+        raise EmptyResultException
+
+    interactions_processed = pd.concat(interactions_scored, ignore_index=True)
+    counts_filtered = pd.concat([counts_simple[cells_names], counts_complex[cells_names]], sort=False)
+    counts_filtered = counts_filtered[~counts_filtered.index.duplicated()]
+
+    clusters = cpdb_statistical_analysis_helper.build_clusters(meta, counts_filtered)
+    core_logger.info('Running Real Analysis')
+
+    cluster_interactions = cpdb_statistical_analysis_helper.get_cluster_combinations(clusters['names'])
+    base_result = cpdb_statistical_analysis_helper.build_result_matrix(interactions_processed,
+                                                                       cluster_interactions,
+                                                                       separator)
+
+    real_mean_analysis = cpdb_statistical_analysis_helper.mean_analysis(interactions_processed,
+                                                                        clusters,
+                                                                        cluster_interactions,
+                                                                        base_result,
+                                                                        separator,
+                                                                        counts_data=counts_data)
+
+    permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(meta,
+                                                                              counts_filtered,
+                                                                              interactions_processed,
+                                                                              clusters['names'],
+                                                                              cluster_interactions,
+                                                                              counts_data=counts_data)
+
+    permutation_mean_analysis = cpdb_statistical_analysis_helper.permutation_mean_analysis(permutation_data,
+                                                                                           base_result)
+
+    expressing_fraction = cpdb_statistical_analysis_helper.clusters_expressing_fraction(clusters)
+
+    candidates = permutation_mean_analysis.values != 0
+    if candidates_threshold is not None:
+        candidates &= cpdb_statistical_analysis_helper.fraction_percent_analysis(expressing_fraction,
+                                                                                 candidates_threshold,
+                                                                                 interactions_processed,
+                                                                                 cluster_interactions,
+                                                                                 base_result,
+                                                                                 counts_data=counts_data).values != 0
+
+    effective_iterations = None
+    if adaptive_exceedances:
+        shuffled_bigger, effective_iterations = cpdb_statistical_analysis_helper.adaptive_shuffled_analysis(
+            iterations,
+            permutation_data,
+            permutation_mean_analysis,
+            threads,
+            adaptive_exceedances,
+            seed=debug_seed if debug_seed >= 0 else None,
+            candidates=candidates)
+    else:
+        shuffled_bigger = cpdb_statistical_analysis_helper.shuffled_analysis(
+            iterations,
+            permutation_data,
+            permutation_mean_analysis,
+            threads,
+            seed=debug_seed if debug_seed >= 0 else None,
+            candidates=candidates)
+
+    return {
+        'iterations': iterations,
+        'counts_data': counts_data,
+        'separator': separator,
+        'debug_seed': debug_seed,
+        'interactions_simple': interactions_simple,
+        'interactions_complex': interactions_complex,
+        'interactions_processed': interactions_processed,
+        'cluster_interactions': cluster_interactions,
+        'expressing_fraction': expressing_fraction,
+        'clusters_means': clusters['means'],
+        'real_mean_analysis': real_mean_analysis,
+        'permutation_mean_analysis': permutation_mean_analysis,
+        'shuffled_bigger': shuffled_bigger,
+        'effective_iterations': effective_iterations,
+        'candidates_threshold': candidates_threshold,
+        'complex_composition': complex_composition,
+        'genes': genes[genes[counts_data].isin(count.index)],
+        'counts_genes': count.index.tolist(),
+    }
+
+
+def build_combinations_results(analysis_data: dict, thresholds: list, pvalues: list, result_precision: int) -> dict:
+    """
+    Builds the results of every (threshold, pvalue) combination from the analysis data. Returns a dict of
+    (deconvoluted, means, pvalues, significant_means) by (threshold, pvalue).
+
+    The thresholds can't be lower than the candidates threshold of the analysis: the pairs expressed only with a lower
+    threshold were not permuted.
+    """
+    base_result = cpdb_statistical_analysis_helper.build_result_matrix(analysis_data['interactions_processed'],
+                                                                       analysis_data['cluster_interactions'],
+                                                                       analysis_data['separator'])
+
+    candidates_threshold = analysis_data.get('candidates_threshold')
+
+    results = {}
+    for threshold in thresholds:
+        if candidates_threshold is not None and threshold < candidates_threshold:
+            raise ThresholdNotAnalyzedException(threshold, candidates_threshold,
+                                                'Only the interactions expressed with the analysis thresholds were '
+                                                'permuted', 'Run the statistical analysis with this threshold')
+
+        real_percent_analysis = cpdb_statistical_analysis_helper.fraction_percent_analysis(
+            analysis_data['expressing_fraction'],
+            threshold,
+            analysis_data['interactions_processed'],
+            analysis_data['cluster_interactions'],
+            base_result,
+            counts_data=analysis_data['counts_data'])
+
+        result_percent = cpdb_statistical_analysis_helper.build_percent_result(
+            analysis_data['permutation_mean_analysis'],
+            real_percent_analysis,
+            analysis_data['shuffled_bigger'],
+            _get_iterations(analysis_data))
+
+        for pvalue in pvalues:
+            results[(threshold, pvalue)] = _build_results(analysis_data, result_percent, result_precision, pvalue)
+
+    return results
+
+
+def build_iterations_result(analysis_data: dict) -> Optional[pd.DataFrame]:
+    """
+    Returns the effective iterations of every interaction and cluster interaction of an adaptive analysis, or None if
+    every cell run all the iterations.
+    """
+    effective_iterations = analysis_data.get('effective_iterations')
+    if effective_iterations is None:
+        return None
+
+    iterations_results = []
+    start = 0
+    for interactions in (analysis_data['interactions_simple'], analysis_data['interactions_complex']):
+        if interactions.empty:
+            continue
+
+        interactions_data = pd.concat([interactions['id_cp_interaction'],
+                                       cpdb_statistical_analysis_helper.interacting_pair_build(interactions)], axis=1)
+        iterations_results.append(
+            pd.concat([interactions_data, _split_result(effective_iterations, start, interactions.index)], axis=1))
+        start += len(interactions)
+
+    return pd.concat(iterations_results, sort=False)
+
+
+def _get_iterations(analysis_data: dict) -> Union[int, pd.DataFrame]:
+    # Artifacts of previous versions have no effective iterations
+    effective_iterations = analysis_data.get('effective_iterations')
+
+    return effective_iterations if effective_iterations is not None else analysis_data['iterations']
+
+
+def _build_results(analysis_data: dict, result_percent: pd.DataFrame, result_precision: int,
+                   pvalue: float) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    interactions_simple = analysis_data['interactions_simple']
+    interactions_complex = analysis_data['interactions_complex']
+    real_mean_analysis = analysis_data['real_mean_analysis']
+    counts_data = analysis_data['counts_data']
+
     pvalues_simple, means_simple, significant_means_simple, deconvoluted_simple = \
-        cpdb_statistical_analysis_simple_method.call(meta.copy(),
-                                                     count.copy(),
-                                                     counts_data,
-                                                     interactions,
-                                                     pvalue,
-                                                     separator,
-                                                     iterations,
-                                                     threshold,
-                                                     threads,
-                                                     debug_seed,
-                                                     result_precision,
-                                                     )
+        pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    if not interactions_simple.empty:
+        pvalues_simple, means_simple, significant_means_simple, deconvoluted_simple = \
+            cpdb_statistical_analysis_simple_method.build_results(
+                interactions_simple,
+                _split_result(real_mean_analysis, 0, interactions_simple.index),
+                _split_result(result_percent, 0, interactions_simple.index),
+                dict(analysis_data['clusters_means']),
+                result_precision,
+                pvalue,
+                counts_data
+            )
 
     pvalues_complex, means_complex, significant_means_complex, deconvoluted_complex = \
-        cpdb_statistical_analysis_complex_method.call(meta.copy(),
-                                                      count.copy(),
-                                                      counts_data,
-                                                      interactions,
-                                                      genes,
-                                                      complex_expanded,
-                                                      complex_composition,
-                                                      pvalue,
-                                                      separator,
-                                                      iterations,
-                                                      threshold,
-                                                      threads,
-                                                      debug_seed,
-                                                      result_precision,
-                                                      )
-
-    pvalues = pvalues_simple.append(pvalues_complex, sort=False)
-    means = means_simple.append(means_complex, sort=False)
-    significant_means = significant_means_simple.append(significant_means_complex, sort=False)
+        pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    if not interactions_complex.empty:
+        pvalues_complex, means_complex, significant_means_complex, deconvoluted_complex = \
+            cpdb_statistical_analysis_complex_method.build_results(
+                interactions_complex,
+                _split_result(real_mean_analysis, len(interactions_simple), interactions_complex.index),
+                _split_result(result_percent, len(interactions_simple), interactions_complex.index),
+                dict(analysis_data['clusters_means']),
+                analysis_data['complex_composition'],
+                # Only the counts genes are used to build the complex results
+                pd.DataFrame(index=analysis_data['counts_genes']),
+                analysis_data['genes'],
+                result_precision,
+                pvalue,
+                counts_data
+            )
+
+    pvalues = pd.concat([pvalues_simple, pvalues_complex], sort=False)
+    means = pd.concat([means_simple, means_complex], sort=False)
+    significant_means = pd.concat([significant_means_simple, significant_means_complex], sort=False)
 
     if means.empty:
         raise EmptyResultException
@@ -62,7 +324,68 @@ def call(meta: pd.DataFrame,
     significant_means['rank'] = significant_means['rank'].apply(lambda rank: rank if rank != 0 else (1 + max_rank))
     significant_means.sort_values('rank', inplace=True)
 
-    deconvoluted = deconvoluted_simple.append(deconvoluted_complex, sort=False)
+    deconvoluted = pd.concat([deconvoluted_simple, deconvoluted_complex], sort=False)
     deconvoluted.drop_duplicates(inplace=True)
 
     return deconvoluted, means, pvalues, significant_means
+
+
+def _complex_prefilters(counts: pd.DataFrame, interactions: pd.DataFrame, genes: pd.DataFrame,
+                        complex_expanded: pd.DataFrame, complex_composition: pd.DataFrame,
+                        counts_data: str) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame):
+    """
+    Returns the complex interactions, the same interactions with the complex components replaced by their significative
+    gene and the counts of their genes.
+
+    Only the counts of the complex components and of the genes interacting with a complex are copied to the complex
+    prefilters, the rest of genes can't be part of a complex interaction.
+    """
+    cells_names = sorted(counts.columns)
+
+    if not counts.index.isin(genes[counts_data]).any():
+        raise AllCountsFilteredException(hint='Are you using human data?')
+
+    counts_complex = counts.loc[counts.index.isin(_complex_interactions_genes(interactions, genes, complex_composition,
+                                                                              counts_data))].copy()
+    if counts_complex.empty:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(columns=counts.columns)
+
+    interactions_filtered, counts_filtered, complex_in_counts = \
+        cpdb_statistical_analysis_complex_method.prefilters(interactions, counts_complex, genes, complex_expanded,
+                                                            complex_composition, counts_data)
+
+    if interactions_filtered.empty:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(columns=counts.columns)
+
+    complex_significative_protein = cpdb_statistical_analysis_complex_method.get_complex_significative(
+        complex_in_counts, counts_filtered, complex_composition, cells_names)
+
+    interactions_processed = cpdb_statistical_analysis_complex_method.get_interactions_processed(
+        interactions_filtered, complex_significative_protein, counts_data=counts_data)
+
+    return interactions_filtered, interactions_processed, counts_filtered
+
+
+def _complex_interactions_genes(interactions: pd.DataFrame, genes: pd.DataFrame, complex_composition: pd.DataFrame,
+                                counts_data: str) -> pd.Series:
+    """
+    Returns the genes of the complex components and the simple components of the complex interactions
+    """
+    components_genes = genes.loc[genes['id_multidata'].isin(complex_composition['protein_multidata_id']),
+                                 counts_data]
+
+    complex_interactions = interactions[interactions['is_complex_1'].astype(bool) |
+                                        interactions['is_complex_2'].astype(bool)]
+    interactions_genes = [complex_interactions['{}{}'.format(counts_data, suffix)] for suffix in ('_1', '_2')]
+
+    return pd.concat([components_genes] + interactions_genes).dropna()
+
+
+def _split_result(result: pd.DataFrame, start: int, index: pd.Index) -> pd.DataFrame:
+    """
+    Takes the rows of one branch from a result of the merged interactions and restores the branch interactions index
+    """
+    branch_result = result.iloc[start:start + len(index)].copy()
+    branch_result.index = index
+
+    return branch_result
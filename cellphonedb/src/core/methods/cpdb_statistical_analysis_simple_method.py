@@ -4,91 +4,6 @@ from cellphonedb.src.core.core_logger import core_logger
 from cellphonedb.src.core.methods import cpdb_statistical_analysis_helper
 
 
-def call(meta: pd.DataFrame,
-         counts: pd.DataFrame,
-         counts_data: str,
-         interactions: pd.DataFrame,
-         pvalue: float,
-         separator: str,
-         iterations: int = 1000,
-         threshold: float = 0.1,
-         threads: int = 4,
-         debug_seed: int = -1,
-         result_precision: int = 3,
-         ) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
-    core_logger.info(
-        '[Cluster Statistical Analysis Simple] '
-        'Threshold:{} Iterations:{} Debug-seed:{} Threads:{} Precision:{}'.format(threshold,
-                                                                                  iterations,
-                                                                                  debug_seed,
-                                                                                  threads,
-                                                                                  result_precision))
-
-    if debug_seed >= 0:
-        pd.np.random.seed(debug_seed)
-        core_logger.warning('Debug random seed enabled. Setted to {}'.format(debug_seed))
-
-    interactions_filtered, counts_filtered = prefilters(counts, interactions, counts_data)
-
-    if interactions_filtered.empty or counts_filtered.empty:
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-
-    clusters = cpdb_statistical_analysis_helper.build_clusters(meta, counts_filtered)
-    core_logger.info('Running Real Simple Analysis')
-    cluster_interactions = cpdb_statistical_analysis_helper.get_cluster_combinations(clusters['names'])
-
-    base_result = cpdb_statistical_analysis_helper.build_result_matrix(interactions_filtered,
-                                                                       cluster_interactions,
-                                                                       separator)
-
-    real_mean_analysis = cpdb_statistical_analysis_helper.mean_analysis(interactions_filtered,
-                                                                        clusters,
-                                                                        cluster_interactions,
-                                                                        base_result,
-                                                                        separator,
-                                                                        suffixes=('_1', '_2'),
-                                                                        counts_data=counts_data)
-
-    real_percent_analysis = cpdb_statistical_analysis_helper.percent_analysis(clusters,
-                                                                              threshold,
-                                                                              interactions_filtered,
-                                                                              cluster_interactions,
-                                                                              base_result,
-                                                                              separator,
-                                                                              suffixes=('_1', '_2'),
-                                                                              counts_data=counts_data)
-
-    statistical_mean_analysis = cpdb_statistical_analysis_helper.shuffled_analysis(iterations, meta,
-                                                                                   counts_filtered,
-                                                                                   interactions_filtered,
-                                                                                   cluster_interactions,
-                                                                                   base_result,
-                                                                                   threads,
-                                                                                   separator,
-                                                                                   suffixes=('_1', '_2'),
-                                                                                   counts_data=counts_data)
-
-    result_percent = cpdb_statistical_analysis_helper.build_percent_result(real_mean_analysis,
-                                                                           real_percent_analysis,
-                                                                           statistical_mean_analysis,
-                                                                           interactions_filtered,
-                                                                           cluster_interactions,
-                                                                           base_result,
-                                                                           separator)
-
-    pvalues_result, means_result, significant_means, deconvoluted_result = build_results(
-        interactions_filtered,
-        real_mean_analysis,
-        result_percent,
-        clusters['means'],
-        result_precision,
-        pvalue,
-        counts_data
-    )
-
-    return pvalues_result, means_result, significant_means, deconvoluted_result
-
-
 def build_results(interactions: pd.DataFrame,
                   real_mean_analysis: pd.DataFrame,
                   result_percent: pd.DataFrame,
@@ -118,10 +33,8 @@ def build_results(interactions: pd.DataFrame,
                  **gene_renames},
         inplace=True)
 
-    interactions_data_result['partner_a'] = interactions_data_result['partner_a'].apply(
-        lambda name: 'simple:{}'.format(name))
-    interactions_data_result['partner_b'] = interactions_data_result['partner_b'].apply(
-        lambda name: 'simple:{}'.format(name))
+    interactions_data_result['partner_a'] = 'simple:' + interactions_data_result['partner_a'].astype(str)
+    interactions_data_result['partner_b'] = 'simple:' + interactions_data_result['partner_b'].astype(str)
 
     # Dedupe rows and filter only desired columns
     interactions_data_result.drop_duplicates(inplace=True)
@@ -1,10 +1,13 @@
+from typing import Union, Optional
+
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
-from cellphonedb.src.core.database import DatabaseManager
+from cellphonedb.src.core.database import DatabaseManager, analysis_bundle
 from cellphonedb.src.core.exceptions.ThresholdValueException import ThresholdValueException
 from cellphonedb.src.core.methods import cpdb_analysis_method, cpdb_statistical_analysis_method
 from cellphonedb.src.core.preprocessors import method_preprocessors
+from cellphonedb.src.core.utils.sparse_counts import SparseCounts
 from cellphonedb.src.core.utils.subsampler import Subsampler
 from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
 
@@ -26,6 +29,13 @@ class MethodLauncher:
         multidatas = self.database_manager.get_repository('multidata').get_multidatas_from_string(string)
         return multidatas
 
+    def get_counts_genes(self, counts_data: str) -> list:
+        """
+        Returns the database genes identified by counts_data. The methods discard any other counts row, so the
+        launchers use it to skip them when reading and casting the counts.
+        """
+        return analysis_bundle.get_analysis_bundle(self.database_manager)['counts_genes'][counts_data]
+
     def cpdb_statistical_analysis_launcher(self,
                                            raw_meta: pd.DataFrame,
                                            counts: pd.DataFrame,
@@ -37,44 +47,129 @@ class MethodLauncher:
                                            result_precision: int,
                                            pvalue: float,
                                            subsampler: Subsampler = None,
+                                           adaptive_exceedances: int = 0,
                                            ) -> (pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame):
 
+        results = self.cpdb_statistical_analysis_combinations_launcher(raw_meta,
+                                                                       counts,
+                                                                       counts_data,
+                                                                       iterations,
+                                                                       [threshold],
+                                                                       threads,
+                                                                       debug_seed,
+                                                                       result_precision,
+                                                                       [pvalue],
+                                                                       subsampler,
+                                                                       adaptive_exceedances)
+
+        return results[(threshold, pvalue)]
+
+    def cpdb_statistical_analysis_combinations_launcher(self,
+                                                        raw_meta: pd.DataFrame,
+                                                        counts: pd.DataFrame,
+                                                        counts_data: str,
+                                                        iterations: int,
+                                                        thresholds: list,
+                                                        threads: int,
+                                                        debug_seed: int,
+                                                        result_precision: int,
+                                                        pvalues: list,
+                                                        subsampler: Subsampler = None,
+                                                        adaptive_exceedances: int = 0,
+                                                        ) -> dict:
+        """
+        Runs the permutations once and returns the (pvalues, means, significant_means, deconvoluted) results of every
+        (threshold, pvalue) combination
+        """
+        self.thresholds_validations(thresholds)
+
+        analysis_data = self.cpdb_statistical_analysis_data_launcher(raw_meta,
+                                                                     counts,
+                                                                     counts_data,
+                                                                     iterations,
+                                                                     threads,
+                                                                     debug_seed,
+                                                                     subsampler,
+                                                                     adaptive_exceedances,
+                                                                     min(thresholds))
+
+        return self.cpdb_statistical_analysis_render_launcher(analysis_data, thresholds, pvalues, result_precision)
+
+    def cpdb_statistical_analysis_data_launcher(self,
+                                                raw_meta: pd.DataFrame,
+                                                counts: pd.DataFrame,
+                                                counts_data: str,
+                                                iterations: int,
+                                                threads: int,
+                                                debug_seed: int,
+                                                subsampler: Subsampler = None,
+                                                adaptive_exceedances: int = 0,
+                                                candidates_threshold: Optional[float] = None,
+                                                ) -> dict:
+        """
+        Runs the threshold and pvalue independent part of the statistical analysis (see
+        cpdb_statistical_analysis_method.build_analysis_data). Only the pairs expressed with candidates_threshold are
+        permuted, so the results can't be built for lower thresholds.
+        """
         if threads < 1:
             core_logger.info('Using Default thread number: %s' % self.default_threads)
             threads = self.default_threads
 
-        if threshold < 0 or threshold > 1:
-            raise ThresholdValueException(threshold)
-
         meta = method_preprocessors.meta_preprocessor(raw_meta)
+        bundle = analysis_bundle.get_analysis_bundle(self.database_manager)
+        genes = bundle['genes']
+
+        if subsampler is None:
+            counts = self._filter_counts_genes(counts, genes[counts_data])
+
         counts = self._counts_validations(counts, meta)
 
         if subsampler is not None:
             counts = subsampler.subsample(counts)
             meta = meta.filter(items=(list(counts)), axis=0)
 
-        interactions = self.database_manager.get_repository('interaction').get_all_expanded()
-        genes = self.database_manager.get_repository('gene').get_all_expanded()
-        complex_composition = self.database_manager.get_repository('complex').get_all_compositions()
-        complex_expanded = self.database_manager.get_repository('complex').get_all_expanded()
-
-        deconvoluted, means, pvalues, significant_means = \
-            cpdb_statistical_analysis_method.call(meta,
-                                                  counts,
-                                                  counts_data,
-                                                  interactions,
-                                                  genes,
-                                                  complex_expanded,
-                                                  complex_composition,
-                                                  iterations,
-                                                  threshold,
-                                                  threads,
-                                                  debug_seed,
-                                                  result_precision,
-                                                  pvalue,
-                                                  self.separator)
-
-        return pvalues, means, significant_means, deconvoluted
+        interactions = bundle['interactions']
+        complex_composition = bundle['complex_composition']
+        complex_expanded = bundle['complex_expanded']
+
+        return cpdb_statistical_analysis_method.build_analysis_data(meta,
+                                                                    counts,
+                                                                    counts_data,
+                                                                    interactions,
+                                                                    genes,
+                                                                    complex_expanded,
+                                                                    complex_composition,
+                                                                    iterations,
+                                                                    threads,
+                                                                    debug_seed,
+                                                                    self.separator,
+                                                                    adaptive_exceedances,
+                                                                    candidates_threshold)
+
+    def cpdb_statistical_analysis_render_launcher(self,
+                                                  analysis_data: dict,
+                                                  thresholds: list,
+                                                  pvalues: list,
+                                                  result_precision: int,
+                                                  ) -> dict:
+        """
+        Builds the (pvalues, means, significant_means, deconvoluted) results of every (threshold, pvalue) combination
+        from the statistical analysis data, without running the permutations
+        """
+        self.thresholds_validations(thresholds)
+
+        results = cpdb_statistical_analysis_method.build_combinations_results(analysis_data, thresholds, pvalues,
+                                                                              result_precision)
+
+        return {combination: (pvalues_result, means, significant_means, deconvoluted)
+                for combination, (deconvoluted, means, pvalues_result, significant_means) in results.items()}
+
+    def cpdb_statistical_analysis_iterations_launcher(self, analysis_data: dict) -> Optional[pd.DataFrame]:
+        """
+        Returns the effective iterations of every interaction and cluster interaction of an adaptive statistical
+        analysis, or None if the analysis was not adaptive
+        """
+        return cpdb_statistical_analysis_method.build_iterations_result(analysis_data)
 
     def cpdb_method_analysis_launcher(self,
                                       raw_meta: pd.DataFrame,
@@ -88,6 +183,11 @@ class MethodLauncher:
         if threshold < 0 or threshold > 1:
             raise ThresholdValueException(threshold)
         meta = method_preprocessors.meta_preprocessor(raw_meta)
+        bundle = analysis_bundle.get_analysis_bundle(self.database_manager)
+        genes = bundle['genes']
+
+        if subsampler is None:
+            counts = self._filter_counts_genes(counts, genes[counts_data])
 
         counts = self._counts_validations(counts, meta)
 
@@ -95,10 +195,9 @@ class MethodLauncher:
             counts = subsampler.subsample(counts)
             meta = meta.filter(items=list(counts), axis=0)
 
-        interactions = self.database_manager.get_repository('interaction').get_all_expanded()
-        genes = self.database_manager.get_repository('gene').get_all_expanded()
-        complex_composition = self.database_manager.get_repository('complex').get_all_compositions()
-        complex_expanded = self.database_manager.get_repository('complex').get_all_expanded()
+        interactions = bundle['interactions']
+        complex_composition = bundle['complex_composition']
+        complex_expanded = bundle['complex_expanded']
 
         means, significant_means, deconvoluted = cpdb_analysis_method.call(
             meta,
@@ -115,13 +214,40 @@ class MethodLauncher:
         return means, significant_means, deconvoluted
 
     @staticmethod
-    def _counts_validations(counts: pd.DataFrame, meta: pd.DataFrame) -> pd.DataFrame:
+    def _filter_counts_genes(counts: Union[pd.DataFrame, SparseCounts],
+                             counts_genes: pd.Series) -> Union[pd.DataFrame, SparseCounts]:
+        """
+        Keeps only the counts of database genes before the counts are densified and casted. The subsampler needs all
+        the genes, so it is not called when subsampling.
+        """
+        if isinstance(counts, SparseCounts):
+            counts = counts.filter_genes(counts_genes)
+        else:
+            counts = counts[counts.index.isin(counts_genes)]
+
+        core_logger.info('Counts filtered to {} database genes'.format(counts.shape[0]))
+
+        return counts
+
+    @staticmethod
+    def thresholds_validations(thresholds: list) -> None:
+        for threshold in thresholds:
+            if threshold < 0 or threshold > 1:
+                raise ThresholdValueException(threshold)
+
+    @staticmethod
+    def _counts_validations(counts: Union[pd.DataFrame, SparseCounts], meta: pd.DataFrame) -> pd.DataFrame:
+        if isinstance(counts, SparseCounts):
+            counts = counts.to_dataframe()
+
         if not len(counts.columns):
             raise ParseCountsException('Counts values are not decimal values', 'Incorrect file format')
-        try:
-            counts = counts.astype(pd.np.float)  # type: pd.DataFrame
-        except:
-            raise ParseCountsException
+        # Counts read as floats (float32 by the counts reader) are kept as they are, anything else is casted to float32
+        if not all(pd.api.types.is_float_dtype(dtype) for dtype in counts.dtypes):
+            try:
+                counts = counts.astype(pd.np.float32)  # type: pd.DataFrame
+            except:
+                raise ParseCountsException
         meta.index = meta.index.astype(str)
         for cell in meta.index.values:
             if cell not in counts.columns.values:
@@ -1,5 +1,6 @@
 import itertools
 
+import numpy as np
 import pandas as pd
 
 from cellphonedb.src.core.core_logger import core_logger
@@ -29,16 +30,19 @@ def merge_complex_counts(clusters_names: list, complex_counts_composition: pd.Da
     if complex_counts_composition.empty:
         return pd.DataFrame()
 
-    def set_complex_cluster_counts(row):
-        scores_complex = complex_counts_composition[
-            row['complex_multidata_id'] == complex_counts_composition['complex_multidata_id']]
+    # Components are sorted by complex, so each complex is a block of rows reduced to its minimum values
+    complex_ids = complex_counts_composition['complex_multidata_id'].values
+    components_order = np.argsort(complex_ids, kind='stable')
+    components_ids = complex_ids[components_order]
 
-        for cluster_name in clusters_names:
-            row[cluster_name] = scores_complex[cluster_name].min()
-        return row
+    complex_starts = np.flatnonzero(np.r_[True, components_ids[1:] != components_ids[:-1]])
+    complex_minimums = np.minimum.reduceat(complex_counts_composition[clusters_names].values[components_order],
+                                           complex_starts, axis=0)
+
+    complex_counts = complex_counts_composition.drop_duplicates(['complex_multidata_id']).copy()
+    complex_positions = np.searchsorted(components_ids[complex_starts], complex_counts['complex_multidata_id'].values)
+    complex_counts[clusters_names] = complex_minimums[complex_positions]
 
-    complex_counts = complex_counts_composition.drop_duplicates(['complex_multidata_id'])
-    complex_counts = complex_counts.apply(set_complex_cluster_counts, axis=1)
     complex_counts = complex_counts[clusters_names + complex_columns_names]
     return complex_counts
 
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from cellphonedb.src.app.cpdb_app import create_app
+from cellphonedb.src.core.Cellphonedb import cellphone_core_dir
+from cellphonedb.src.core.database import analysis_bundle
+
+
+class TestAnalysisBundle(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.original_dirs = analysis_bundle.cpdb_releases, analysis_bundle.cpdb_bundles
+        analysis_bundle.cpdb_releases = os.path.join(self.temp_dir, 'releases')
+        analysis_bundle.cpdb_bundles = os.path.join(self.temp_dir, 'bundles')
+
+        self.release_dir = os.path.join(analysis_bundle.cpdb_releases, 'v0.0.1')
+        os.makedirs(self.release_dir)
+        self.database_file = os.path.join(self.release_dir, 'cellphone.db')
+        shutil.copy(os.path.join(cellphone_core_dir, 'cellphone.db'), self.database_file)
+
+    def tearDown(self):
+        analysis_bundle.cpdb_releases, analysis_bundle.cpdb_bundles = self.original_dirs
+        shutil.rmtree(self.temp_dir)
+
+    def test_bundle_stored_next_to_release_database(self):
+        database_manager = create_app(False, self.database_file).database_manager
+
+        bundle = analysis_bundle.get_analysis_bundle(database_manager)
+        bundle_files = self._bundle_files(self.release_dir)
+        loaded_bundle = analysis_bundle.get_analysis_bundle(database_manager)
+
+        self.assertEqual(bundle_files, ['analysis_bundle_{}.pkl'.format(analysis_bundle.file_hash(self.database_file))])
+        self.assertTrue(loaded_bundle['interactions'].equals(
+            database_manager.get_repository('interaction').get_all_expanded()))
+        self.assertTrue(loaded_bundle['complex_expanded'].equals(bundle['complex_expanded']))
+        self.assertEqual(loaded_bundle['counts_genes']['ensembl'],
+                         bundle['genes']['ensembl'].dropna().unique().tolist())
+
+    def test_bundle_rebuilt_when_database_changes(self):
+        database_manager = create_app(False, self.database_file).database_manager
+        analysis_bundle.get_analysis_bundle(database_manager)
+
+        with open(self.database_file, 'ab') as f:
+            f.write(b'\0' * 512)
+        analysis_bundle.get_analysis_bundle(database_manager)
+
+        self.assertEqual(self._bundle_files(self.release_dir),
+                         ['analysis_bundle_{}.pkl'.format(analysis_bundle.file_hash(self.database_file))])
+
+    def test_bundle_kept_in_memory(self):
+        database_manager = create_app(False, self.database_file).database_manager
+        bundle = analysis_bundle.get_analysis_bundle(database_manager)
+
+        with mock.patch.object(analysis_bundle, 'file_hash', wraps=analysis_bundle.file_hash) as file_hash:
+            loaded_bundle = analysis_bundle.get_analysis_bundle(database_manager)
+            loaded_bundle['genes'].drop(loaded_bundle['genes'].index, inplace=True)
+
+            self.assertEqual(file_hash.call_count, 0)
+            self.assertTrue(analysis_bundle.get_analysis_bundle(database_manager)['genes'].equals(bundle['genes']))
+
+            with open(self.database_file, 'ab') as f:
+                f.write(b'\0' * 512)
+            analysis_bundle.get_analysis_bundle(database_manager)
+
+            self.assertEqual(file_hash.call_count, 1)
+
+    def test_bundle_of_custom_database(self):
+        database_file = os.path.join(self.temp_dir, 'custom.db')
+        shutil.copy(self.database_file, database_file)
+
+        analysis_bundle.get_analysis_bundle(create_app(False, database_file).database_manager)
+
+        self.assertEqual(len(self._bundle_files(analysis_bundle.cpdb_bundles)), 1)
+
+    @staticmethod
+    def _bundle_files(folder: str) -> list:
+        return [file for file in os.listdir(folder) if file.startswith(analysis_bundle.bundle_prefix)]
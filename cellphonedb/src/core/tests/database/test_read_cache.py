@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import pandas as pd
+
+from cellphonedb.src.app.cpdb_app import create_app
+from cellphonedb.src.core.Cellphonedb import cellphone_core_dir
+from cellphonedb.src.core.collectors import protein_preprocess_collector, gene_preprocess_collector, \
+    complex_preprocess_collector, interaction_preprocess_collector
+from cellphonedb.src.core.collectors.collector import Collector
+from cellphonedb.src.core.database.ReadCache import ReadCache
+from cellphonedb.src.core.database.sqlalchemy_repository.ComplexRepository import ComplexRepository
+from cellphonedb.src.core.database.sqlalchemy_repository.GeneRepository import GeneRepository
+from cellphonedb.src.core.database.sqlalchemy_repository.InteractionRepository import InteractionRepository
+from cellphonedb.src.core.database.sqlalchemy_repository.ProteinRepository import ProteinRepository
+
+
+class TestReadCache(TestCase):
+    def test_least_recently_used_evicted(self):
+        cache = ReadCache(max_size=2)
+        reads = []
+
+        def read(key):
+            return cache.get(key, lambda: reads.append(key) or key)
+
+        for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+            read(key)
+
+        self.assertEqual(reads, ['a', 'b', 'c', 'b'])
+        self.assertEqual(len(cache), 2)
+
+    def test_results_are_copies(self):
+        cache = ReadCache()
+        cache.get('key', lambda: pd.DataFrame({'value': [1, 2]}))
+
+        result = cache.get('key', lambda: None)
+        result.loc[0, 'value'] = 10
+        result['other'] = 0
+
+        self.assertTrue(cache.get('key', lambda: None).equals(pd.DataFrame({'value': [1, 2]})))
+
+    def test_repository_reads_cached(self):
+        database_manager = create_app(False).database_manager
+        read_cache = database_manager.database.read_cache
+
+        interactions = database_manager.get_repository('interaction').get_all_expanded()
+        cached_reads = len(read_cache)
+
+        self.assertTrue(database_manager.get_repository('interaction').get_all_expanded().equals(interactions))
+        self.assertEqual(len(read_cache), cached_reads)
+        self.assertFalse(database_manager.get_repository('interaction').get_all_expanded(suffixes=('_a', '_b')).equals(
+            interactions))
+
+        read_cache.clear()
+        self.assertEqual(len(read_cache), 0)
+
+    def test_string_lookups_not_cached(self):
+        database_manager = create_app(False).database_manager
+        read_cache = database_manager.database.read_cache
+        multidata_repository = database_manager.get_repository('multidata')
+
+        multidata_repository.get_multidatas_from_string('CD44')
+        cached_reads = len(read_cache)
+
+        for input_string in ['CD74', 'APP', 'ENSG00000026508']:
+            multidata_repository.get_multidatas_from_string(input_string)
+
+        self.assertEqual(len(read_cache), cached_reads)
+
+    def test_collector_writes_clear_cache(self):
+        database_manager = create_app(False).database_manager
+        read_cache = database_manager.database.read_cache
+        collector = Collector(database_manager)
+        writes = [
+            ('protein', protein_preprocess_collector, ProteinRepository, 'add_proteins', (None, None)),
+            ('gene', gene_preprocess_collector, GeneRepository, 'add', None),
+            ('complex', complex_preprocess_collector, ComplexRepository, 'add', None),
+            ('interaction', interaction_preprocess_collector, InteractionRepository, 'add', None),
+        ]
+
+        for collector_method, preprocess_collector, repository, add_method, preprocessed in writes:
+            database_manager.get_repository('interaction').get_all_expanded()
+            self.assertGreater(len(read_cache), 0)
+
+            with mock.patch.object(preprocess_collector, 'call', return_value=preprocessed), \
+                    mock.patch.object(repository, add_method) as add:
+                getattr(collector, collector_method)(pd.DataFrame())
+
+            add.assert_called_once()
+            self.assertEqual(len(read_cache), 0, collector_method)
+
+    def test_drop_everything_clears_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            database_file = os.path.join(temp_dir, 'cellphone.db')
+            shutil.copy(os.path.join(cellphone_core_dir, 'cellphone.db'), database_file)
+            database = create_app(False, database_file).database_manager.database
+
+            database.read_cache.get('key', lambda: pd.DataFrame())
+            database.drop_everything()
+
+            self.assertEqual(len(database.read_cache), 0)
+        finally:
+            shutil.rmtree(temp_dir)
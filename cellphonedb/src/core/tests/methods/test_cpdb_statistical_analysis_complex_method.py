@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.core.methods import cpdb_statistical_analysis_complex_method
+
+
+class TestCpdbStatisticalAnalysisComplexMethod(TestCase):
+    def setUp(self):
+        self.interactions = pd.DataFrame({'id_cp_interaction': ['a', 'b', 'c', 'd', 'd'],
+                                          'ensembl_1': ['gene_1', None, 'gene_2', 'gene_5', 'gene_5'],
+                                          'ensembl_2': ['gene_3', 'gene_4', None, None, None],
+                                          'is_complex_1': [False, True, False, False, False],
+                                          'is_complex_2': [False, False, True, True, True],
+                                          'multidata_1_id': [1, 10, 2, 5, 5],
+                                          'multidata_2_id': [3, 4, 20, 30, 30]},
+                                         index=[5, 6, 7, 8, 9])
+
+    def test_filter_interactions_by_genes(self):
+        result = cpdb_statistical_analysis_complex_method.filter_interactions_by_genes(self.interactions,
+                                                                                      ['gene_3', 'gene_4', 'gene_5'])
+
+        self.assertEqual(list(result.index), [5, 6, 8, 9])
+
+    def test_filter_interactions_by_complexes(self):
+        complexes = pd.DataFrame({'complex_multidata_id': [10, 30, 30]})
+
+        result = cpdb_statistical_analysis_complex_method.filter_interactions_by_complexes(self.interactions,
+                                                                                          complexes)
+
+        self.assertEqual(list(result.index), [6, 8])
+
+    def test_get_complex_significative(self):
+        complexes = pd.DataFrame({'complex_multidata_id': [10, 20], 'id_complex': [1, 2],
+                                  'name': ['complex_1', 'complex_2']})
+        complex_composition = pd.DataFrame({'complex_multidata_id': [10, 10, 20, 20],
+                                            'protein_multidata_id': [1, 2, 2, 3]})
+        counts = pd.DataFrame({'cell_1': [0.5, 0.2, 0.9], 'cell_2': [0.5, 0.4, 0.0],
+                               'id_multidata': [1, 2, 3], 'gene': ['gene_1', 'gene_2', 'gene_3'],
+                               'name': ['protein_1', 'protein_2', 'protein_3']})
+
+        result = cpdb_statistical_analysis_complex_method.get_complex_significative(complexes, counts,
+                                                                                   complex_composition,
+                                                                                   ['cell_1', 'cell_2'])
+
+        self.assertEqual(result.to_dict(), {'complex_1': 'gene_2', 'complex_2': 'gene_2'})
+
+    def test_get_complex_significative_ties(self):
+        complexes = pd.DataFrame({'complex_multidata_id': [10, 20], 'id_complex': [1, 2],
+                                  'name': ['complex_1', 'complex_2']})
+        complex_composition = pd.DataFrame({'complex_multidata_id': [10, 10, 20, 20],
+                                            'protein_multidata_id': [1, 2, 3, 4]})
+        # complex_1 means are 8388608.5 and 8388608 (equal if they were summed in float32), complex_2 means are tied
+        counts = pd.DataFrame({'cell_1': np.array([2 ** 24, 2 ** 24, 0.5, 0.25], dtype=np.float32),
+                               'cell_2': np.array([1, 0, 0.5, 0.75], dtype=np.float32),
+                               'id_multidata': [1, 2, 3, 4], 'gene': ['gene_1', 'gene_2', 'gene_3', 'gene_4'],
+                               'name': ['protein_1', 'protein_2', 'protein_3', 'protein_4']})
+
+        result = cpdb_statistical_analysis_complex_method.get_complex_significative(complexes, counts,
+                                                                                   complex_composition,
+                                                                                   ['cell_1', 'cell_2'])
+
+        # Ties are resolved by the first component
+        self.assertEqual(result.to_dict(), {'complex_1': 'gene_2', 'complex_2': 'gene_3'})
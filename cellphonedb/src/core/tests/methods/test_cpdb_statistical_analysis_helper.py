@@ -0,0 +1,258 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.core.methods import cpdb_statistical_analysis_helper, cpdb_analysis_helper
+
+
+class TestCpdbStatisticalAnalysisHelper(TestCase):
+    separator = '|'
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+
+        genes = ['gene_{}'.format(number) for number in range(12)]
+        cells = ['cell_{}'.format(number) for number in range(30)]
+
+        values = random_state.poisson(0.6, (len(genes), len(cells))).astype(float)
+        values[3] = 0
+        self.counts = pd.DataFrame(values, index=genes, columns=cells)
+
+        self.meta = pd.DataFrame({'cell_type': random_state.choice(['cluster_b', 'cluster_a', 'cluster_c'],
+                                                                   len(cells))},
+                                 index=cells)
+
+        self.interactions = pd.DataFrame({'ensembl_1': random_state.choice(genes, 20),
+                                          'ensembl_2': random_state.choice(genes, 20)},
+                                         index=range(100, 120))
+
+        self.clusters = cpdb_statistical_analysis_helper.build_clusters(self.meta, self.counts)
+        self.cluster_interactions = cpdb_statistical_analysis_helper.get_cluster_combinations(self.clusters['names'])
+        self.base_result = cpdb_statistical_analysis_helper.build_result_matrix(self.interactions,
+                                                                                self.cluster_interactions,
+                                                                                self.separator)
+
+    def test_mean_analysis(self):
+        interactions, clusters, cluster_interactions, base_result = self._hand_computed_data()
+
+        result = cpdb_statistical_analysis_helper.mean_analysis(interactions, clusters, cluster_interactions,
+                                                                base_result, self.separator)
+
+        # Cluster means: gene_1 A=2 B=0, gene_2 A=1 B=3, gene_3 A=0 B=0.5
+        expected_result = pd.DataFrame([[1.5, 2.5, 0.0, 0.0], [0.0, 0.75, 0.0, 1.75]],
+                                       index=[10, 11], columns=['A|A', 'A|B', 'B|A', 'B|B'])
+        pd.testing.assert_frame_equal(result, expected_result)
+
+    def test_get_interactions_genes_indices(self):
+        receptors, ligands = cpdb_statistical_analysis_helper.get_interactions_genes_indices(self.interactions,
+                                                                                            self.counts.index)
+
+        np.testing.assert_array_equal(self.counts.index[receptors], self.interactions['ensembl_1'])
+        np.testing.assert_array_equal(self.counts.index[ligands], self.interactions['ensembl_2'])
+
+        interactions = self.interactions.copy()
+        interactions.at[105, 'ensembl_2'] = 'gene_missing'
+        with self.assertRaises(KeyError):
+            cpdb_statistical_analysis_helper.get_interactions_genes_indices(interactions, self.counts.index)
+
+    def test_permutations_cluster_means(self):
+        permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(self.meta, self.counts,
+                                                                                   self.interactions,
+                                                                                   self.clusters['names'],
+                                                                                   self.cluster_interactions)
+        permutations_labels = np.array([np.random.RandomState(seed).permutation(permutation_data['labels'])
+                                        for seed in range(3)])
+
+        result = cpdb_statistical_analysis_helper.permutations_cluster_means(permutation_data['counts'],
+                                                                             permutations_labels,
+                                                                             permutation_data['sizes'])
+
+        for permutation_labels, cluster_means in zip(permutations_labels, result):
+            shuffled_meta = pd.DataFrame({'cell_type': np.array(self.clusters['names'])[permutation_labels]},
+                                         index=self.meta.index)
+            shuffled_clusters = cpdb_statistical_analysis_helper.build_clusters(shuffled_meta, self.counts)
+            expected_result = pd.DataFrame(shuffled_clusters['means'], columns=self.clusters['names'])
+
+            np.testing.assert_allclose(cluster_means, expected_result.values, rtol=1e-6)
+
+    def test_get_permutation_batches(self):
+        batches = cpdb_statistical_analysis_helper.get_permutation_batches(10, 4)
+
+        self.assertEqual([(start, stop) for start, stop, _ in batches], [(0, 4), (4, 8), (8, 10)])
+
+    def test_shuffled_analysis(self):
+        permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(self.meta, self.counts,
+                                                                                   self.interactions,
+                                                                                   self.clusters['names'],
+                                                                                   self.cluster_interactions)
+        real_mean_analysis = cpdb_statistical_analysis_helper.permutation_mean_analysis(permutation_data,
+                                                                                        self.base_result)
+
+        result = cpdb_statistical_analysis_helper.shuffled_analysis(10, permutation_data, real_mean_analysis,
+                                                                    threads=2, seed=0, batch_size=3)
+
+        expected_result = np.zeros(real_mean_analysis.shape, dtype=int)
+        for start, stop, seed_sequence in cpdb_statistical_analysis_helper.get_permutation_batches(10, 3, seed=0):
+            random_generator = np.random.default_rng(seed_sequence)
+            for _ in range(start, stop):
+                shuffled_labels = random_generator.permutation(permutation_data['labels'])
+                cluster_means = cpdb_statistical_analysis_helper.permutations_cluster_means(
+                    permutation_data['counts'], shuffled_labels[None, :], permutation_data['sizes'])[0]
+                expected_result += cpdb_statistical_analysis_helper.interactions_cluster_means(
+                    cluster_means, permutation_data['receptors'], permutation_data['ligands'],
+                    permutation_data['clusters_receptors'], permutation_data['clusters_ligands']) > \
+                    real_mean_analysis.values
+
+        np.testing.assert_array_equal(result.values, expected_result)
+
+    def test_build_percent_result(self):
+        real_mean_analysis = pd.DataFrame([[0.5, 0.4], [0.0, 0.2]])
+        real_percents_analysis = pd.DataFrame([[1, 0], [0, 1]])
+        shuffled_bigger = pd.DataFrame([[1, 0], [0, 1]])
+
+        result = cpdb_statistical_analysis_helper.build_percent_result(real_mean_analysis, real_percents_analysis,
+                                                                       shuffled_bigger, 2)
+
+        self.assertTrue(result.equals(pd.DataFrame([[0.5, 1.0], [1.0, 0.5]])))
+
+    def test_shuffled_analysis_threads_independent(self):
+        permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(self.meta, self.counts,
+                                                                                   self.interactions,
+                                                                                   self.clusters['names'],
+                                                                                   self.cluster_interactions)
+        real_mean_analysis = cpdb_statistical_analysis_helper.permutation_mean_analysis(permutation_data,
+                                                                                        self.base_result)
+
+        results = [cpdb_statistical_analysis_helper.shuffled_analysis(50, permutation_data, real_mean_analysis,
+                                                                      threads=threads, seed=7, batch_size=4)
+                   for threads in [1, 3]]
+
+        self.assertTrue(results[0].equals(results[1]))
+
+    def test_shuffled_analysis_candidates(self):
+        permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(self.meta, self.counts,
+                                                                                   self.interactions,
+                                                                                   self.clusters['names'],
+                                                                                   self.cluster_interactions)
+        real_mean_analysis = cpdb_statistical_analysis_helper.permutation_mean_analysis(permutation_data,
+                                                                                        self.base_result)
+        candidates = (real_mean_analysis.values != 0) & (np.arange(real_mean_analysis.size) % 3 == 0).reshape(
+            real_mean_analysis.shape)
+
+        expected_result = cpdb_statistical_analysis_helper.shuffled_analysis(20, permutation_data, real_mean_analysis,
+                                                                             threads=2, seed=5, batch_size=6)
+        result = cpdb_statistical_analysis_helper.shuffled_analysis(20, permutation_data, real_mean_analysis,
+                                                                    threads=2, seed=5, batch_size=6,
+                                                                    candidates=candidates)
+
+        np.testing.assert_array_equal(result.values, np.where(candidates, expected_result.values, 0))
+
+    def test_adaptive_shuffled_analysis(self):
+        permutation_data = cpdb_statistical_analysis_helper.build_permutation_data(self.meta, self.counts,
+                                                                                   self.interactions,
+                                                                                   self.clusters['names'],
+                                                                                   self.cluster_interactions)
+        real_mean_analysis = cpdb_statistical_analysis_helper.permutation_mean_analysis(permutation_data,
+                                                                                        self.base_result)
+        evaluated = real_mean_analysis.values != 0
+
+        expected_result = cpdb_statistical_analysis_helper.shuffled_analysis(60, permutation_data, real_mean_analysis,
+                                                                             threads=2, seed=3, batch_size=4)
+
+        result, effective_iterations = cpdb_statistical_analysis_helper.adaptive_shuffled_analysis(
+            60, permutation_data, real_mean_analysis, threads=2, exceedances=5, seed=3, batch_size=4)
+
+        stopped = evaluated & (effective_iterations.values < 60)
+        self.assertTrue(stopped.any())
+        self.assertTrue((result.values[stopped] >= 5).all())
+        self.assertTrue((result.values <= expected_result.values).all())
+        np.testing.assert_array_equal(result.values[evaluated & ~stopped],
+                                      expected_result.values[evaluated & ~stopped])
+        self.assertTrue((effective_iterations.values[~evaluated] == 0).all())
+
+        result, effective_iterations = cpdb_statistical_analysis_helper.adaptive_shuffled_analysis(
+            60, permutation_data, real_mean_analysis, threads=2, exceedances=61, seed=3, batch_size=4)
+
+        np.testing.assert_array_equal(result.values[evaluated], expected_result.values[evaluated])
+        np.testing.assert_array_equal(effective_iterations.values, np.where(evaluated, 60, 0))
+
+    def test_build_percent_result_effective_iterations(self):
+        real_mean_analysis = pd.DataFrame([[0.5, 0.4], [0.0, 0.2]])
+        real_percents_analysis = pd.DataFrame([[1, 1], [0, 1]])
+        shuffled_bigger = pd.DataFrame([[5, 1], [0, 1]])
+        effective_iterations = pd.DataFrame([[8, 10], [0, 10]])
+
+        result = cpdb_statistical_analysis_helper.build_percent_result(real_mean_analysis, real_percents_analysis,
+                                                                       shuffled_bigger, effective_iterations)
+
+        self.assertTrue(result.equals(pd.DataFrame([[0.625, 0.1], [1.0, 0.1]])))
+
+    def test_interacting_pair_and_partners(self):
+        interactions = pd.DataFrame({'name_1': ['P1', 'complex_1'], 'gene_name_1': ['GENE1', None],
+                                     'is_complex_1': [False, True],
+                                     'name_2': ['complex_2', 'P2'], 'gene_name_2': [None, 'GENE2'],
+                                     'is_complex_2': [True, False]},
+                                    index=[4, 9])
+
+        interacting_pair = cpdb_statistical_analysis_helper.interacting_pair_build(interactions)
+
+        self.assertEqual(interacting_pair.name, 'interacting_pair')
+        self.assertEqual(interacting_pair.to_dict(), {4: 'GENE1_complex_2', 9: 'complex_1_GENE2'})
+        self.assertEqual(cpdb_statistical_analysis_helper.partner_build(interactions, '_1').to_dict(),
+                         {4: 'simple:P1', 9: 'complex:complex_1'})
+        self.assertEqual(cpdb_statistical_analysis_helper.partner_build(interactions, '_2').to_dict(),
+                         {4: 'complex:complex_2', 9: 'simple:P2'})
+
+    def test_get_significant_means(self):
+        real_mean_analysis = pd.DataFrame({'cluster1': [0.1, 2.0, 0.3], 'cluster2': [1.0, 0.1, 0.0],
+                                           'cluster3': [2.0, 0.2, 0.5]},
+                                          index=['ensembl1', 'ensembl2', 'ensembl3'])
+        result_percent = pd.DataFrame({'cluster1': [0.0, 0.04, 0.3], 'cluster2': [1.0, 0.03, 0.55],
+                                       'cluster3': [1.0, 0.62, 0.02]},
+                                      index=['ensembl1', 'ensembl2', 'ensembl3'])
+
+        result = cpdb_statistical_analysis_helper.get_significant_means(real_mean_analysis, result_percent, 0.05)
+
+        expected_result = pd.DataFrame({'cluster1': [0.1, 2.0, np.nan], 'cluster2': [np.nan, 0.1, np.nan],
+                                        'cluster3': [np.nan, np.nan, 0.5]},
+                                       index=['ensembl1', 'ensembl2', 'ensembl3'])
+        pd.testing.assert_frame_equal(result, expected_result)
+
+    def test_percent_analysis(self):
+        interactions, clusters, cluster_interactions, base_result = self._hand_computed_data()
+
+        # Expressing fractions: gene_1 A=1 B=0, gene_2 A=0.5 B=1, gene_3 A=0 B=0.5. The statistical analysis keeps
+        # the fractions >= threshold and the analysis the fractions > threshold
+        expected_results = {
+            0.0: ([[1, 1, 1, 1], [1, 1, 1, 1]], [[1, 1, 0, 0], [0, 1, 0, 1]]),
+            0.5: ([[1, 1, 0, 0], [0, 1, 0, 1]], [[0, 1, 0, 0], [0, 0, 0, 0]]),
+        }
+
+        for threshold, (expected_result, expected_analysis_result) in expected_results.items():
+            result = cpdb_statistical_analysis_helper.percent_analysis(clusters, threshold, interactions,
+                                                                       cluster_interactions, base_result,
+                                                                       self.separator)
+            analysis_result = cpdb_analysis_helper.percent_analysis(clusters, threshold, interactions,
+                                                                    cluster_interactions, base_result,
+                                                                    self.separator)
+
+            pd.testing.assert_frame_equal(result, pd.DataFrame(expected_result, dtype=float, index=base_result.index,
+                                                               columns=base_result.columns))
+            pd.testing.assert_frame_equal(analysis_result, pd.DataFrame(expected_analysis_result, dtype=float,
+                                                                        index=base_result.index,
+                                                                        columns=base_result.columns))
+
+    def _hand_computed_data(self) -> (pd.DataFrame, dict, list, pd.DataFrame):
+        counts = pd.DataFrame([[1.0, 3.0, 0.0, 0.0], [2.0, 0.0, 4.0, 2.0], [0.0, 0.0, 1.0, 0.0]],
+                              index=['gene_1', 'gene_2', 'gene_3'], columns=['cell_1', 'cell_2', 'cell_3', 'cell_4'])
+        meta = pd.DataFrame({'cell_type': ['A', 'A', 'B', 'B']}, index=counts.columns)
+        interactions = pd.DataFrame({'ensembl_1': ['gene_1', 'gene_2'], 'ensembl_2': ['gene_2', 'gene_3']},
+                                    index=[10, 11])
+
+        clusters = cpdb_statistical_analysis_helper.build_clusters(meta, counts)
+        cluster_interactions = cpdb_statistical_analysis_helper.get_cluster_combinations(clusters['names'])
+        base_result = cpdb_statistical_analysis_helper.build_result_matrix(interactions, cluster_interactions,
+                                                                           self.separator)
+
+        return interactions, clusters, cluster_interactions, base_result
@@ -0,0 +1,31 @@
+import os
+from unittest import TestCase, mock
+
+import pandas as pd
+
+from cellphonedb.src.app.cellphonedb_app import data_test_dir
+from cellphonedb.src.app.cpdb_app import create_app
+from cellphonedb.src.core.database import analysis_bundle
+from cellphonedb.src.core.methods import cpdb_statistical_analysis_method, cpdb_statistical_analysis_complex_method
+
+
+class TestCpdbStatisticalAnalysisMethod(TestCase):
+    def test_complex_prefilters_counts_subset(self):
+        bundle = analysis_bundle.get_analysis_bundle(create_app(False).database_manager)
+        counts = pd.read_table(os.path.join(data_test_dir, 'hi_test_counts.txt'), index_col=0).astype('float32')
+        prefilters_data = (bundle['interactions'], bundle['genes'], bundle['complex_expanded'],
+                           bundle['complex_composition'], 'ensembl')
+
+        with mock.patch.object(cpdb_statistical_analysis_complex_method, 'prefilters',
+                               wraps=cpdb_statistical_analysis_complex_method.prefilters) as prefilters:
+            interactions, _, counts_filtered = cpdb_statistical_analysis_method._complex_prefilters(counts,
+                                                                                                    *prefilters_data)
+
+        # Same results as the complex prefilters of all the counts, which are not modified
+        all_interactions, all_counts_filtered, _ = cpdb_statistical_analysis_complex_method.prefilters(
+            bundle['interactions'], counts.copy(), *prefilters_data[1:])
+
+        self.assertLess(len(prefilters.call_args[0][1]), len(counts))
+        self.assertTrue(interactions.equals(all_interactions))
+        self.assertTrue(counts_filtered.equals(all_counts_filtered))
+        self.assertNotIn('gene', counts.columns)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
+
+
+class SparseCounts(object):
+    """
+    Genes x cells counts matrix stored as a scipy sparse matrix.
+
+    Single cell counts are mostly zeros, so the matrix is kept sparse until the genes are filtered and only the
+    remaining rows are converted to a dense DataFrame.
+    """
+
+    def __init__(self, matrix: sparse.spmatrix, genes: list, cells: list):
+        self.matrix = sparse.csr_matrix(matrix)
+        self.index = pd.Index(genes).astype(str)
+        self.columns = pd.Index(cells).astype(str)
+
+        if self.matrix.shape != (len(self.index), len(self.columns)):
+            raise ParseCountsException('Counts matrix shape {} doesnt match the number of genes ({}) and cells ({})'
+                                       .format(self.matrix.shape, len(self.index), len(self.columns)),
+                                       'Check the genes and cells files')
+
+    @property
+    def shape(self) -> tuple:
+        return self.matrix.shape
+
+    def filter_genes(self, genes: list) -> 'SparseCounts':
+        """
+        Keeps only the rows of the given genes (in the original order)
+        """
+        genes_mask = self.index.isin(genes)
+
+        return SparseCounts(self.matrix[np.flatnonzero(genes_mask)], self.index[genes_mask], self.columns)
+
+    def to_dataframe(self, dtype=np.float32) -> pd.DataFrame:
+        return pd.DataFrame(self.matrix.toarray().astype(dtype, copy=False), index=self.index, columns=self.columns)
@@ -0,0 +1,5 @@
+class WriteFileException(Exception):
+    def __init__(self, description: str = None, hint: str = None):
+        super(WriteFileException, self).__init__('Can not write results')
+        self.description = description
+        self.hint = hint
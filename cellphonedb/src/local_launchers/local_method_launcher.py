@@ -1,12 +1,13 @@
 import os
-from typing import Optional
+from typing import Optional, Union
 
 import pandas as pd
 
 from cellphonedb.src.app.app_logger import app_logger
 from cellphonedb.src.app.cellphonedb_app import output_dir
+from cellphonedb.src.core.preprocessors import method_preprocessors
 from cellphonedb.src.core.utils.subsampler import Subsampler
-from cellphonedb.utils import utils
+from cellphonedb.utils import utils, counts_reader, long_results, analysis_artifact
 from cellphonedb.utils.utils import write_to_file
 
 
@@ -27,7 +28,7 @@ class LocalMethodLauncher(object):
                                                         counts_data: str,
                                                         project_name: str = '',
                                                         iterations: int = 1000,
-                                                        threshold: float = 0.1,
+                                                        threshold: Union[float, list] = 0.1,
                                                         output_path: str = '',
                                                         output_format: Optional[str] = None,
                                                         means_filename: str = 'means',
@@ -37,37 +38,166 @@ class LocalMethodLauncher(object):
                                                         debug_seed: int = -1,
                                                         threads: int = -1,
                                                         result_precision: int = 3,
-                                                        pvalue: float = 0.05,
+                                                        pvalue: Union[float, list] = 0.05,
                                                         subsampler: Subsampler = None,
+                                                        long_output: Optional[str] = None,
+                                                        long_filename: str = 'significant_interactions',
+                                                        long_mean_cutoff: Optional[float] = None,
+                                                        analysis_artifact_filename: Optional[str] = None,
+                                                        adaptive_exceedances: int = 0,
+                                                        iterations_filename: str = 'effective_iterations',
                                                         ) -> None:
+        """
+        If long_output (tsv.gz or parquet) is set, the pvalues, means and significant means are written as a single
+        long table of the pairs with pvalue < pvalue or mean > long_mean_cutoff instead of the wide tables.
+
+        threshold and pvalue can be lists: the permutations run once and the results of every (threshold, pvalue)
+        combination are written in its own threshold-<threshold>_pvalue-<pvalue> subfolder.
+
+        If analysis_artifact_filename is set, the analysis data is also saved with this filename, so the results can
+        be rendered again (see cpdb_statistical_analysis_render_local_method_launcher).
+
+        If adaptive_exceedances is set, the permutations of every pair stop after adaptive_exceedances shuffled means
+        bigger than the real mean and the effective iterations of every pair are written with iterations_filename.
+        """
+        if long_output:
+            long_results.check_format(long_output)
+
         output_path = self._set_paths(output_path, project_name)
 
         debug_seed = int(debug_seed)
         iterations = int(iterations)
         threads = int(threads)
-        threshold = float(threshold)
+        thresholds = [float(value) for value in self._as_list(threshold)]
+        pvalues = [float(value) for value in self._as_list(pvalue)]
         result_precision = int(result_precision)
+        adaptive_exceedances = int(adaptive_exceedances)
+
+        counts_genes = self.cellphonedb_app.method.get_counts_genes(counts_data) if subsampler is None else None
+        counts, meta = self._load_meta_counts(counts_filename, meta_filename, counts_data, counts_genes)
 
-        counts, meta = self._load_meta_counts(counts_filename, meta_filename)
+        if analysis_artifact_filename or adaptive_exceedances:
+            self.cellphonedb_app.method.thresholds_validations(thresholds)
+            analysis_data = self.cellphonedb_app.method.cpdb_statistical_analysis_data_launcher(meta,
+                                                                                                counts,
+                                                                                                counts_data,
+                                                                                                iterations,
+                                                                                                threads,
+                                                                                                debug_seed,
+                                                                                                subsampler,
+                                                                                                adaptive_exceedances,
+                                                                                                min(thresholds))
+            if analysis_artifact_filename:
+                parameters = {'meta_filename': meta_filename, 'counts_filename': counts_filename,
+                              'counts_data': counts_data, 'iterations': iterations, 'debug_seed': debug_seed,
+                              'thresholds': thresholds, 'pvalues': pvalues, 'result_precision': result_precision,
+                              'adaptive_exceedances': adaptive_exceedances}
+                artifact_file = analysis_artifact.save_analysis_artifact(analysis_data, parameters,
+                                                                         analysis_artifact_filename, output_path)
+                app_logger.info('Analysis artifact saved in {}'.format(artifact_file))
 
-        pvalues_simple, means_simple, significant_means_simple, deconvoluted_simple = \
-            self.cellphonedb_app.method.cpdb_statistical_analysis_launcher(
+            self._write_iterations_result(analysis_data, iterations_filename, output_path, output_format)
+
+            results = self.cellphonedb_app.method.cpdb_statistical_analysis_render_launcher(analysis_data,
+                                                                                            thresholds,
+                                                                                            pvalues,
+                                                                                            result_precision)
+        else:
+            results = self.cellphonedb_app.method.cpdb_statistical_analysis_combinations_launcher(
                 meta,
                 counts,
                 counts_data,
                 iterations,
-                threshold,
+                thresholds,
                 threads,
                 debug_seed,
                 result_precision,
-                pvalue,
+                pvalues,
                 subsampler
             )
 
-        write_to_file(means_simple, means_filename, output_path, output_format)
-        write_to_file(pvalues_simple, pvalues_filename, output_path, output_format)
-        write_to_file(significant_means_simple, significant_means_filename, output_path, output_format)
-        write_to_file(deconvoluted_simple, deconvoluted_filename, output_path, output_format)
+        clusters_names = method_preprocessors.meta_preprocessor(meta.copy())['cell_type'].astype(str).unique().tolist()
+
+        self._write_statistical_results(results, output_path, output_format, means_filename, pvalues_filename,
+                                        significant_means_filename, deconvoluted_filename, long_output, long_filename,
+                                        long_mean_cutoff, clusters_names, self.cellphonedb_app.method.separator)
+
+    def cpdb_statistical_analysis_render_local_method_launcher(self, artifact_filename: str,
+                                                               project_name: str = '',
+                                                               threshold: Union[float, list, None] = None,
+                                                               output_path: str = '',
+                                                               output_format: Optional[str] = None,
+                                                               means_filename: str = 'means',
+                                                               pvalues_filename: str = 'pvalues',
+                                                               significant_means_filename: str = 'significant_means',
+                                                               deconvoluted_filename='deconvoluted',
+                                                               result_precision: Optional[int] = None,
+                                                               pvalue: Union[float, list, None] = None,
+                                                               long_output: Optional[str] = None,
+                                                               long_filename: str = 'significant_interactions',
+                                                               long_mean_cutoff: Optional[float] = None,
+                                                               iterations_filename: str = 'effective_iterations',
+                                                               ) -> None:
+        """
+        Writes the statistical analysis results from a saved analysis artifact, without running the permutations.
+        The threshold, pvalue and result_precision of the analysis run are used if they are not set.
+        """
+        if long_output:
+            long_results.check_format(long_output)
+
+        analysis_data, parameters = analysis_artifact.load_analysis_artifact(os.path.realpath(artifact_filename))
+
+        output_path = self._set_paths(output_path, project_name)
+
+        thresholds = [float(value) for value in self._as_list(threshold)] if threshold is not None else \
+            parameters['thresholds']
+        pvalues = [float(value) for value in self._as_list(pvalue)] if pvalue is not None else parameters['pvalues']
+        result_precision = int(result_precision) if result_precision is not None else parameters['result_precision']
+
+        results = self.cellphonedb_app.method.cpdb_statistical_analysis_render_launcher(analysis_data,
+                                                                                        thresholds,
+                                                                                        pvalues,
+                                                                                        result_precision)
+
+        clusters_names = sorted({cluster for cluster_interaction in analysis_data['cluster_interactions']
+                                 for cluster in cluster_interaction})
+
+        self._write_statistical_results(results, output_path, output_format, means_filename, pvalues_filename,
+                                        significant_means_filename, deconvoluted_filename, long_output, long_filename,
+                                        long_mean_cutoff, clusters_names, analysis_data['separator'])
+        self._write_iterations_result(analysis_data, iterations_filename, output_path, output_format)
+
+    def _write_iterations_result(self, analysis_data: dict, iterations_filename: str, output_path: str,
+                                 output_format: Optional[str]) -> None:
+        iterations_result = self.cellphonedb_app.method.cpdb_statistical_analysis_iterations_launcher(analysis_data)
+        if iterations_result is not None:
+            write_to_file(iterations_result, iterations_filename, output_path, output_format)
+
+    @staticmethod
+    def _write_statistical_results(results: dict, output_path: str, output_format: Optional[str],
+                                   means_filename: str, pvalues_filename: str, significant_means_filename: str,
+                                   deconvoluted_filename: str, long_output: Optional[str], long_filename: str,
+                                   long_mean_cutoff: Optional[float], clusters_names: list, separator: str) -> None:
+        for (combination_threshold, combination_pvalue), combination_results in results.items():
+            combination_path = output_path
+            if len(results) > 1:
+                combination_path = os.path.join(output_path, 'threshold-{}_pvalue-{}'.format(combination_threshold,
+                                                                                               combination_pvalue))
+                os.makedirs(combination_path, exist_ok=True)
+
+            pvalues_simple, means_simple, significant_means_simple, deconvoluted_simple = combination_results
+
+            if long_output:
+                long_result = long_results.build_long_results(pvalues_simple, means_simple, clusters_names,
+                                                              combination_pvalue, long_mean_cutoff, separator)
+                long_results.write_long_results(long_result, long_filename, combination_path, long_output)
+            else:
+                write_to_file(means_simple, means_filename, combination_path, output_format)
+                write_to_file(pvalues_simple, pvalues_filename, combination_path, output_format)
+                write_to_file(significant_means_simple, significant_means_filename, combination_path,
+                              output_format)
+
+            write_to_file(deconvoluted_simple, deconvoluted_filename, combination_path, output_format)
 
     def cpdb_analysis_local_method_launcher(self, meta_filename: str,
                                             counts_filename: str,
@@ -87,7 +217,8 @@ class LocalMethodLauncher(object):
         result_precision = int(result_precision)
         threshold = float(threshold)
 
-        counts, meta = self._load_meta_counts(counts_filename, meta_filename)
+        counts_genes = self.cellphonedb_app.method.get_counts_genes(counts_data) if subsampler is None else None
+        counts, meta = self._load_meta_counts(counts_filename, meta_filename, counts_data, counts_genes)
 
         means, significant_means, deconvoluted = \
             self.cellphonedb_app.method.cpdb_method_analysis_launcher(meta,
@@ -101,6 +232,13 @@ class LocalMethodLauncher(object):
         write_to_file(significant_means, significant_means_filename, output_path, output_format)
         write_to_file(deconvoluted, deconvoluted_filename, output_path, output_format)
 
+    @staticmethod
+    def _as_list(value: Union[float, str, list]) -> list:
+        if isinstance(value, (list, tuple)):
+            return list(value)
+
+        return [value]
+
     @staticmethod
     def _path_is_empty(path):
         return bool([f for f in os.listdir(path) if not f.startswith('.')])
@@ -118,11 +256,16 @@ class LocalMethodLauncher(object):
         return output_path
 
     @staticmethod
-    def _load_meta_counts(counts_filename: str, meta_filename: str) -> (pd.DataFrame, pd.DataFrame):
+    def _load_meta_counts(counts_filename: str, meta_filename: str, counts_data: str,
+                          counts_genes: Optional[list] = None) -> (pd.DataFrame, pd.DataFrame):
         """
+        Only the counts rows of counts_genes are read when it is set. The genes of sparse counts are identified by
+        their counts_data.
+
         :raise ParseMetaException
         """
         meta = utils.read_data_table_from_file(os.path.realpath(meta_filename))
-        counts = utils.read_data_table_from_file(os.path.realpath(counts_filename), index_column_first=True)
+        counts = counts_reader.read_counts_from_file(os.path.realpath(counts_filename), index_filter=counts_genes,
+                                                     counts_data=counts_data)
 
         return counts, meta
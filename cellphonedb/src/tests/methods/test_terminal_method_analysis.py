@@ -1,14 +1,16 @@
 import os
+import tempfile
 from typing import Optional
 
 import pandas as pd
+from scipy import io as scipy_io, sparse
 
 from cellphonedb.src.app.cellphonedb_app import output_test_dir, data_test_dir, cellphonedb_app
 from cellphonedb.src.app.flask.flask_app import create_app
 from cellphonedb.src.core.utils.subsampler import Subsampler
 from cellphonedb.src.local_launchers.local_method_launcher import LocalMethodLauncher
 from cellphonedb.src.tests.cellphone_flask_test_case import CellphoneFlaskTestCase
-from cellphonedb.utils import dataframe_functions
+from cellphonedb.utils import dataframe_functions, binary_counts
 
 
 class TestTerminalMethodlAnalysis(CellphoneFlaskTestCase):
@@ -51,8 +53,37 @@ class TestTerminalMethodlAnalysis(CellphoneFlaskTestCase):
         subsampler = Subsampler(False, 4, 4, debug_seed=0)
         self._method_call(data, project_name, threshold, result_precision, subsampler)
 
+    def test_non_statistical_method__data_test__threshold__01__precision_3_sparse_counts(self):
+        data = 'test'
+        project_name = 'test_data'
+        threshold = 0.1
+        result_precision = 3
+
+        counts = pd.read_table('{}/hi_{}_counts.txt'.format(data_test_dir, data), index_col=0)
+        with tempfile.TemporaryDirectory() as counts_dir:
+            scipy_io.mmwrite('{}/matrix.mtx'.format(counts_dir), sparse.csr_matrix(counts.values))
+            pd.Series(counts.index).to_csv('{}/features.tsv'.format(counts_dir), index=False, header=False)
+            pd.Series(counts.columns).to_csv('{}/barcodes.tsv'.format(counts_dir), index=False, header=False)
+
+            self._method_call(data, project_name, threshold, result_precision,
+                              counts_filename='{}/matrix.mtx'.format(counts_dir))
+
+    def test_non_statistical_method__data_test__threshold__01__precision_3_binary_counts(self):
+        data = 'test'
+        project_name = 'test_data'
+        threshold = 0.1
+        result_precision = 3
+
+        counts = pd.read_table('{}/hi_{}_counts.txt'.format(data_test_dir, data), index_col=0)
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = '{}/counts{}'.format(counts_dir, binary_counts.EXTENSION)
+            binary_counts.write_binary_counts(counts, counts_filename)
+
+            self._method_call(data, project_name, threshold, result_precision, counts_filename=counts_filename)
+
     def _method_call(self, data: str, project_name: str, threshold: float, result_precision: int,
-                     subsampler: Optional[Subsampler] = None, counts_data: str = 'ensembl'):
+                     subsampler: Optional[Subsampler] = None, counts_data: str = 'ensembl',
+                     counts_filename: Optional[str] = None):
         result_names_as_fixture = False
         if result_names_as_fixture:
             result_deconvoluted_filename, result_means_filename, result_significant_means_filename = self._original_names(
@@ -65,12 +96,13 @@ class TestTerminalMethodlAnalysis(CellphoneFlaskTestCase):
 
         meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
 
-        if counts_data == 'ensembl':
-            counts_file = '{}/hi_{}_counts.txt'.format(data_test_dir, data)
-        else:
-            counts_file = '{}/hi_{}_counts_{}.txt'.format(data_test_dir, data, counts_data)
+        if counts_filename is None:
+            if counts_data == 'ensembl':
+                counts_file = '{}/hi_{}_counts.txt'.format(data_test_dir, data)
+            else:
+                counts_file = '{}/hi_{}_counts_{}.txt'.format(data_test_dir, data, counts_data)
 
-        counts_filename = os.path.realpath(counts_file)
+            counts_filename = os.path.realpath(counts_file)
 
         LocalMethodLauncher(cellphonedb_app.cellphonedb).cpdb_analysis_local_method_launcher(meta_filename,
                                                                                              counts_filename,
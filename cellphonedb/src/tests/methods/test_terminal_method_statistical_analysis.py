@@ -1,10 +1,16 @@
 import os
+import shutil
 from typing import Optional
+from unittest import mock
 
+import numpy as np
 import pandas as pd
 
 from cellphonedb.src.app.cellphonedb_app import output_test_dir, data_test_dir, cellphonedb_app
 from cellphonedb.src.app.flask.flask_app import create_app
+from cellphonedb.src.core.exceptions.ThresholdNotAnalyzedException import ThresholdNotAnalyzedException
+from cellphonedb.src.core.exceptions.ThresholdValueException import ThresholdValueException
+from cellphonedb.src.core.methods import cpdb_statistical_analysis_method
 from cellphonedb.src.core.utils.subsampler import Subsampler
 from cellphonedb.src.local_launchers.local_method_launcher import LocalMethodLauncher
 from cellphonedb.src.tests.cellphone_flask_test_case import CellphoneFlaskTestCase
@@ -63,6 +69,131 @@ class TestTerminalMethodStatisticalAnalysis(CellphoneFlaskTestCase):
         subsampler = Subsampler(False, 4, 4, debug_seed=0)
         self._method_call(data, iterations, project_name, threshold, debug_seed, result_precision, subsampler)
 
+    def test_statistical_method_threshold_pvalue_combinations(self):
+        data = 'test'
+        meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
+        counts_filename = os.path.realpath('{}/hi_{}_counts.txt'.format(data_test_dir, data))
+        output_path = '{}/{}'.format(output_test_dir, 'test_combinations')
+
+        launcher = LocalMethodLauncher(cellphonedb_app.cellphonedb)
+        launcher.cpdb_statistical_analysis_local_method_launcher(meta_filename, counts_filename, 'ensembl',
+                                                                 'combinations', 10, [0.1, 0.2], output_path, 'txt',
+                                                                 debug_seed=0, result_precision=3,
+                                                                 pvalue=[0.05, 0.01])
+        launcher.cpdb_statistical_analysis_local_method_launcher(meta_filename, counts_filename, 'ensembl',
+                                                                 'single', 10, 0.2, output_path, 'txt',
+                                                                 debug_seed=0, result_precision=3, pvalue=0.01)
+
+        for filename in ['means', 'pvalues', 'significant_means', 'deconvoluted']:
+            fixture = pd.read_table(os.path.realpath(
+                '{}/statistical_analysis__{}_result__data-test_it-10_seed-0_threshold-01_precision-3.txt'.format(
+                    data_test_dir, filename)))
+            result = pd.read_table('{}/combinations/threshold-0.1_pvalue-0.05/{}.txt'.format(output_path, filename))
+            self.assertTrue(dataframe_functions.dataframes_has_same_data(result, fixture))
+
+            single_result = pd.read_table('{}/single/{}.txt'.format(output_path, filename))
+            result = pd.read_table('{}/combinations/threshold-0.2_pvalue-0.01/{}.txt'.format(output_path, filename))
+            self.assertTrue(dataframe_functions.dataframes_has_same_data(result, single_result))
+
+        self.assertEqual(sorted(os.listdir('{}/combinations'.format(output_path))),
+                         ['threshold-0.1_pvalue-0.01', 'threshold-0.1_pvalue-0.05', 'threshold-0.2_pvalue-0.01',
+                          'threshold-0.2_pvalue-0.05'])
+
+        shutil.rmtree(output_path)
+
+    def test_statistical_method_render_analysis_artifact(self):
+        data = 'test'
+        meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
+        counts_filename = os.path.realpath('{}/hi_{}_counts.txt'.format(data_test_dir, data))
+        output_path = '{}/{}'.format(output_test_dir, 'test_render')
+
+        launcher = LocalMethodLauncher(cellphonedb_app.cellphonedb)
+        launcher.cpdb_statistical_analysis_local_method_launcher(meta_filename, counts_filename, 'ensembl',
+                                                                 'analysis', 10, 0.1, output_path, 'txt',
+                                                                 debug_seed=0, result_precision=3,
+                                                                 analysis_artifact_filename='artifact')
+        launcher.cpdb_statistical_analysis_render_local_method_launcher(
+            '{}/analysis/artifact.cpdbanalysis'.format(output_path), 'render', output_path=output_path,
+            output_format='txt', result_precision=1)
+
+        # Only the pairs expressed with the analysis threshold were permuted
+        with self.assertRaises(ThresholdNotAnalyzedException):
+            launcher.cpdb_statistical_analysis_render_local_method_launcher(
+                '{}/analysis/artifact.cpdbanalysis'.format(output_path), 'render_lower_threshold',
+                threshold=0.05, output_path=output_path, output_format='txt')
+
+        for filename in ['means', 'pvalues', 'significant_means', 'deconvoluted']:
+            for project_name, precision in [('analysis', 3), ('render', 1)]:
+                fixture = pd.read_table(os.path.realpath(
+                    '{}/statistical_analysis__{}_result__data-test_it-10_seed-0_threshold-01_precision-{}.txt'.format(
+                        data_test_dir, filename, precision)))
+                result = pd.read_table('{}/{}/{}.txt'.format(output_path, project_name, filename))
+                self.assertTrue(dataframe_functions.dataframes_has_same_data(result, fixture))
+
+        shutil.rmtree(output_path)
+
+    def test_statistical_method_analysis_data_thresholds_validated(self):
+        data = 'test'
+        meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
+        counts_filename = os.path.realpath('{}/hi_{}_counts.txt'.format(data_test_dir, data))
+        output_path = '{}/{}'.format(output_test_dir, 'test_thresholds_validated')
+        launcher = LocalMethodLauncher(cellphonedb_app.cellphonedb)
+
+        # The thresholds are validated before the permutations, as without an artifact or adaptive permutations
+        with mock.patch.object(cpdb_statistical_analysis_method, 'build_analysis_data') as build_analysis_data:
+            for options in [{'analysis_artifact_filename': 'artifact'}, {'adaptive_exceedances': 5}]:
+                with self.assertRaises(ThresholdValueException):
+                    launcher.cpdb_statistical_analysis_local_method_launcher(
+                        meta_filename, counts_filename, 'ensembl', 'thresholds', 10, [0.1, 1.5], output_path, 'txt',
+                        debug_seed=0, **options)
+
+        build_analysis_data.assert_not_called()
+
+        shutil.rmtree(output_path, ignore_errors=True)
+
+    def test_statistical_method_adaptive_exceedances(self):
+        data = 'test'
+        meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
+        counts_filename = os.path.realpath('{}/hi_{}_counts.txt'.format(data_test_dir, data))
+        output_path = '{}/{}'.format(output_test_dir, 'test_adaptive')
+
+        # No pair gets more exceedances than iterations: every pair runs all of them, as without adaptive permutations
+        LocalMethodLauncher(cellphonedb_app.cellphonedb).cpdb_statistical_analysis_local_method_launcher(
+            meta_filename, counts_filename, 'ensembl', 'adaptive', 10, 0.1, output_path, 'txt', debug_seed=0,
+            result_precision=3, adaptive_exceedances=11)
+
+        for filename in ['means', 'pvalues', 'significant_means', 'deconvoluted']:
+            fixture = pd.read_table(os.path.realpath(
+                '{}/statistical_analysis__{}_result__data-test_it-10_seed-0_threshold-01_precision-3.txt'.format(
+                    data_test_dir, filename)))
+            result = pd.read_table('{}/adaptive/{}.txt'.format(output_path, filename))
+            self.assertTrue(dataframe_functions.dataframes_has_same_data(result, fixture))
+
+        effective_iterations = pd.read_table('{}/adaptive/effective_iterations.txt'.format(output_path))
+        means = pd.read_table('{}/adaptive/means.txt'.format(output_path))
+        pairs = [column for column in effective_iterations.columns if '|' in column]
+
+        self.assertEqual(len(effective_iterations), len(means))
+        self.assertTrue(effective_iterations[pairs].isin([0, 10]).all().all())
+
+        shutil.rmtree(output_path)
+
+    def test_statistical_method_counts_float32(self):
+        data = 'test'
+        meta_filename = os.path.realpath('{}/hi_{}_meta.txt'.format(data_test_dir, data))
+        counts_filename = os.path.realpath('{}/hi_{}_counts.txt'.format(data_test_dir, data))
+        output_path = '{}/{}'.format(output_test_dir, 'test_float32')
+
+        with mock.patch.object(cpdb_statistical_analysis_method, 'build_analysis_data',
+                               wraps=cpdb_statistical_analysis_method.build_analysis_data) as build_analysis_data:
+            LocalMethodLauncher(cellphonedb_app.cellphonedb).cpdb_statistical_analysis_local_method_launcher(
+                meta_filename, counts_filename, 'ensembl', 'float32', 10, 0.1, output_path, 'txt', debug_seed=0)
+
+        counts = build_analysis_data.call_args[0][1]
+        self.assertTrue((counts.dtypes == np.float32).all())
+
+        shutil.rmtree(output_path)
+
     def _method_call(self,
                      data: str,
                      iterations: int,
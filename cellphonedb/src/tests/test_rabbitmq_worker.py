@@ -0,0 +1,47 @@
+import os
+from unittest import TestCase, mock
+
+for variable in ['S3_ACCESS_KEY', 'S3_SECRET_KEY', 'S3_BUCKET_NAME', 'S3_ENDPOINT', 'RABBIT_HOST', 'RABBIT_PORT',
+                 'RABBIT_USER', 'RABBIT_PASSWORD', 'RABBIT_JOB_QUEUE', 'RABBIT_RESULT_QUEUE']:
+    os.environ.setdefault(variable, 'test')
+os.environ.setdefault('QUEUE_TYPE', 'method')
+
+import run_cellphonedb_rabbitmq as worker
+from cellphonedb.src.core.database import analysis_bundle
+
+
+class TestRabbitmqWorker(TestCase):
+    def tearDown(self):
+        worker.apps.clear()
+
+    def test_jobs_inherit_analysis_bundle(self):
+        with mock.patch.dict(analysis_bundle._loaded_bundles, clear=True), \
+                mock.patch.object(analysis_bundle, 'file_hash', wraps=analysis_bundle.file_hash) as file_hash, \
+                mock.patch.object(analysis_bundle, 'load_analysis_bundle',
+                                  wraps=analysis_bundle.load_analysis_bundle) as load_analysis_bundle:
+            worker.get_app('latest')
+            worker_loads = file_hash.call_count, load_analysis_bundle.call_count
+
+            jobs_loads = [self._run_job(self._bundle_loads) for _ in range(2)]
+
+        self.assertEqual(jobs_loads, [worker_loads, worker_loads])
+
+    @staticmethod
+    def _bundle_loads() -> tuple:
+        app = worker.get_app('latest')
+        app.method.get_counts_genes('ensembl')
+        app.database_manager.get_repository('multidata').get_multidatas_from_string('CD44')
+
+        return analysis_bundle.file_hash.call_count, analysis_bundle.load_analysis_bundle.call_count
+
+    @staticmethod
+    def _run_job(job) -> tuple:
+        result_reader, result_writer = worker.job_context.Pipe(duplex=False)
+        process = worker.job_context.Process(target=lambda: result_writer.send(job()))
+        process.start()
+        result_writer.close()
+
+        result = result_reader.recv()
+        process.join()
+
+        return result
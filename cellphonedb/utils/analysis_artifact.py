@@ -0,0 +1,56 @@
+"""
+Statistical analysis artifact: the threshold and pvalue independent data of a statistical analysis run (real means,
+clusters expressing fractions, shuffled means counters, clusters means and interactions, see
+cpdb_statistical_analysis_method.build_analysis_data) stored as a pickle.
+
+The results of any threshold, pvalue and precision can be rendered from it without running the permutations again.
+
+Version 2 adds the adaptive permutations effective iterations and the candidates threshold to the analysis data.
+Version 1 artifacts are still loaded: the keys added by a later version are read with .get and default to the
+previous behaviour (every pair run all the iterations and every threshold can be rendered).
+"""
+import os
+import pickle
+import tempfile
+
+from cellphonedb.src.exceptions.ReadFileException import ReadFileException
+
+EXTENSION = '.cpdbanalysis'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+
+def save_analysis_artifact(analysis_data: dict, parameters: dict, filename: str, output_path: str) -> str:
+    """
+    Stores the analysis data and the run parameters in output_path. The extension is added to filename if it is
+    missing. The file is written atomically, so an interrupted run never leaves a partial artifact.
+    """
+    if not filename.endswith(EXTENSION):
+        filename = '{}{}'.format(filename, EXTENSION)
+
+    file = os.path.join(output_path, filename)
+
+    with tempfile.NamedTemporaryFile(dir=output_path, suffix='.tmp', delete=False) as f:
+        pickle.dump({'version': VERSION, 'parameters': parameters, 'analysis_data': analysis_data}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, file)
+
+    return file
+
+
+def load_analysis_artifact(file: str) -> (dict, dict):
+    """
+    Returns the analysis data and the run parameters of an artifact
+
+    :raise ReadFileException
+    """
+    try:
+        with open(file, 'rb') as f:
+            artifact = pickle.load(f)
+    except Exception:
+        raise ReadFileException(file)
+
+    if not isinstance(artifact, dict) or artifact.get('version') not in SUPPORTED_VERSIONS:
+        raise ReadFileException('{}: it is not a statistical analysis artifact of this version'.format(file))
+
+    return artifact['analysis_data'], artifact['parameters']
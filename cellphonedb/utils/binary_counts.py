@@ -0,0 +1,203 @@
+"""
+Columnar binary counts format (.cpdbcounts)
+
+    magic (8 bytes) | header length (uint64) | json header | padding | float32 values
+
+The json header holds the genes (row index) and the cells (column index). Values are little endian float32 stored
+gene-major: every gene is a contiguous block of cells values, so the rows of the needed genes can be memory-mapped
+(or downloaded) without reading the rest of the file.
+"""
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+from typing import Optional, Union, BinaryIO, Callable, Iterable
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.core.utils.sparse_counts import SparseCounts
+from cellphonedb.src.exceptions.ReadFileException import ReadFileException
+
+EXTENSION = '.cpdbcounts'
+MAGIC = b'CPDBCNT1'
+DTYPE = np.dtype('<f4')
+_PREAMBLE_SIZE = len(MAGIC) + 8
+_ALIGNMENT = 64
+_HEADER_PREFETCH = 64 * 1024
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def write_binary_counts(counts: Union[pd.DataFrame, SparseCounts], file: str, chunk_genes: int = 1024) -> None:
+    """
+    Writes a genes x cells counts matrix in the binary format. The values are converted in chunks of genes, so dense
+    copies of sparse counts are never bigger than chunk_genes rows.
+    """
+    with open(file, 'wb') as f:
+        _write_header(f, counts.index, counts.columns)
+        _write_values(f, counts, chunk_genes)
+
+
+def write_binary_counts_chunks(counts_chunks: Iterable[Union[pd.DataFrame, SparseCounts]], file: str,
+                               chunk_genes: int = 1024) -> None:
+    """
+    Writes the counts of consecutive chunks of genes (see counts_reader.read_counts_file_chunks) in the binary format,
+    so the whole matrix is never in memory. The header needs all the genes, so the values are written to a temporary
+    file while the chunks are read and copied after the header.
+    """
+    genes = []
+    cells = []
+
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(file))) as values_file:
+        for counts in counts_chunks:
+            genes.extend(counts.index)
+            cells = counts.columns
+            _write_values(values_file, counts, chunk_genes)
+
+        values_file.seek(0)
+
+        with open(file, 'wb') as f:
+            _write_header(f, genes, cells)
+            shutil.copyfileobj(values_file, f, _COPY_BUFFER_SIZE)
+
+
+def _write_header(f: BinaryIO, genes: Iterable, cells: Iterable) -> None:
+    header = json.dumps({'genes': [str(gene) for gene in genes],
+                         'cells': [str(cell) for cell in cells]}).encode('utf-8')
+    padding = -(_PREAMBLE_SIZE + len(header)) % _ALIGNMENT
+
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(header)))
+    f.write(header)
+    f.write(b'\0' * padding)
+
+
+def _write_values(f: BinaryIO, counts: Union[pd.DataFrame, SparseCounts], chunk_genes: int) -> None:
+    for start in range(0, counts.shape[0], chunk_genes):
+        if isinstance(counts, SparseCounts):
+            values = counts.matrix[start:start + chunk_genes].toarray()
+        else:
+            values = counts.iloc[start:start + chunk_genes].values
+
+        f.write(values.astype(DTYPE).tobytes())
+
+
+def read_header(stream: BinaryIO) -> (pd.Index, pd.Index, int):
+    """
+    Reads the header of a binary counts stream and leaves the stream at the start of the values.
+
+    Returns the genes, the cells and the offset of the values in the file.
+    """
+    preamble = stream.read(_PREAMBLE_SIZE)
+    if len(preamble) != _PREAMBLE_SIZE or preamble[:len(MAGIC)] != MAGIC:
+        raise ReadFileException('binary counts: invalid header')
+
+    header_size, = struct.unpack('<Q', preamble[len(MAGIC):])
+    header = json.loads(_read_exactly(stream, header_size).decode('utf-8'))
+
+    padding = -(_PREAMBLE_SIZE + header_size) % _ALIGNMENT
+    _read_exactly(stream, padding)
+
+    return pd.Index(header['genes']), pd.Index(header['cells']), _PREAMBLE_SIZE + header_size + padding
+
+
+def read_binary_counts(file: str, index_filter: Optional[list] = None) -> pd.DataFrame:
+    """
+    Reads a binary counts file. The values are memory-mapped and only the rows of the genes in index_filter are
+    copied to memory.
+    """
+    try:
+        with open(file, 'rb') as f:
+            genes, cells, values_offset = read_header(f)
+    except OSError:
+        raise ReadFileException(file)
+
+    values = np.memmap(file, dtype=DTYPE, mode='r', offset=values_offset, shape=(len(genes), len(cells)))
+    rows = _get_rows(genes, index_filter)
+
+    return pd.DataFrame(values[rows], index=genes[rows], columns=cells)
+
+
+def read_binary_counts_stream(stream: BinaryIO, index_filter: Optional[list] = None,
+                              chunk_genes: int = 256) -> pd.DataFrame:
+    """
+    Reads binary counts from a stream that can't be memory-mapped (i.e. a S3 body). The values are read in chunks of
+    genes and only the rows of the genes in index_filter are kept.
+    """
+    genes, cells, _ = read_header(stream)
+
+    rows = _get_rows(genes, index_filter)
+    row_size = len(cells) * DTYPE.itemsize
+    values = np.empty((len(rows), len(cells)), dtype=DTYPE)
+
+    filled = 0
+    for start in range(0, len(genes), chunk_genes):
+        chunk_genes_number = min(chunk_genes, len(genes) - start)
+        chunk = _read_exactly(stream, chunk_genes_number * row_size)
+
+        chunk_rows = rows[(rows >= start) & (rows < start + chunk_genes_number)] - start
+        if len(chunk_rows):
+            chunk_values = np.frombuffer(chunk, dtype=DTYPE).reshape(chunk_genes_number, len(cells))
+            values[filled:filled + len(chunk_rows)] = chunk_values[chunk_rows]
+            filled += len(chunk_rows)
+
+    return pd.DataFrame(values, index=genes[rows], columns=cells)
+
+
+def read_binary_counts_ranges(read_range: Callable[[int, int], bytes], index_filter: Optional[list] = None,
+                              max_gap_bytes: int = 1024 * 1024) -> pd.DataFrame:
+    """
+    Reads binary counts through a read_range(start, stop) function (i.e. S3 ranged GETs): the header is read first and
+    then only the blocks of rows of the genes in index_filter. Blocks separated by less than max_gap_bytes are read
+    with a single request.
+    """
+    prefetch = read_range(0, _HEADER_PREFETCH)
+    if len(prefetch) >= _PREAMBLE_SIZE and prefetch[:len(MAGIC)] == MAGIC:
+        header_size, = struct.unpack('<Q', prefetch[len(MAGIC):_PREAMBLE_SIZE])
+        values_offset = _PREAMBLE_SIZE + header_size + (-(_PREAMBLE_SIZE + header_size) % _ALIGNMENT)
+        if values_offset > len(prefetch):
+            prefetch += read_range(len(prefetch), values_offset)
+
+    genes, cells, values_offset = read_header(io.BytesIO(prefetch))
+
+    rows = _get_rows(genes, index_filter)
+    row_size = len(cells) * DTYPE.itemsize
+    values = np.empty((len(rows), len(cells)), dtype=DTYPE)
+
+    max_gap_rows = max_gap_bytes // row_size if row_size else 0
+    blocks_starts = np.flatnonzero(np.diff(rows) > max_gap_rows + 1) + 1
+
+    for block_rows, block_positions in zip(np.split(rows, blocks_starts),
+                                           np.split(np.arange(len(rows)), blocks_starts)):
+        if not len(block_rows):
+            continue
+
+        first_row, last_row = block_rows[0], block_rows[-1]
+        block = read_range(values_offset + first_row * row_size, values_offset + (last_row + 1) * row_size)
+        if len(block) != (last_row - first_row + 1) * row_size:
+            raise ReadFileException('binary counts: unexpected end of file')
+
+        block_values = np.frombuffer(block, dtype=DTYPE).reshape(-1, len(cells))
+        values[block_positions] = block_values[block_rows - first_row]
+
+    return pd.DataFrame(values, index=genes[rows], columns=cells)
+
+
+def _get_rows(genes: pd.Index, index_filter: Optional[list]) -> np.ndarray:
+    if index_filter is None:
+        return np.arange(len(genes))
+
+    return np.flatnonzero(genes.isin(index_filter))
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            raise ReadFileException('binary counts: unexpected end of file')
+        data.extend(block)
+
+    return bytes(data)
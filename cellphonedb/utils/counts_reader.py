@@ -0,0 +1,243 @@
+"""
+Counts readers.
+
+Text counts are parsed in chunks of rows with all the values declared as float32 (pandas doesn't infer any dtype), and
+only the rows of the requested genes are parsed. Gzip (.gz) and zstd (.zst) compressed files are decompressed while
+they are read. Binary and sparse counts are read by their own readers.
+"""
+import csv
+import gzip
+import io
+import os
+from typing import Optional, Union, BinaryIO, TextIO, Iterator, Iterable
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.core.utils.sparse_counts import SparseCounts
+from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
+from cellphonedb.src.exceptions.ReadFileException import ReadFileException
+from cellphonedb.utils import utils, binary_counts
+
+COMPRESSION_EXTENSIONS = ('.gz', '.zst')
+TEXT_EXTENSIONS = ('.csv', '.tsv', '.txt', '.tab')
+
+
+def read_counts_from_file(file: str, index_filter: Optional[list] = None, chunk_size: int = 1000,
+                          counts_data: str = 'ensembl') -> Union[pd.DataFrame, SparseCounts]:
+    """
+    The genes of sparse counts are identified by their counts_data, the other formats store the genes in the file.
+    """
+    filename, compression = split_compression(file)
+    _, file_extension = os.path.splitext(filename)
+
+    if file_extension.lower() not in TEXT_EXTENSIONS:
+        return utils.read_data_table_from_file(file, index_column_first=True, index_filter=index_filter,
+                                               counts_data=counts_data)
+
+    try:
+        f = open(file, 'rb')
+    except Exception:
+        raise ReadFileException(file)
+
+    with f:
+        return read_counts_table(_text_stream(f, compression), utils._get_separator(file_extension), index_filter,
+                                 chunk_size)
+
+
+def read_counts_from_s3(s3_client, bucket: str, key: str, index_filter: Optional[list] = None,
+                        chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Reads a counts file from S3. Binary counts are read with ranged GETs of the needed genes rows only, any other
+    format is streamed from a single GET.
+    """
+    _, file_extension = os.path.splitext(key)
+
+    if file_extension == binary_counts.EXTENSION:
+        def read_range(start: int, stop: int) -> bytes:
+            s3_object = s3_client.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, stop - 1))
+            return s3_object['Body'].read()
+
+        return binary_counts.read_binary_counts_ranges(read_range, index_filter)
+
+    return read_counts_from_s3_object(s3_client.get_object(Bucket=bucket, Key=key), key, index_filter, chunk_size)
+
+
+def read_counts_from_s3_object(s3_object: dict, s3_name: str, index_filter: Optional[list] = None,
+                               chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Text counts are parsed while the S3 body is downloaded (and decompressed): only the filtered rows are kept in
+    memory.
+    """
+    filename, compression = split_compression(s3_name)
+    _, file_extension = os.path.splitext(filename)
+
+    if file_extension.lower() not in TEXT_EXTENSIONS:
+        return utils.read_data_from_s3_object(s3_object, s3_name, index_column_first=True, index_filter=index_filter)
+
+    bytestream = io.BufferedReader(_StreamReader(s3_object['Body']), buffer_size=1 << 20)
+
+    return read_counts_table(_text_stream(bytestream, compression), utils._get_separator(file_extension),
+                             index_filter, chunk_size)
+
+
+def read_counts_file_chunks(file: str, chunk_size: int = 1000,
+                            counts_data: str = 'ensembl') -> Iterator[Union[pd.DataFrame, SparseCounts]]:
+    """
+    Reads a counts file in chunks of genes. Text counts are yielded every chunk_size rows, so the whole dense matrix is
+    never in memory. Binary and sparse counts are read at once and yielded as a single chunk.
+    """
+    filename, compression = split_compression(file)
+    _, file_extension = os.path.splitext(filename)
+
+    if file_extension.lower() not in TEXT_EXTENSIONS:
+        yield read_counts_from_file(file, counts_data=counts_data)
+        return
+
+    try:
+        f = open(file, 'rb')
+    except Exception:
+        raise ReadFileException(file)
+
+    with f:
+        yield from read_counts_chunks(_text_stream(f, compression), utils._get_separator(file_extension),
+                                      chunk_size=chunk_size)
+
+
+def read_counts_table(file_stream: TextIO, separator: str, index_filter: Optional[list] = None,
+                      chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Reads a genes x cells counts table: the first column is the gene and every other column a cell.
+
+    Lines are parsed in chunks of chunk_size rows with float32 values. If index_filter is set, the lines of other
+    genes are discarded before parsing them.
+
+    :raise ParseCountsException
+    """
+    return pd.concat(read_counts_chunks(file_stream, separator, index_filter, chunk_size))
+
+
+def read_counts_chunks(file_stream: TextIO, separator: str, index_filter: Optional[list] = None,
+                       chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+    """
+    Yields the float32 counts of every chunk of chunk_size lines of a counts table (see read_counts_table). A single
+    empty table is yielded if no gene is read.
+
+    :raise ParseCountsException
+    """
+    header = _split_line(file_stream.readline(), separator)
+    index_filter = set(index_filter) if index_filter is not None else None
+
+    columns = None
+    index_name = None
+    chunks_read = 0
+
+    for lines in _lines_chunks(file_stream, chunk_size):
+        if columns is None:
+            # Files written without index name (i.e. by R) have one less column in the header
+            if len(_split_line(lines[0], separator)) == len(header) + 1:
+                columns = header
+            else:
+                index_name, columns = header[0], header[1:]
+
+        if index_filter is not None:
+            lines = filter_lines(lines, separator, index_filter)
+
+        if not lines:
+            continue
+
+        dtype = {position: np.float32 for position in range(1, len(columns) + 1)}
+        dtype[0] = str
+
+        try:
+            counts_chunk = pd.read_csv(io.StringIO(''.join(lines)), sep=separator, header=None, index_col=0,
+                                       dtype=dtype)
+        except ValueError:
+            raise ParseCountsException('Counts values are not decimal values', 'Incorrect file format')
+
+        counts_chunk.columns = columns
+        counts_chunk.index.name = index_name
+        chunks_read += 1
+
+        yield counts_chunk
+
+    if not chunks_read:
+        if columns is None:
+            columns = header[1:]
+
+        counts = pd.DataFrame(np.empty((0, len(columns)), dtype=np.float32), index=pd.Index([], dtype=object),
+                              columns=columns)
+        counts.index.name = index_name
+
+        yield counts
+
+
+def filter_lines(lines: Iterable[str], separator: str, index_filter: set) -> list:
+    """
+    Keeps the lines whose first field (the gene) is in index_filter, so the other lines are never parsed
+    """
+    return [line for line in lines if line.split(separator, 1)[0].strip('"') in index_filter]
+
+
+def split_compression(filename: str) -> (str, str):
+    """
+    Returns the filename without its compression extension and the compression extension (.gz, .zst or '')
+    """
+    name, extension = os.path.splitext(filename)
+    if extension.lower() in COMPRESSION_EXTENSIONS:
+        return name, extension.lower()
+
+    return filename, ''
+
+
+def _text_stream(binary_stream: BinaryIO, compression: str) -> TextIO:
+    if compression == '.gz':
+        binary_stream = gzip.GzipFile(fileobj=binary_stream)
+
+    elif compression == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ReadFileException('zstd counts: zstandard is required to read .zst files')
+
+        binary_stream = zstandard.ZstdDecompressor().stream_reader(binary_stream)
+
+    return io.TextIOWrapper(binary_stream, encoding='utf-8')
+
+
+class _StreamReader(io.RawIOBase):
+    """
+    Raw binary stream over any object with a read(size) method (i.e. a S3 streaming body), so it can be buffered and
+    decoded by the io module.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+
+
+def _lines_chunks(file_stream: TextIO, chunk_size: int) -> Iterator[list]:
+    lines = []
+    for line in file_stream:
+        if not line.strip():
+            continue
+
+        lines.append(line)
+        if len(lines) == chunk_size:
+            yield lines
+            lines = []
+
+    if lines:
+        yield lines
+
+
+def _split_line(line: str, separator: str) -> list:
+    return next(csv.reader([line.rstrip('\r\n')], delimiter=separator))
@@ -0,0 +1,94 @@
+"""
+Long (sparse) statistical analysis results.
+
+The wide pvalues and means tables have one column per cluster pair. The long table has one row per interaction and
+cluster pair instead, and only keeps the pairs with a pvalue up to the pvalue cutoff or a mean above the mean cutoff:
+
+    id_cp_interaction | interacting_pair | cluster_a | cluster_b | mean | pvalue
+
+It is written as gzip compressed TSV (tsv.gz) or Parquet (parquet, needs pyarrow or fastparquet).
+"""
+import importlib.util
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.exceptions.WriteFileException import WriteFileException
+
+FORMATS = ['tsv.gz', 'parquet']
+INTERACTION_COLUMNS = ['id_cp_interaction', 'interacting_pair']
+
+
+def build_long_results(pvalues: pd.DataFrame, means: pd.DataFrame, clusters_names: list, pvalue_cutoff: float,
+                       mean_cutoff: Optional[float] = None, separator: str = '|') -> pd.DataFrame:
+    """
+    Builds the long table from the wide pvalues and means results (rows are matched by index, as built by
+    build_results). A pair is kept if its pvalue is lower than or equal to pvalue_cutoff (as in the significant means
+    result) or (if mean_cutoff is set) its mean is higher than mean_cutoff.
+
+    The cluster pairs columns are found from the clusters names, so names containing the separator are not split.
+    """
+    clusters_by_column = {separator.join((cluster_a, cluster_b)): (cluster_a, cluster_b)
+                          for cluster_a in clusters_names for cluster_b in clusters_names}
+    clusters_pairs = [column for column in pvalues.columns if column in clusters_by_column]
+
+    means = means.reindex(pvalues.index)
+    pvalues_values = pvalues[clusters_pairs].values.astype(np.float64)
+    means_values = means[clusters_pairs].values.astype(np.float64)
+
+    significant = pvalues_values <= pvalue_cutoff
+    if mean_cutoff is not None:
+        significant |= means_values > mean_cutoff
+
+    rows, columns = np.nonzero(significant)
+    clusters = np.array([clusters_by_column[column] for column in clusters_pairs], dtype=object).reshape(-1, 2)
+
+    long_results = pd.DataFrame({column: pvalues[column].values[rows] for column in INTERACTION_COLUMNS})
+    long_results['cluster_a'] = clusters[columns, 0]
+    long_results['cluster_b'] = clusters[columns, 1]
+    long_results['mean'] = means_values[rows, columns]
+    long_results['pvalue'] = pvalues_values[rows, columns]
+
+    return long_results
+
+
+def write_long_results(long_results: pd.DataFrame, filename: str, output_path: str,
+                       output_format: str = 'tsv.gz') -> str:
+    """
+    Writes the long table in output_path. The format extension is added to filename if it is missing.
+
+    :raise WriteFileException
+    """
+    check_format(output_format)
+
+    extension = '.{}'.format(output_format)
+    if not filename.endswith(extension):
+        filename = '{}{}'.format(filename, extension)
+
+    file = os.path.join(output_path, filename)
+
+    if output_format == 'parquet':
+        long_results.to_parquet(file, index=False)
+    else:
+        long_results.to_csv(file, sep='\t', index=False, compression='gzip')
+
+    return file
+
+
+def check_format(output_format: str) -> None:
+    """
+    :raise WriteFileException
+    """
+    if output_format not in FORMATS:
+        raise WriteFileException('Long results format {} is not valid'.format(output_format),
+                                 'Accepted formats: {}'.format(', '.join(FORMATS)))
+
+    if output_format == 'parquet' and not any(_is_installed(engine) for engine in ['pyarrow', 'fastparquet']):
+        raise WriteFileException('Parquet long results need pyarrow or fastparquet',
+                                 'Install one of them or use the tsv.gz format')
+
+
+def _is_installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
@@ -0,0 +1,92 @@
+"""
+Streaming writer of result tables to S3.
+
+Tables are rendered to CSV in chunks of rows and every chunk is encoded (and optionally gzip compressed) before the
+next one is rendered, so only one part of the upload is kept in memory. Tables bigger than one part are uploaded as a
+multipart upload; smaller ones with a single put_object.
+"""
+import io
+import zlib
+from typing import Iterator, Iterable
+
+import pandas as pd
+
+# S3 rejects multipart parts smaller than 5 MB (except the last one)
+MIN_PART_SIZE = 5 * 1024 ** 2
+DEFAULT_PART_SIZE = 8 * 1024 ** 2
+
+
+def write_dataframe(s3_client, data: pd.DataFrame, bucket: str, key: str, separator: str = '\t',
+                    compress: bool = False, chunk_rows: int = 5000, part_size: int = DEFAULT_PART_SIZE) -> None:
+    chunks = dataframe_csv_chunks(data, separator, chunk_rows)
+
+    if compress:
+        chunks = gzip_chunks(chunks)
+
+    upload_chunks(s3_client, chunks, bucket, key, part_size)
+
+
+def dataframe_csv_chunks(data: pd.DataFrame, separator: str, chunk_rows: int) -> Iterator[bytes]:
+    """
+    Renders the DataFrame (without index) as utf-8 CSV, chunk_rows rows at a time. The header goes in the first chunk.
+    """
+    for start in range(0, max(len(data), 1), chunk_rows):
+        buffer = io.StringIO()
+        data.iloc[start:start + chunk_rows].to_csv(buffer, index=False, sep=separator, header=start == 0)
+
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # wbits=31 writes the gzip container, so the result is a regular .gz file
+    compressor = zlib.compressobj(wbits=31)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def upload_chunks(s3_client, chunks: Iterable[bytes], bucket: str, key: str,
+                  part_size: int = DEFAULT_PART_SIZE) -> None:
+    """
+    Uploads the chunks to bucket/key. Chunks are grouped in parts of part_size bytes; the multipart upload is started
+    with the first full part and aborted if anything fails. S3 needs parts of at least MIN_PART_SIZE bytes.
+    """
+    part = bytearray()
+    parts = []
+    upload_id = None
+
+    try:
+        for chunk in chunks:
+            part.extend(chunk)
+
+            if len(part) >= part_size:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+                parts.append(_upload_part(s3_client, bytes(part), bucket, key, upload_id, len(parts) + 1))
+                part = bytearray()
+
+        if upload_id is None:
+            s3_client.put_object(Body=bytes(part), Bucket=bucket, Key=key)
+            return
+
+        if part:
+            parts.append(_upload_part(s3_client, bytes(part), bucket, key, upload_id, len(parts) + 1))
+
+        s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                            MultipartUpload={'Parts': parts})
+
+    except Exception:
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+def _upload_part(s3_client, body: bytes, bucket: str, key: str, upload_id: str, part_number: int) -> dict:
+    response = s3_client.upload_part(Body=body, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number)
+
+    return {'ETag': response['ETag'], 'PartNumber': part_number}
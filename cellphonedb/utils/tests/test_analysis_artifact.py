@@ -0,0 +1,55 @@
+import os
+import pickle
+import tempfile
+from unittest import TestCase
+
+import pandas as pd
+
+from cellphonedb.src.exceptions.ReadFileException import ReadFileException
+from cellphonedb.utils import analysis_artifact
+
+
+class TestAnalysisArtifact(TestCase):
+    def test_save_load(self):
+        analysis_data = {'iterations': 10, 'shuffled_bigger': pd.DataFrame({'a|b': [1, 2]})}
+        parameters = {'thresholds': [0.1], 'pvalues': [0.05], 'result_precision': 3}
+
+        with tempfile.TemporaryDirectory() as output_path:
+            file = analysis_artifact.save_analysis_artifact(analysis_data, parameters, 'artifact', output_path)
+
+            self.assertEqual(file, os.path.join(output_path, 'artifact.cpdbanalysis'))
+            self.assertEqual(os.listdir(output_path), ['artifact.cpdbanalysis'])
+
+            loaded_data, loaded_parameters = analysis_artifact.load_analysis_artifact(file)
+
+        self.assertEqual(loaded_parameters, parameters)
+        self.assertEqual(loaded_data['iterations'], 10)
+        pd.testing.assert_frame_equal(loaded_data['shuffled_bigger'], analysis_data['shuffled_bigger'])
+
+    def test_load_previous_version(self):
+        analysis_data = {'iterations': 10}
+
+        with tempfile.TemporaryDirectory() as output_path:
+            file = os.path.join(output_path, 'artifact.cpdbanalysis')
+            with open(file, 'wb') as f:
+                pickle.dump({'version': 1, 'parameters': {}, 'analysis_data': analysis_data}, f)
+
+            self.assertEqual(analysis_artifact.load_analysis_artifact(file), (analysis_data, {}))
+
+            with open(file, 'wb') as f:
+                pickle.dump({'version': analysis_artifact.VERSION + 1, 'parameters': {}, 'analysis_data': {}}, f)
+
+            with self.assertRaises(ReadFileException):
+                analysis_artifact.load_analysis_artifact(file)
+
+    def test_load_invalid_file(self):
+        with tempfile.TemporaryDirectory() as output_path:
+            file = os.path.join(output_path, 'artifact.cpdbanalysis')
+            with open(file, 'wb') as f:
+                f.write(b'not an artifact')
+
+            with self.assertRaises(ReadFileException):
+                analysis_artifact.load_analysis_artifact(file)
+
+            with self.assertRaises(ReadFileException):
+                analysis_artifact.load_analysis_artifact(os.path.join(output_path, 'missing.cpdbanalysis'))
@@ -0,0 +1,78 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from cellphonedb.src.core.utils.sparse_counts import SparseCounts
+from cellphonedb.utils import binary_counts, counts_reader, utils
+
+
+class TestBinaryCounts(TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.counts = pd.DataFrame(random_state.poisson(0.5, (7, 5)).astype(np.float32),
+                                   index=['gene_{}'.format(number) for number in range(7)],
+                                   columns=['cell_{}'.format(number) for number in range(5)])
+
+    def test_read_file(self):
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = os.path.join(counts_dir, 'counts{}'.format(binary_counts.EXTENSION))
+            binary_counts.write_binary_counts(self.counts, counts_filename, chunk_genes=3)
+
+            result = utils.read_data_table_from_file(counts_filename)
+            filtered_result = utils.read_data_table_from_file(counts_filename, index_filter=['gene_5', 'gene_1'])
+
+        self.assertTrue(result.equals(self.counts))
+        self.assertTrue(filtered_result.equals(self.counts.loc[['gene_1', 'gene_5']]))
+
+    def test_read_stream(self):
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = os.path.join(counts_dir, 'counts{}'.format(binary_counts.EXTENSION))
+            binary_counts.write_binary_counts(SparseCounts(sparse.csr_matrix(self.counts.values), self.counts.index,
+                                                           self.counts.columns), counts_filename, chunk_genes=2)
+
+            with open(counts_filename, 'rb') as f:
+                result = utils.read_data_from_s3_object({'Body': f}, 'counts{}'.format(binary_counts.EXTENSION),
+                                                        index_filter=['gene_0', 'gene_3', 'gene_6'])
+
+        self.assertTrue(result.equals(self.counts.loc[['gene_0', 'gene_3', 'gene_6']]))
+
+    def test_read_ranges(self):
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = os.path.join(counts_dir, 'counts{}'.format(binary_counts.EXTENSION))
+            binary_counts.write_binary_counts(self.counts, counts_filename)
+
+            with open(counts_filename, 'rb') as f:
+                content = f.read()
+
+        ranges = []
+
+        def read_range(start, stop):
+            ranges.append((start, stop))
+            return content[start:stop]
+
+        result = binary_counts.read_binary_counts_ranges(read_range, ['gene_6', 'gene_1', 'gene_2'], max_gap_bytes=0)
+
+        self.assertTrue(result.equals(self.counts.loc[['gene_1', 'gene_2', 'gene_6']]))
+        # Header, then the blocks gene_1-gene_2 and gene_6
+        self.assertEqual(len(ranges), 3)
+
+        result = binary_counts.read_binary_counts_ranges(read_range, None)
+        self.assertTrue(result.equals(self.counts))
+
+    def test_write_chunks(self):
+        with tempfile.TemporaryDirectory() as counts_dir:
+            text_filename = os.path.join(counts_dir, 'counts.txt.gz')
+            self.counts.to_csv(text_filename, sep='\t', compression='gzip')
+            counts_filename = os.path.join(counts_dir, 'counts{}'.format(binary_counts.EXTENSION))
+
+            counts_chunks = list(counts_reader.read_counts_file_chunks(text_filename, chunk_size=3))
+            binary_counts.write_binary_counts_chunks(iter(counts_chunks), counts_filename, chunk_genes=2)
+
+            result = utils.read_data_table_from_file(counts_filename)
+
+        self.assertEqual([len(counts_chunk) for counts_chunk in counts_chunks], [3, 3, 1])
+        self.assertTrue(result.equals(self.counts))
@@ -0,0 +1,77 @@
+import gzip
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.app.cellphonedb_app import data_test_dir
+from cellphonedb.utils import counts_reader
+
+
+class TestCountsReader(TestCase):
+    def setUp(self):
+        self.counts_filename = '{}/hi_test_counts.txt'.format(data_test_dir)
+        self.counts = pd.read_csv(self.counts_filename, sep='\t', index_col=0).astype(np.float32)
+
+    def test_read_counts(self):
+        result = counts_reader.read_counts_from_file(self.counts_filename, chunk_size=7)
+
+        self.assertTrue(result.equals(self.counts))
+
+    def test_index_filter(self):
+        genes = list(self.counts.index[[3, 10, 25]]) + ['not_a_gene']
+        result = counts_reader.read_counts_from_file(self.counts_filename, index_filter=genes, chunk_size=4)
+
+        self.assertTrue(result.equals(self.counts.iloc[[3, 10, 25]]))
+
+    def test_compressed_counts(self):
+        with open(self.counts_filename, 'rb') as f:
+            counts_content = f.read()
+
+        with tempfile.TemporaryDirectory() as counts_dir:
+            with gzip.open(os.path.join(counts_dir, 'counts.txt.gz'), 'wb') as f:
+                f.write(counts_content)
+            result = counts_reader.read_counts_from_file(os.path.join(counts_dir, 'counts.txt.gz'))
+            self.assertTrue(result.equals(self.counts))
+
+            try:
+                import zstandard
+            except ImportError:
+                return
+
+            with open(os.path.join(counts_dir, 'counts.txt.zst'), 'wb') as f:
+                f.write(zstandard.ZstdCompressor().compress(counts_content))
+            result = counts_reader.read_counts_from_file(os.path.join(counts_dir, 'counts.txt.zst'))
+            self.assertTrue(result.equals(self.counts))
+
+    def test_header_without_index_name(self):
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = os.path.join(counts_dir, 'counts.csv')
+            with open(counts_filename, 'w') as f:
+                f.write('"cell_1","cell_2"\n"gene_1",1,0.5\n"gene_2",0,2\n')
+
+            result = counts_reader.read_counts_from_file(counts_filename)
+
+        expected_result = pd.DataFrame([[1, 0.5], [0, 2]], index=['gene_1', 'gene_2'], columns=['cell_1', 'cell_2'],
+                                       dtype=np.float32)
+        self.assertTrue(result.equals(expected_result))
+
+    def test_read_s3_stream(self):
+        class StreamingBody:
+            def __init__(self, content):
+                self.content = io.BytesIO(content)
+
+            def read(self, size=None):
+                return self.content.read(size)
+
+        with open(self.counts_filename, 'rb') as f:
+            counts_content = f.read()
+
+        genes = list(self.counts.index[[0, 7]])
+        result = counts_reader.read_counts_from_s3_object({'Body': StreamingBody(gzip.compress(counts_content))},
+                                                          'counts.txt.gz', index_filter=genes, chunk_size=5)
+
+        self.assertTrue(result.equals(self.counts.loc[genes]))
@@ -0,0 +1,67 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.src.exceptions.WriteFileException import WriteFileException
+from cellphonedb.utils import long_results
+
+
+class TestLongResults(TestCase):
+    def setUp(self):
+        info = pd.DataFrame({'id_cp_interaction': ['CPI-1', 'CPI-2'],
+                             'interacting_pair': ['A_B', 'C_D'],
+                             'secreted': [True, False]},
+                            index=[3, 7])
+
+        self.pvalues = pd.concat([info, pd.DataFrame({'x|x': [0.01, 1.0], 'x|y': [0.5, 0.04], 'y|x': [1.0, 1.0]},
+                                                     index=[3, 7])], axis=1)
+        self.means = pd.concat([info, pd.DataFrame({'x|x': [1.5, 0.0], 'x|y': [0.2, 0.8], 'y|x': [2.0, 0.1]},
+                                                   index=[3, 7])], axis=1)
+
+    def test_build_long_results(self):
+        result = long_results.build_long_results(self.pvalues, self.means, ['x', 'y'], 0.05)
+
+        self.assertEqual(list(result.columns), ['id_cp_interaction', 'interacting_pair', 'cluster_a', 'cluster_b',
+                                                'mean', 'pvalue'])
+        self.assertEqual(result[['id_cp_interaction', 'cluster_a', 'cluster_b']].values.tolist(),
+                         [['CPI-1', 'x', 'x'], ['CPI-2', 'x', 'y']])
+        np.testing.assert_array_equal(result['mean'].values, [1.5, 0.8])
+        np.testing.assert_array_equal(result['pvalue'].values, [0.01, 0.04])
+
+    def test_build_long_results_mean_cutoff(self):
+        result = long_results.build_long_results(self.pvalues, self.means.iloc[::-1], ['x', 'y'], 0.05,
+                                                 mean_cutoff=1.0)
+
+        self.assertEqual(result[['id_cp_interaction', 'cluster_a', 'cluster_b']].values.tolist(),
+                         [['CPI-1', 'x', 'x'], ['CPI-1', 'y', 'x'], ['CPI-2', 'x', 'y']])
+        np.testing.assert_array_equal(result['mean'].values, [1.5, 2.0, 0.8])
+
+    def test_build_long_results_pvalue_cutoff_included(self):
+        result = long_results.build_long_results(self.pvalues, self.means, ['x', 'y'], 0.04)
+
+        self.assertEqual(result[['id_cp_interaction', 'cluster_a', 'cluster_b']].values.tolist(),
+                         [['CPI-1', 'x', 'x'], ['CPI-2', 'x', 'y']])
+
+    def test_build_long_results_clusters_with_separator(self):
+        pvalues = self.pvalues.rename(columns={'x|x': 'a|b|a|b', 'x|y': 'a|b|c', 'y|x': 'c|a|b'})
+        means = self.means.rename(columns={'x|x': 'a|b|a|b', 'x|y': 'a|b|c', 'y|x': 'c|a|b'})
+
+        result = long_results.build_long_results(pvalues, means, ['a|b', 'c'], 0.05)
+
+        self.assertEqual(result[['cluster_a', 'cluster_b']].values.tolist(), [['a|b', 'a|b'], ['a|b', 'c']])
+
+    def test_write_tsv_gz(self):
+        result = long_results.build_long_results(self.pvalues, self.means, ['x', 'y'], 0.05)
+
+        with tempfile.TemporaryDirectory() as output_path:
+            file = long_results.write_long_results(result, 'significant_interactions', output_path, 'tsv.gz')
+
+            self.assertEqual(file, os.path.join(output_path, 'significant_interactions.tsv.gz'))
+            pd.testing.assert_frame_equal(pd.read_csv(file, sep='\t'), result)
+
+    def test_invalid_format(self):
+        with self.assertRaises(WriteFileException):
+            long_results.check_format('xlsx')
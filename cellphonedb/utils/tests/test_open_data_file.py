@@ -1,9 +1,13 @@
 from unittest import TestCase
 
 import os
+import tempfile
 
+import numpy as np
 import pandas as pd
+from scipy import io as scipy_io, sparse
 
+from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
 from cellphonedb.utils import utils
 
 
@@ -18,6 +22,80 @@ class TestOpenDataFile(TestCase):
     def test_custom(self):
         self.assert_open_file('example_data_custom', 'csv', False, ';')
 
+    def test_index_filter(self):
+        fixtures_dir = '{}/fixtures'.format(self.current_dir)
+        for extension in ['csv', 'tsv', 'txt']:
+            result = utils.read_data_table_from_file('{}/example_data.{}'.format(fixtures_dir, extension),
+                                                     index_column_first=True, index_filter=['4', '22', '99'])
+            expected_result = pd.read_csv('{}/example_data.csv'.format(fixtures_dir), index_col=0).loc[[4, 22]]
+
+            self.assertTrue(result.equals(expected_result))
+
+    def test_sparse_counts(self):
+        counts = pd.DataFrame([[0.0, 1.5, 0.0], [2.0, 0.0, 0.0]], index=['gene_1', 'gene_2'],
+                              columns=['cell_1', 'cell_2', 'cell_3'])
+
+        with tempfile.TemporaryDirectory() as counts_dir:
+            pd.Series(counts.index).to_csv('{}/features.tsv'.format(counts_dir), index=False, header=False)
+            pd.Series(counts.columns).to_csv('{}/barcodes.tsv.gz'.format(counts_dir), index=False, header=False)
+
+            scipy_io.mmwrite('{}/matrix.mtx'.format(counts_dir), sparse.csr_matrix(counts.values))
+            sparse.save_npz('{}/matrix.npz'.format(counts_dir), sparse.csr_matrix(counts.values))
+
+            for counts_filename in ['matrix.mtx', 'matrix.npz']:
+                result = utils.read_data_table_from_file('{}/{}'.format(counts_dir, counts_filename))
+                self.assertTrue(result.to_dataframe().equals(counts.astype(np.float32)))
+
+            result = utils.read_data_table_from_file('{}/matrix.mtx'.format(counts_dir)).filter_genes(['gene_2'])
+            self.assertTrue(result.to_dataframe().equals(counts.loc[['gene_2']].astype(np.float32)))
+
+            # Genes names can't be read from a features file with only the genes ids
+            with self.assertRaises(ParseCountsException):
+                utils.read_data_table_from_file('{}/matrix.mtx'.format(counts_dir), counts_data='gene_name')
+
+    def test_sparse_counts_genes_names(self):
+        counts = pd.DataFrame([[0.0, 1.5], [2.0, 0.0]], index=['ENSG01', 'ENSG02'], columns=['cell_1', 'cell_2'])
+        features = pd.DataFrame({'id': counts.index, 'name': ['GENE1', 'GENE2'], 'type': 'Gene Expression'})
+
+        with tempfile.TemporaryDirectory() as counts_dir:
+            features.to_csv('{}/features.tsv.gz'.format(counts_dir), sep='\t', index=False, header=False)
+            pd.Series(counts.columns).to_csv('{}/barcodes.tsv'.format(counts_dir), index=False, header=False)
+            scipy_io.mmwrite('{}/matrix.mtx'.format(counts_dir), sparse.csr_matrix(counts.values))
+
+            for counts_data, genes in [('ensembl', ['ENSG01', 'ENSG02']), ('gene_name', ['GENE1', 'GENE2']),
+                                       ('hgnc_symbol', ['GENE1', 'GENE2'])]:
+                result = utils.read_data_table_from_file('{}/matrix.mtx'.format(counts_dir), counts_data=counts_data)
+                self.assertEqual(result.index.tolist(), genes)
+
+    def test_10x_h5_counts(self):
+        try:
+            import h5py
+        except ImportError:
+            self.skipTest('h5py not installed')
+
+        counts = pd.DataFrame([[0.0, 1.0, 0.0], [2.0, 0.0, 3.0]], index=['gene_1', 'gene_2'],
+                              columns=['cell_1', 'cell_2', 'cell_3'])
+        matrix = sparse.csc_matrix(counts.values)
+
+        with tempfile.TemporaryDirectory() as counts_dir:
+            counts_filename = '{}/counts.h5'.format(counts_dir)
+            with h5py.File(counts_filename, 'w') as f:
+                group = f.create_group('matrix')
+                group['data'] = matrix.data
+                group['indices'] = matrix.indices
+                group['indptr'] = matrix.indptr
+                group['shape'] = np.array(matrix.shape)
+                group['barcodes'] = np.array(counts.columns, dtype='S')
+                features = group.create_group('features')
+                features['id'] = np.array(counts.index, dtype='S')
+                features['name'] = np.array(['GENE1', 'GENE2'], dtype='S')
+
+            result = utils.read_data_table_from_file(counts_filename)
+            names_result = utils.read_data_table_from_file(counts_filename, counts_data='hgnc_symbol')
+
+        self.assertTrue(result.to_dataframe().equals(counts.astype(np.float32)))
+        self.assertEqual(names_result.index.tolist(), ['GENE1', 'GENE2'])
+
     def assert_open_file(self, base_name, extension, index_column_first, separator):
         fixtures_dir = '{}/fixtures'.format(self.current_dir)
         result = utils.read_data_table_from_file('{}/{}.{}'.format(fixtures_dir, base_name, extension),
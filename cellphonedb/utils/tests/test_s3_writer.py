@@ -0,0 +1,98 @@
+import gzip
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cellphonedb.utils import s3_writer
+
+
+class LocalS3Client:
+    """
+    S3 client stand-in that stores the objects in a local folder
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.uploads = {}
+        self.aborted = []
+
+    def put_object(self, Body: bytes, Bucket: str, Key: str):
+        self._write(Bucket, Key, Body)
+
+    def create_multipart_upload(self, Bucket: str, Key: str):
+        upload_id = 'upload_{}'.format(len(self.uploads))
+        self.uploads[upload_id] = {}
+
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, UploadId: str, PartNumber: int):
+        if PartNumber > 2 and Key.startswith('failing'):
+            raise IOError('Connection lost')
+
+        self.uploads[UploadId][PartNumber] = Body
+
+        return {'ETag': '"{}"'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict):
+        parts = self.uploads.pop(UploadId)
+        self._write(Bucket, Key, b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts']))
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+    def read(self, bucket: str, key: str) -> bytes:
+        with open(os.path.join(self.path, bucket, key), 'rb') as f:
+            return f.read()
+
+    def _write(self, bucket: str, key: str, body: bytes):
+        os.makedirs(os.path.join(self.path, bucket), exist_ok=True)
+        with open(os.path.join(self.path, bucket, key), 'wb') as f:
+            f.write(body)
+
+
+class TestS3Writer(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.s3_client = LocalS3Client(self.temp_dir.name)
+
+        random_state = np.random.RandomState(0)
+        self.data = pd.DataFrame(random_state.rand(500, 6).round(3), columns=['c{}'.format(i) for i in range(6)])
+        self.data.insert(0, 'interacting_pair', ['pair_{}'.format(i) for i in range(500)])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_write_multipart(self):
+        s3_writer.write_dataframe(self.s3_client, self.data, 'bucket', 'means.txt', chunk_rows=37, part_size=1024)
+
+        result = pd.read_csv(io.BytesIO(self.s3_client.read('bucket', 'means.txt')), sep='\t')
+
+        self.assertTrue(result.equals(self.data))
+        self.assertEqual(self.s3_client.uploads, {})
+
+    def test_write_compressed(self):
+        s3_writer.write_dataframe(self.s3_client, self.data, 'bucket', 'means.txt.gz', compress=True, chunk_rows=37,
+                                  part_size=1024)
+
+        result = pd.read_csv(io.BytesIO(gzip.decompress(self.s3_client.read('bucket', 'means.txt.gz'))), sep='\t')
+
+        self.assertTrue(result.equals(self.data))
+
+    def test_write_small_and_empty(self):
+        s3_writer.write_dataframe(self.s3_client, self.data.iloc[:0], 'bucket', 'empty.txt')
+
+        self.assertEqual(self.s3_client.read('bucket', 'empty.txt').decode('utf-8'),
+                         '\t'.join(self.data.columns) + '\n')
+
+    def test_failed_upload_aborted(self):
+        with self.assertRaises(IOError):
+            s3_writer.write_dataframe(self.s3_client, self.data, 'bucket', 'failing.txt', chunk_rows=37,
+                                      part_size=1024)
+
+        self.assertEqual(self.s3_client.aborted, ['failing.txt'])
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, 'bucket', 'failing.txt')))
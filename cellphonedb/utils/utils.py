@@ -1,23 +1,50 @@
 import io
 import os
 import pickle
-from typing import TextIO, Optional
+from typing import TextIO, Optional, Union
 
+import numpy as np
 import pandas as pd
+from scipy import io as scipy_io, sparse
 from werkzeug.datastructures import FileStorage
 
 from cellphonedb.src.app.app_logger import app_logger
 from cellphonedb.src.app.cellphonedb_app import output_dir
+from cellphonedb.src.core.utils.sparse_counts import SparseCounts
 
 from cellphonedb.src.exceptions.NotADataFrameException import NotADataFrameException
+from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
 from cellphonedb.src.exceptions.ReadFileException import ReadFileException
 from cellphonedb.src.exceptions.ReadFromPickleException import ReadFromPickleException
+from cellphonedb.utils import binary_counts
+
+# Column of the genes identifiers of every counts data in 10x features.tsv/genes.tsv files (id, name, feature type)
+FEATURES_COLUMNS = {'ensembl': 0, 'gene_name': 1, 'hgnc_symbol': 1}
 
 
 def read_data_table_from_file(file: str, index_column_first: bool = False, separator: str = '',
-                              dtype=None, na_values=None, compression=None) -> pd.DataFrame:
+                              dtype=None, na_values=None, compression=None,
+                              index_filter: Optional[list] = None,
+                              counts_data: str = 'ensembl') -> Union[pd.DataFrame, SparseCounts]:
+    """
+    If index_filter is set, only the rows whose first column is in it are read (the other rows are not parsed).
+
+    The genes of sparse counts are identified by their counts_data (ensembl, gene_name or hgnc_symbol).
+    """
     filename, file_extension = os.path.splitext(file)
 
+    if file_extension == binary_counts.EXTENSION:
+        return binary_counts.read_binary_counts(file, index_filter)
+
+    sparse_readers = {'.mtx': _read_mtx_counts, '.npz': _read_npz_counts, '.h5': _read_10x_h5_counts,
+                      '.hdf5': _read_10x_h5_counts}
+    sparse_extension = '.mtx' if file.endswith('.mtx.gz') else file_extension
+    if sparse_extension in sparse_readers:
+        counts = sparse_readers[sparse_extension](file, counts_data)
+        if index_filter is not None:
+            counts = counts.filter_genes(index_filter)
+        return counts
+
     if file_extension == '.pickle':
         try:
             with open(file, 'rb') as f:
@@ -37,6 +64,11 @@ def read_data_table_from_file(file: str, index_column_first: bool = False, separ
         raise ReadFileException(file)
     else:
         with f:
+            if index_filter is not None and compression is None:
+                # counts_reader reads its text counts through this module
+                from cellphonedb.utils import counts_reader
+                header = f.readline()
+                f = io.StringIO(header + ''.join(counts_reader.filter_lines(f, separator, set(index_filter))))
             return _read_data(f, separator, index_column_first, dtype, na_values, compression)
 
 
@@ -48,8 +80,12 @@ def read_data_from_content_type(file: FileStorage, index_column_first: bool = Fa
 
 
 def read_data_from_s3_object(s3_object: dict, s3_name: str, index_column_first: bool = False, separator: str = '',
-                             dtype=None, na_values=None) -> pd.DataFrame:
+                             dtype=None, na_values=None, index_filter: Optional[list] = None) -> pd.DataFrame:
     filename, file_extension = os.path.splitext(s3_name)
+
+    if file_extension == binary_counts.EXTENSION:
+        return binary_counts.read_binary_counts_stream(s3_object['Body'], index_filter)
+
     if not separator:
         separator = _get_separator(file_extension)
         bytestream = io.BytesIO(s3_object['Body'].read())
@@ -92,6 +128,101 @@ def _read_data(file_stream: TextIO, separator: str, index_column_first: bool, dt
                        na_values=na_values, compression=compression)
 
 
+def _read_mtx_counts(file: str, counts_data: str = 'ensembl') -> SparseCounts:
+    """
+    Reads a Matrix Market genes x cells matrix. Genes and cells are read from the features.tsv (or genes.tsv) and
+    barcodes.tsv files (optionally gzipped) in the same directory, as written by 10x Cell Ranger.
+    """
+    try:
+        matrix = scipy_io.mmread(file)
+    except Exception:
+        raise ReadFileException(file)
+
+    genes, cells = _read_features_barcodes(os.path.dirname(file), counts_data)
+
+    return SparseCounts(matrix, genes, cells)
+
+
+def _read_npz_counts(file: str, counts_data: str = 'ensembl') -> SparseCounts:
+    """
+    Reads a genes x cells matrix saved with scipy.sparse.save_npz. Genes and cells are read from the features.tsv
+    (or genes.tsv) and barcodes.tsv files in the same directory.
+    """
+    try:
+        matrix = sparse.load_npz(file)
+    except Exception:
+        raise ReadFileException(file)
+
+    genes, cells = _read_features_barcodes(os.path.dirname(file), counts_data)
+
+    return SparseCounts(matrix, genes, cells)
+
+
+def _read_10x_h5_counts(file: str, counts_data: str = 'ensembl') -> SparseCounts:
+    """
+    Reads a 10x Cell Ranger HDF5 feature-barcode matrix (v3 'matrix' group or the v2 genome group).
+    Genes are identified by their feature id (ensembl) or by their feature name (gene_name and hgnc_symbol).
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ReadFileException('{}: h5py is required to read HDF5 counts'.format(file))
+
+    try:
+        with h5py.File(file, 'r') as f:
+            if 'matrix' in f:
+                group = f['matrix']
+                genes_dataset = group['features'].get(['id', 'name'][FEATURES_COLUMNS[counts_data]])
+            else:
+                group = f[list(f.keys())[0]]
+                genes_dataset = group.get(['genes', 'gene_names'][FEATURES_COLUMNS[counts_data]])
+
+            genes = genes_dataset[:] if genes_dataset is not None else None
+
+            matrix = sparse.csc_matrix((group['data'][:], group['indices'][:], group['indptr'][:]),
+                                       shape=group['shape'][:])
+            cells = group['barcodes'][:]
+    except Exception:
+        raise ReadFileException(file)
+
+    if genes is None:
+        raise _missing_genes_exception(file, counts_data)
+
+    return SparseCounts(matrix, _decode(genes), _decode(cells))
+
+
+def _read_features_barcodes(path: str, counts_data: str = 'ensembl') -> (list, list):
+    features_file = _find_file(path, ['features.tsv', 'genes.tsv'])
+    barcodes_file = _find_file(path, ['barcodes.tsv'])
+
+    features = pd.read_csv(features_file, sep='\t', header=None, dtype=str)
+    if FEATURES_COLUMNS[counts_data] >= len(features.columns):
+        raise _missing_genes_exception(features_file, counts_data)
+
+    genes = features[FEATURES_COLUMNS[counts_data]]
+    cells = pd.read_csv(barcodes_file, sep='\t', header=None, usecols=[0], dtype=str)[0]
+
+    return genes.tolist(), cells.tolist()
+
+
+def _missing_genes_exception(file: str, counts_data: str) -> ParseCountsException:
+    return ParseCountsException('{} has no {} genes identifiers'.format(file, counts_data),
+                                'Use the counts data of the features ids (ensembl) or add the genes names')
+
+
+def _find_file(path: str, names: list) -> str:
+    for name in names:
+        for candidate in [name, '{}.gz'.format(name)]:
+            if os.path.exists(os.path.join(path, candidate)):
+                return os.path.join(path, candidate)
+
+    raise ReadFileException(os.path.join(path, names[0]))
+
+
+def _decode(values: np.ndarray) -> list:
+    return [value.decode() if isinstance(value, bytes) else str(value) for value in values]
+
+
 def _get_separator(mime_type_or_extension: str) -> str:
     extensions = {
         '.csv': ',',
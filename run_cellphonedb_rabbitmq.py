@@ -1,25 +1,34 @@
 #!/usr/bin/env python3
 
-import io
+import collections
 import json
+import math
+import multiprocessing
 import os
+import resource
+import shutil
 import sys
 import tempfile
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from distutils.util import strtobool
 from functools import wraps
 from logging import INFO
-from typing import Callable
+from typing import Callable, Optional
 
 import boto3
+import botocore.config
 import pandas as pd
 import pika
 
 from cellphonedb.src.app import cpdb_app
+from cellphonedb.src.core.database import analysis_bundle
 from cellphonedb.src.core.exceptions.AllCountsFilteredException import AllCountsFilteredException
 from cellphonedb.src.core.exceptions.EmptyResultException import EmptyResultException
 from cellphonedb.src.core.exceptions.ThresholdValueException import ThresholdValueException
+from cellphonedb.src.core.methods.cpdb_statistical_analysis_helper import PERMUTATION_BATCH_SIZE
+from cellphonedb.src.core.preprocessors import method_preprocessors
 from cellphonedb.src.core.utils.subsampler import Subsampler
 from cellphonedb.src.database.manager.DatabaseVersionManager import list_local_versions, find_database_for
 from cellphonedb.src.exceptions.ParseCountsException import ParseCountsException
@@ -27,7 +36,7 @@ from cellphonedb.src.exceptions.ParseMetaException import ParseMetaException
 from cellphonedb.src.exceptions.PlotException import PlotException
 from cellphonedb.src.exceptions.ReadFileException import ReadFileException
 from cellphonedb.src.plotters.r_plotter import dot_plot, heatmaps_plot
-from cellphonedb.utils import utils
+from cellphonedb.utils import utils, counts_reader, s3_writer
 from rabbit_logger import RabbitAdapter, RabbitLogger
 
 rabbit_logger = RabbitLogger()
@@ -51,6 +60,9 @@ except KeyError as e:
     exit(1)
 
 verbose = bool(strtobool(os.getenv('VERBOSE', 'true')))
+s3_gzip_results = bool(strtobool(os.getenv('S3_GZIP_RESULTS', 'false')))
+s3_max_pool_connections = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 10))
+s3_clients = {}
 
 if verbose:
     rabbit_logger.setLevel(INFO)
@@ -82,42 +94,54 @@ def create_rabbit_connection():
     ))
 
 
-s3_resource = boto3.resource('s3', aws_access_key_id=s3_access_key,
-                             aws_secret_access_key=s3_secret_key,
-                             endpoint_url=s3_endpoint)
+def get_s3_client():
+    """
+    Returns the S3 client of this process. Clients are pooled and thread safe, but they can't be shared with forked job
+    processes, so every process creates its own one.
+    """
+    pid = os.getpid()
 
-s3_client = boto3.client('s3', aws_access_key_id=s3_access_key,
-                         aws_secret_access_key=s3_secret_key,
-                         endpoint_url=s3_endpoint)
+    if pid not in s3_clients:
+        s3_clients.clear()
+        s3_clients[pid] = boto3.client('s3', aws_access_key_id=s3_access_key,
+                                       aws_secret_access_key=s3_secret_key,
+                                       endpoint_url=s3_endpoint,
+                                       config=botocore.config.Config(max_pool_connections=s3_max_pool_connections))
+
+    return s3_clients[pid]
 
 
 def read_data_from_s3(filename: str, s3_bucket_name: str, index_column_first: bool):
-    s3_object = s3_client.get_object(Bucket=s3_bucket_name, Key=filename)
+    s3_object = get_s3_client().get_object(Bucket=s3_bucket_name, Key=filename)
     return utils.read_data_from_s3_object(s3_object, filename, index_column_first=index_column_first)
 
 
+def read_counts_from_s3(filename: str, s3_bucket_name: str, counts_genes: Optional[list]):
+    return counts_reader.read_counts_from_s3(get_s3_client(), s3_bucket_name, filename, index_filter=counts_genes)
+
+
 def write_data_in_s3(data: pd.DataFrame, filename: str):
-    result_buffer = io.StringIO()
-    data.to_csv(result_buffer, index=False, sep='\t')
-    result_buffer.seek(0)
+    s3_writer.write_dataframe(get_s3_client(), data, s3_bucket_name, filename, compress=s3_gzip_results)
 
-    # TODO: Find more elegant solution (connexion closes after timeout)
-    s3_client = boto3.client('s3', aws_access_key_id=s3_access_key,
-                             aws_secret_access_key=s3_secret_key,
-                             endpoint_url=s3_endpoint)
 
-    s3_client.put_object(Body=result_buffer.getvalue().encode('utf-8'), Bucket=s3_bucket_name, Key=filename)
+def write_results_in_s3(results: dict):
+    """
+    Uploads the result tables ({filename: data}) in parallel
+    """
+    with ThreadPoolExecutor(max_workers=len(results)) as executor:
+        uploads = [executor.submit(write_data_in_s3, data, filename) for filename, data in results.items()]
 
+        for upload in uploads:
+            upload.result()
 
-def write_image_to_s3(path: str, filename: str):
-    _io = open(path, 'rb')
 
-    # TODO: Find more elegant solution (connexion closes after timeout)
-    s3_client = boto3.client('s3', aws_access_key_id=s3_access_key,
-                             aws_secret_access_key=s3_secret_key,
-                             endpoint_url=s3_endpoint)
+def result_filename(filename: str) -> str:
+    return '{}.gz'.format(filename) if s3_gzip_results else filename
 
-    s3_client.put_object(Body=_io, Bucket=s3_bucket_name, Key=filename)
+
+def write_image_to_s3(path: str, filename: str):
+    with open(path, 'rb') as _io:
+        get_s3_client().put_object(Body=_io, Bucket=s3_bucket_name, Key=filename)
 
 
 @_track_success
@@ -213,8 +237,8 @@ def heatmaps_plot_results(meta: str, pvalues: str, pvalue: float, job_id: str):
 
 
 def _from_s3_to_temp(key, file):
-    data = s3_client.get_object(Bucket=s3_bucket_name, Key=key)
-    file.write(data['Body'].read())
+    data = get_s3_client().get_object(Bucket=s3_bucket_name, Key=key)
+    shutil.copyfileobj(data['Body'], file, length=1 << 20)
     file.seek(0)
 
     return file
@@ -259,19 +283,16 @@ def process_method(method, properties, body, logger) -> dict:
     job_id = metadata['job_id']
     logger.info('New Job Queued')
     meta = read_data_from_s3(metadata['file_meta'], s3_bucket_name, index_column_first=False)
-    counts = read_data_from_s3(metadata['file_counts'], s3_bucket_name, index_column_first=True)
 
     subsampler = Subsampler(bool(metadata['log']),
                             int(metadata['num_pc']),
                             int(metadata['num_cells']) if metadata.get('num_cells', False) else None
                             ) if metadata.get('subsampling', False) else None
 
-    database_version = metadata.get('database_version', 'latest')
+    app = get_app(job_database_version(metadata))
 
-    if database_version not in list_local_versions() + ['latest']:
-        database_version = 'latest'
-
-    app = cpdb_app.create_app(verbose=verbose, database_file=find_database_for(database_version))
+    counts_genes = app.method.get_counts_genes(metadata.get('counts_data', 'ensembl')) if subsampler is None else None
+    counts = read_counts_from_s3(metadata['file_counts'], s3_bucket_name, counts_genes)
 
     if metadata['iterations']:
         response = statistical_analysis(app, meta, counts, job_id, metadata, subsampler)
@@ -283,6 +304,8 @@ def process_method(method, properties, body, logger) -> dict:
 
 @_track_success
 def statistical_analysis(app, meta, counts, job_id, metadata, subsampler):
+    clusters = method_preprocessors.meta_preprocessor(meta.copy())['cell_type'].nunique()
+
     pvalues, means, significant_means, deconvoluted = \
         app.method.cpdb_statistical_analysis_launcher(meta,
                                                       counts,
@@ -290,7 +313,7 @@ def statistical_analysis(app, meta, counts, job_id, metadata, subsampler):
                                                       threshold=float(metadata['threshold']),
                                                       iterations=int(metadata['iterations']),
                                                       debug_seed=-1,
-                                                      threads=4,
+                                                      threads=job_threads(int(metadata['iterations']), clusters),
                                                       result_precision=int(metadata['result_precision']),
                                                       pvalue=float(metadata.get('pvalue', 0.05)),
                                                       subsampler=subsampler,
@@ -298,17 +321,17 @@ def statistical_analysis(app, meta, counts, job_id, metadata, subsampler):
     response = {
         'job_id': job_id,
         'files': {
-            'pvalues': 'pvalues_simple_{}.txt'.format(job_id),
-            'means': 'means_simple_{}.txt'.format(job_id),
-            'significant_means': 'significant_means_simple_{}.txt'.format(job_id),
-            'deconvoluted': 'deconvoluted_simple_{}.txt'.format(job_id),
+            'pvalues': result_filename('pvalues_simple_{}.txt'.format(job_id)),
+            'means': result_filename('means_simple_{}.txt'.format(job_id)),
+            'significant_means': result_filename('significant_means_simple_{}.txt'.format(job_id)),
+            'deconvoluted': result_filename('deconvoluted_simple_{}.txt'.format(job_id)),
         },
         'success': True
     }
-    write_data_in_s3(pvalues, response['files']['pvalues'])
-    write_data_in_s3(means, response['files']['means'])
-    write_data_in_s3(significant_means, response['files']['significant_means'])
-    write_data_in_s3(deconvoluted, response['files']['deconvoluted'])
+    write_results_in_s3({response['files']['pvalues']: pvalues,
+                         response['files']['means']: means,
+                         response['files']['significant_means']: significant_means,
+                         response['files']['deconvoluted']: deconvoluted})
     return response
 
 
@@ -325,89 +348,270 @@ def non_statistical_analysis(app, meta, counts, job_id, metadata, subsampler):
     response = {
         'job_id': job_id,
         'files': {
-            'means': 'means_simple_{}.txt'.format(job_id),
-            'significant_means': 'significant_means_{}.txt'.format(job_id),
-            'deconvoluted': 'deconvoluted_simple_{}.txt'.format(job_id),
+            'means': result_filename('means_simple_{}.txt'.format(job_id)),
+            'significant_means': result_filename('significant_means_{}.txt'.format(job_id)),
+            'deconvoluted': result_filename('deconvoluted_simple_{}.txt'.format(job_id)),
         },
         'success': True
     }
-    write_data_in_s3(means, response['files']['means'])
-    write_data_in_s3(significant_means, response['files']['significant_means'])
-    write_data_in_s3(deconvoluted, response['files']['deconvoluted'])
+    write_results_in_s3({response['files']['means']: means,
+                         response['files']['significant_means']: significant_means,
+                         response['files']['deconvoluted']: deconvoluted})
     return response
 
 
-consume_more_jobs = True
+def job_database_version(metadata: dict) -> str:
+    database_version = metadata.get('database_version', 'latest')
 
-credentials = pika.PlainCredentials(rabbit_user, rabbit_password)
-connection = create_rabbit_connection()
-channel = connection.channel()
-channel.basic_qos(prefetch_count=1)
-
-jobs_runned = 0
-
-while jobs_runned < 3 and consume_more_jobs:
-    job = channel.basic_get(queue=jobs_queue_name, no_ack=True)
-
-    if all(job):
-        job_id = json.loads(job[2].decode('utf-8'))['job_id']
-        job_logger = logger_for_job(job_id)
-        try:
-            if queue_type == 'plot':
-                job_response = process_plot(*job, logger=job_logger)
-            elif queue_type == 'method':
-                job_response = process_method(*job, logger=job_logger)
-            else:
-                raise Exception('Unknown queue type')
-
-            # TODO: Find more elegant solution
-            connection = create_rabbit_connection()
-            channel = connection.channel()
-            channel.basic_qos(prefetch_count=1)
-
-            channel.basic_publish(exchange='', routing_key=result_queue_name, body=json.dumps(job_response))
-            job_logger.info('JOB PROCESSED')
-        except (ReadFileException, ParseMetaException, ParseCountsException, ThresholdValueException,
-                AllCountsFilteredException, EmptyResultException, PlotException) as e:
-            error_response = {
-                'job_id': job_id,
-                'success': False,
-                'error': {
-                    'id': str(e),
-                    'message': (' {}.'.format(e.description) if hasattr(e, 'description') and e.description else '') +
-                               (' {}.'.format(e.hint) if hasattr(e, 'hint') and e.hint else '')
+    if database_version not in list_local_versions() + ['latest']:
+        database_version = 'latest'
 
-                }
-            }
-            print(traceback.print_exc(file=sys.stdout))
-            job_logger.error('[-] ERROR DURING PROCESSING JOB')
-            if connection.is_closed:
-                connection = create_rabbit_connection()
-                channel = connection.channel()
-                channel.basic_qos(prefetch_count=1)
-            channel.basic_publish(exchange='', routing_key=result_queue_name, body=json.dumps(error_response))
-            job_logger.error(e)
-        except Exception as e:
-            error_response = {
-                'job_id': job_id,
-                'success': False,
-                'error': {
-                    'id': 'unknown_error',
-                    'message': ''
-                }
-            }
-            print(traceback.print_exc(file=sys.stdout))
-            job_logger.error('[-] ERROR DURING PROCESSING JOB')
-            if connection.is_closed:
-                connection = create_rabbit_connection()
-                channel = connection.channel()
-                channel.basic_qos(prefetch_count=1)
-            channel.basic_publish(exchange='', routing_key=result_queue_name, body=json.dumps(error_response))
-            job_logger.error(e)
-
-        jobs_runned += 1
+    return database_version
+
+
+def get_app(database_version: str):
+    """
+    Returns the app of the database version. Apps are kept for the whole worker life, so the database is opened and
+    its analysis bundle loaded only once per version.
+    """
+    database_file = find_database_for(database_version)
+
+    if database_file not in apps:
+        app = cpdb_app.create_app(verbose=verbose, database_file=database_file)
+        warm_app(app)
+        apps[database_file] = app
+
+    return apps[database_file]
+
+
+def warm_app(app) -> None:
+    """
+    Loads the analysis bundle and the cached repository reads in the worker process, so every forked job inherits
+    them instead of loading them again. The database connections are closed before forking: the jobs open their own.
+    """
+    analysis_bundle.get_analysis_bundle(app.database_manager)
+    app.database_manager.get_repository('multidata').get_all_expanded()
+
+    database = app.database_manager.database
+    if database.established_session:
+        database.established_session.close()
+    database.engine.dispose()
+
+
+def job_error_response(job_id: Optional[str], error_id: str, message: str = '') -> dict:
+    return {
+        'job_id': job_id,
+        'success': False,
+        'error': {
+            'id': error_id,
+            'message': message
+        }
+    }
 
+
+def process_job(method, properties, body) -> dict:
+    job_id = json.loads(body.decode('utf-8'))['job_id']
+    job_logger = logger_for_job(job_id)
+    try:
+        if queue_type == 'plot':
+            job_response = process_plot(method, properties, body, logger=job_logger)
+        elif queue_type == 'method':
+            job_response = process_method(method, properties, body, logger=job_logger)
+        else:
+            raise Exception('Unknown queue type')
+
+        job_logger.info('JOB PROCESSED')
+        return job_response
+
+    except (ReadFileException, ParseMetaException, ParseCountsException, ThresholdValueException,
+            AllCountsFilteredException, EmptyResultException, PlotException) as e:
+        error_response = job_error_response(
+            job_id, str(e),
+            (' {}.'.format(e.description) if hasattr(e, 'description') and e.description else '') +
+            (' {}.'.format(e.hint) if hasattr(e, 'hint') and e.hint else ''))
+        print(traceback.print_exc(file=sys.stdout))
+        job_logger.error('[-] ERROR DURING PROCESSING JOB')
+        job_logger.error(e)
+        return error_response
+    except Exception as e:
+        error_response = job_error_response(job_id, 'unknown_error')
+        print(traceback.print_exc(file=sys.stdout))
+        job_logger.error('[-] ERROR DURING PROCESSING JOB')
+        job_logger.error(e)
+        return error_response
+
+
+def start_job(channel, method, properties, body) -> Optional[dict]:
+    """
+    Runs the job in a forked process: it inherits the warm apps of the worker and its CPU time (including the
+    permutation pool processes) is measured on its own. The result is sent back through a pipe.
+
+    The message is parsed and the app of its database created before forking. If any of them fails, the error
+    response is published and the job rejected without requeue, so a bad message never stops the worker.
+    """
+    job_id = None
+    try:
+        metadata = json.loads(body.decode('utf-8'))
+        job_id = metadata['job_id']
+
+        if queue_type == 'method':
+            get_app(job_database_version(metadata))
+
+    except Exception as e:
+        print(traceback.print_exc(file=sys.stdout))
+        rabbit_logger.error('[-] ERROR STARTING JOB {}'.format(job_id))
+        rabbit_logger.error(e)
+
+        channel.basic_publish(exchange='', routing_key=result_queue_name,
+                              body=json.dumps(job_error_response(job_id, 'unknown_error')))
+        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+        return None
+
+    result_reader, result_writer = job_context.Pipe(duplex=False)
+
+    def run():
+        job_response = process_job(method, properties, body)
+        cpu = resource.getrusage(resource.RUSAGE_SELF)
+        children_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_seconds = cpu.ru_utime + cpu.ru_stime + children_cpu.ru_utime + children_cpu.ru_stime
+        # Peak resident memory of the job process and its permutation pool processes (ru_maxrss is in KB)
+        rss_mb = max(cpu.ru_maxrss, children_cpu.ru_maxrss) / 1024
+
+        result_writer.send((job_response, cpu_seconds, rss_mb))
+
+    process = job_context.Process(target=run, daemon=False)
+    process.start()
+    result_writer.close()
+
+    return {'process': process, 'result': result_reader, 'method': method, 'job_id': job_id,
+            'started': time.time()}
+
+
+def finish_job(channel, job: dict) -> Optional[float]:
+    """
+    Publishes the job response. Only successful jobs are acknowledged: failed jobs are rejected without requeue (their
+    error response is published) and jobs whose process died are requeued once.
+
+    Returns the peak resident memory of the job process in MB (None if it died).
+    """
+    method = job['method']
+    job_logger = logger_for_job(job['job_id'])
+
+    try:
+        job_response, cpu_seconds, rss_mb = job['result'].recv()
+    except EOFError:
+        job_response, cpu_seconds, rss_mb = None, None, None
+    job['result'].close()
+    job['process'].join()
+
+    if job_response is None:
+        job_logger.error('[-] JOB PROCESS DIED (exit code {})'.format(job['process'].exitcode))
+        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+        return None
+
+    channel.basic_publish(exchange='', routing_key=result_queue_name, body=json.dumps(job_response))
+
+    if job_response['success']:
+        channel.basic_ack(delivery_tag=method.delivery_tag)
     else:
-        rabbit_logger.debug('Empty queue')
+        channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+
+    job_logger.info('Job finished in {:.1f}s using {:.1f} CPU-seconds and {:.0f} MB'.format(
+        time.time() - job['started'], cpu_seconds, rss_mb))
+
+    return rss_mb
+
+
+def job_threads(iterations: int, clusters: int) -> int:
+    """
+    Threads for the permutations of a job: the permutation batches limit the useful threads and a job gets one
+    thread per JOB_WORK_PER_THREAD iterations x cluster pairs, up to the CPU budget of one slot.
+    """
+    batches = math.ceil(iterations / PERMUTATION_BATCH_SIZE)
+    work = iterations * clusters ** 2
+
+    return max(1, min(slot_threads, batches, math.ceil(work / job_work_per_thread)))
+
+
+def log_worker_status(channel, running_jobs: list) -> None:
+    queue_depth = channel.queue_declare(queue=jobs_queue_name, passive=True).method.message_count
+    rabbit_logger.info('Queue depth: {} Active slots: {}/{}'.format(queue_depth, len(running_jobs), job_slots))
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def should_recycle(jobs_processed: int, job_rss_mb: Optional[float] = None) -> bool:
+    """
+    The worker exits when it reaches MAX_JOBS jobs or MAX_RSS_MB of resident memory (0 disables each limit), so the
+    container restarts it with a clean process. Jobs run in forked processes, so the memory limit is checked against
+    the worker process and the peak memory of the last finished job.
+    """
+    if max_jobs and jobs_processed >= max_jobs:
+        rabbit_logger.info('Recycling worker: {} jobs processed'.format(jobs_processed))
+        return True
+
+    rss_mb = max(current_rss_mb(), job_rss_mb or 0)
+    if max_rss_mb and rss_mb >= max_rss_mb:
+        rabbit_logger.info('Recycling worker: {:.0f} MB of resident memory'.format(rss_mb))
+        return True
+
+    return False
+
+
+def consume_jobs():
+    connection = create_rabbit_connection()
+    channel = connection.channel()
+    channel.basic_qos(prefetch_count=job_slots)
+
+    pending_jobs = collections.deque()
+
+    def on_job(channel, method, properties, body):
+        pending_jobs.append((method, properties, body))
+
+    channel.basic_consume(on_job, queue=jobs_queue_name, no_ack=False)
+
+    running_jobs = []
+    jobs_processed = 0
+    recycle = False
+    while not recycle or running_jobs:
+        connection.process_data_events(time_limit=1)
+
+        for job in [job for job in running_jobs if job['result'].poll() or not job['process'].is_alive()]:
+            running_jobs.remove(job)
+            job_rss_mb = finish_job(channel, job)
+            jobs_processed += 1
+            recycle = recycle or should_recycle(jobs_processed, job_rss_mb)
+            log_worker_status(channel, running_jobs)
+
+        while pending_jobs and not recycle and len(running_jobs) < job_slots:
+            job = start_job(channel, *pending_jobs.popleft())
+            if job is not None:
+                running_jobs.append(job)
+            log_worker_status(channel, running_jobs)
+
+    # Prefetched jobs not acknowledged yet are requeued by the broker
+    connection.close()
+
+
+# Recycle policy
+max_jobs = int(os.getenv('MAX_JOBS', 0))
+max_rss_mb = int(os.getenv('MAX_RSS_MB', 0))
+
+# Concurrent jobs and CPU budget shared by them: each slot gets an equal share of the budget
+job_slots = int(os.getenv('JOB_SLOTS', 1))
+cpu_budget = int(os.getenv('CPU_BUDGET', os.cpu_count() or 1))
+slot_threads = max(1, cpu_budget // job_slots)
+job_work_per_thread = int(os.getenv('JOB_WORK_PER_THREAD', 20000))
+
+job_context = multiprocessing.get_context('fork')
+credentials = pika.PlainCredentials(rabbit_user, rabbit_password)
+apps = {}
 
-    time.sleep(1)
+if __name__ == '__main__':
+    consume_jobs()
@@ -34,6 +34,8 @@ setup(
         'geosketch==0.3',
         'rpy2>=3.0.4,<3.0.99',
         'tqdm>=4.32,<4.32.99',
-        'cython>=0.29,<0.29.99'
+        'cython>=0.29,<0.29.99',
+        'scipy>=1.3,<1.3.99',
+        'numpy>=1.17,<1.17.99'
     ],
 )